@@ -143,6 +143,11 @@ def login():
     if not user.is_active:
         return jsonify({"erro": "Conta desativada"}), 403
 
+    # Hash antigo com custo menor que o atual: refaz agora que temos a senha em claro
+    if user.precisa_rehash():
+        user.set_password(senha)
+        db.session.commit()
+
     _garantir_vitalicio(user)
 
     ip = _get_ip()
@@ -151,7 +156,7 @@ def login():
     if token_id is None:
         info = user.get_plano_info()
         return jsonify({
-            "erro": f"Limite de {info['max_ips']} dispositivo(s) atingido no plano {info['nome']}. Faca upgrade para mais dispositivos."
+            "erro": f"Limite de {info.max_ips} dispositivo(s) atingido no plano {info.nome}. Faca upgrade para mais dispositivos."
         }), 403
 
     token = create_access_token(identity=str(user.id), additional_claims={"sid": token_id})
@@ -214,10 +219,10 @@ def listar_planos():
             continue
         lista.append({
             "id": key,
-            "nome": info["nome"],
-            "max_ips": info["max_ips"],
-            "valor": info["valor"],
-            "limite_proc": info["limite_proc"],
+            "nome": info.nome,
+            "max_ips": info.max_ips,
+            "valor": info.valor,
+            "limite_proc": info.limite_proc,
         })
     return jsonify({"planos": lista})
 
@@ -398,7 +403,7 @@ def admin_listar_usuarios():
             "id": u.id,
             "email": u.email,
             "plano": u.plano,
-            "plano_nome": u.get_plano_info()["nome"],
+            "plano_nome": u.get_plano_info().nome,
             "is_active": u.is_active,
             "vitalicio": vitalicio,
             "created_at": u.created_at.strftime("%d/%m/%Y"),
@@ -440,7 +445,7 @@ def admin_liberar_acesso():
     db.session.commit()
 
     return jsonify({
-        "mensagem": f"Acesso {PLANOS[plano]['nome']} liberado para {email} por {meses} mes(es)",
+        "mensagem": f"Acesso {PLANOS[plano].nome} liberado para {email} por {meses} mes(es)",
         "usuario": {
             "email": user.email,
             "plano": user.plano,
@@ -537,7 +542,7 @@ def google_login():
     if token_id is None:
         info = user.get_plano_info()
         return jsonify({
-            "erro": f"Limite de {info['max_ips']} dispositivo(s) atingido no plano {info['nome']}."
+            "erro": f"Limite de {info.max_ips} dispositivo(s) atingido no plano {info.nome}."
         }), 403
 
     token = create_access_token(identity=str(user.id), additional_claims={"sid": token_id})
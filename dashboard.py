@@ -53,12 +53,19 @@ import openpyxl
 import requests
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils import get_column_letter
+from flask.json.provider import DefaultJSONProvider
+
+# orjson (opcional): serializacao mais rapida das respostas JSON, com fallback para o json padrao
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from etiquetas_shopee import ProcessadorEtiquetasShopee
-from models import (db, bcrypt, User, Session, WhatsAppContact, Schedule,
+from models import (db, User, Session, WhatsAppContact, Schedule,
                     UpSellerConfig, ExecutionLog, Loja, EmailContact,
                     WhatsAppQueueItem, MarketplaceApiConfig, MarketplaceLoja,
-                    TimeLote, encrypt_value, decrypt_value,
+                    TimeLote, encrypt_value, decrypt_value, sessao_existe,
                     Funcionario, FolhaPagamento, ValeParcela)
 from auth import auth_bp
 from email_utils import enviar_email_com_anexo, enviar_email_com_anexos, smtp_configurado, get_smtp_config
@@ -76,6 +83,26 @@ else:
 app = Flask(__name__, static_folder=os.path.join(_BASE_DIR, 'static'))
 CORS(app)
 
+
+class _OrjsonJSONProvider(DefaultJSONProvider):
+    """jsonify via orjson. Datas, dataclasses e subclasses passam pelo default do Flask
+    (mesmo formato de antes); o que o orjson recusar cai no json padrao."""
+    _OPCOES = (orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+               | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_SUBCLASS) if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        # Formato compacto (o padrao fora do debug): orjson; indentado/outros args: json padrao
+        if kwargs.get("indent") is None and kwargs.get("separators") in (None, (",", ":")):
+            try:
+                return orjson.dumps(obj, default=self.default, option=self._OPCOES).decode("utf-8")
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+
+if orjson is not None:
+    app.json = _OrjsonJSONProvider(app)
+
 # ----------------------------------------------------------------
 # CONFIGURACAO DO APP
 # ----------------------------------------------------------------
@@ -95,6 +122,18 @@ _VOLUME_PATH = os.environ.get('RAILWAY_VOLUME_MOUNT_PATH', os.environ.get('DB_DI
 os.makedirs(_VOLUME_PATH, exist_ok=True)
 app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(_VOLUME_PATH, 'app.db')}"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# SQLite compartilhado entre as threads do Flask e do scheduler: conexoes reaproveitadas
+# pelo pool, espera ate 30s pelo lock de escrita e pre-ping para descartar conexoes mortas.
+# Pool dimensionado para as threads do servidor + scheduler + fila de webhooks (DB_POOL_SIZE).
+# WAL/synchronous sao ligados por conexao em models._sqlite_pragmas.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    "pool_size": int(os.environ.get('DB_POOL_SIZE', '10')),
+    "max_overflow": int(os.environ.get('DB_MAX_OVERFLOW', '20')),
+    "pool_timeout": 30,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+    "connect_args": {"check_same_thread": False, "timeout": 30},
+}
 _WEBVIEW_STORAGE_DIR = os.path.join(_VOLUME_PATH, 'webview_profile')
 os.makedirs(_WEBVIEW_STORAGE_DIR, exist_ok=True)
 
@@ -275,7 +314,6 @@ def _consume_pending_oauth(user_id: int):
 
 # Inicializar extensoes
 db.init_app(app)
-bcrypt.init_app(app)
 jwt = JWTManager(app)
 
 
@@ -331,6 +369,7 @@ def _local_auto_token():
     if not sessao:
         sessao = Session(user_id=user.id, token_id=token_id, ip="127.0.0.1")
         db.session.add(sessao)
+        user.dispositivos = None  # IP pode ser novo: recontar na proxima leitura
         db.session.commit()
     token = create_access_token(
         identity=str(user.id),
@@ -387,6 +426,14 @@ def _migrate_db():
                 conn.execute(sqlalchemy.text("ALTER TABLE users ADD COLUMN smtp_from VARCHAR(200) DEFAULT ''"))
             if 'pasta_avulsas' not in colunas:
                 conn.execute(sqlalchemy.text("ALTER TABLE users ADD COLUMN pasta_avulsas VARCHAR(500) DEFAULT ''"))
+            if 'dispositivos' not in colunas:
+                conn.execute(sqlalchemy.text('ALTER TABLE users ADD COLUMN dispositivos INTEGER'))
+                # Backfill unico: IPs distintos ja registrados
+                if 'sessions' in inspector.get_table_names():
+                    conn.execute(sqlalchemy.text(
+                        'UPDATE users SET dispositivos = '
+                        '(SELECT COUNT(DISTINCT ip) FROM sessions WHERE sessions.user_id = users.id)'
+                    ))
 
     # Migrar tabela lojas
     if 'lojas' in inspector.get_table_names():
@@ -507,10 +554,21 @@ def _migrate_db():
             if 'oauth_pending_at' not in cols_mkt:
                 conn.execute(sqlalchemy.text("ALTER TABLE marketplace_api_config ADD COLUMN oauth_pending_at DATETIME"))
 
+def _criar_indices():
+    """create_all nao cria indices novos em tabelas que ja existem: cria os que faltarem."""
+    for tabela in db.metadata.sorted_tables:
+        for indice in tabela.indexes:
+            try:
+                indice.create(bind=db.engine, checkfirst=True)
+            except Exception as e:
+                print(f"Aviso: falha ao criar indice {indice.name}: {e}")
+
+
 # Criar tabelas
 with app.app_context():
     _migrate_db()
     db.create_all()
+    _criar_indices()
 
 # Inicializar scheduler de automacao
 beka_scheduler.init_app(app)
@@ -591,8 +649,7 @@ def check_session_valid(jwt_header, jwt_payload):
     if not user_id:
         return False
     try:
-        sessao = Session.query.filter_by(user_id=int(user_id), token_id=token_id).first()
-        return sessao is None  # True = bloqueado (sessao nao existe mais)
+        return not sessao_existe(int(user_id), token_id)  # True = bloqueado (sessao nao existe mais)
     except Exception:
         # Se o banco estiver com lock (ex: callback Shopee escrevendo),
         # nao bloquear o token — permitir a request.
@@ -1531,6 +1588,7 @@ def api_escanear_lojas():
                         if not any(l['cnpj'] == cnpj_s for l in lojas):
                             nome_s = proc.get_nome_loja(cnpj_s)
                             lojas.append({"cnpj": cnpj_s, "nome": nome_s})
+            proc.fechar_documentos()
 
         lojas.sort(key=lambda x: x["nome"])
         return jsonify({"lojas": lojas})
@@ -1557,7 +1615,7 @@ def api_processar():
     if not user.pode_processar():
         info = user.get_plano_info()
         return jsonify({
-            "erro": f"Limite de {info['limite_proc']} processamentos/mes atingido. Faca upgrade do plano!"
+            "erro": f"Limite de {info.limite_proc} processamentos/mes atingido. Faca upgrade do plano!"
         }), 403
 
     thread = threading.Thread(
@@ -2997,6 +3055,15 @@ def _executar_processamento(user_id, sem_recorte=True, resumo_sku_somente=False,
                 shutil.rmtree(pasta_saida)
             os.makedirs(pasta_saida, exist_ok=True)
 
+            # Um timestamp por lote; cada pasta de loja e criada uma vez (o Shein reaproveita)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            pastas_criadas = set()
+
+            def _garantir_pasta(pasta):
+                if pasta not in pastas_criadas:
+                    os.makedirs(pasta, exist_ok=True)
+                    pastas_criadas.add(pasta)
+
             estado["_etiquetas_por_cnpj"] = dict(lojas_por_cnpj)
             estado["_proc_config"] = {
                 "largura_pt": proc.LARGURA_PT,
@@ -3038,10 +3105,7 @@ def _executar_processamento(user_id, sem_recorte=True, resumo_sku_somente=False,
                     adicionar_log(estado, f"Processando: {nome_loja} ({n_etiquetas} etiquetas)...", "info")
 
                     pasta_loja = os.path.join(pasta_saida, nome_loja)
-                    if not os.path.exists(pasta_loja):
-                        os.makedirs(pasta_loja)
-
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    _garantir_pasta(pasta_loja)
 
                     # Todas as etiquetas vão no mesmo PDF (regular, cpf e retirada juntas)
                     total_pags = 0
@@ -3154,9 +3218,7 @@ def _executar_processamento(user_id, sem_recorte=True, resumo_sku_somente=False,
 
                 for nome_loja_s, etqs_s in _shein_por_loja.items():
                     pasta_loja_s = os.path.join(pasta_saida, nome_loja_s)
-                    if not os.path.exists(pasta_loja_s):
-                        os.makedirs(pasta_loja_s)
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    _garantir_pasta(pasta_loja_s)
                     caminho_shein = os.path.join(pasta_loja_s, f"shein_{nome_loja_s}_{timestamp}.pdf")
                     total_shein = proc.gerar_pdf_shein(etqs_s, caminho_shein)
 
@@ -3196,6 +3258,7 @@ def _executar_processamento(user_id, sem_recorte=True, resumo_sku_somente=False,
                     resultado_lojas.append(info_shein)
 
                     adicionar_log(estado, f"  Shein {nome_loja_s}: {total_shein} paginas, {n_skus_s} itens, {total_qtd_s} unidades", "success")
+            proc.fechar_documentos()
 
             if estado["agrupamentos"] and resultado_lojas:
                 adicionar_log(estado, "Gerando agrupamentos pre-configurados...", "info")
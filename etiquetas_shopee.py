@@ -14,21 +14,121 @@ Processador de Etiquetas Shopee
 import fitz  # PyMuPDF
 import re
 import os
-import io
+import sys
 import glob
 import zipfile
 import collections
+import threading
 import unicodedata
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from itertools import groupby
 from collections import defaultdict, OrderedDict
 
-# python-barcode para gerar Code128
-import barcode
-from barcode.writer import SVGWriter
-
 # openpyxl para gerar XLSX
 import openpyxl
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
+from openpyxl.cell import WriteOnlyCell
+
+# python-calamine (opcional): leitor XLSX em Rust, usado na leitura quando instalado
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+# PyMuPDF nao e thread-safe: chamadas fitz de threads diferentes sao serializadas
+_FITZ_LOCK = threading.Lock()
+
+
+def _pode_usar_processos():
+    """Pools de processos (fork) so num processo de uma unica thread.
+
+    O dashboard chama estas rotinas de threads do Flask e do scheduler: o fork de um processo
+    com outras threads pode herdar locks travados (logging, pool do SQLAlchemy, _FITZ_LOCK) e
+    o filho trava sem excecao. La a leitura segue em sequencia; o CLI continua em paralelo.
+    """
+    return threading.active_count() == 1
+
+
+# Regex pre-compiladas dos caminhos quentes (XLSX product_info e texto das etiquetas)
+_RE_BLOCO = re.compile(r'\[\d+\]\s*')
+# Campos de um bloco product_info numa unica varredura ("Parent SKU..." vem antes
+# de "SKU..." na alternancia para nao casar o sufixo do campo Parent)
+_RE_FIELDS = re.compile(
+    r'(Parent SKU Reference No\.|SKU Reference No\.|Quantity|Product Name|Variation Name):\s*([^;]+)'
+)
+_RE_DIGITOS = re.compile(r'\d+')
+_RE_PEDIDO = re.compile(r'Pedido[:\s]*\n?([A-Z0-9]{12,20})', re.IGNORECASE)
+_RE_PEDIDO_ORDER_SN = re.compile(r'\n(\d{6}[A-Z0-9]{6,10})\n')
+_RE_TRACKING = re.compile(r'(BR\w{10,20})')
+_RE_TRACKING_BR = re.compile(r'(BR[0-9A-Z]{10,20}BR|BR[0-9A-Z]{10,20})')
+_RE_ORDER_SN = re.compile(r'\b(\d{6}[A-Z0-9]{6,12})\b')
+_RE_NF_EMISSAO = re.compile(r'Emiss.o:\n(\d+)\n')
+_RE_NF = re.compile(r'NF:\s*(\d+)')
+_RE_NF_DATE = re.compile(r'(\d{4,6})\n\d\n\d{2}-\d{2}-\d{4}')
+_RE_CHAVE44 = re.compile(r'(\d{44})')
+# Limpeza do nome do emitente (pasta da loja / nome de arquivo)
+_RE_CNPJ_PREFIX = re.compile(r'^\d[\d.]+\s+')
+_RE_CPF_SUFFIX = re.compile(r'\s+\d{11}$')
+_RE_CORP = re.compile(r'\s+(LTDA|ME|MEI|EPP|EIRELI)\s*$', re.IGNORECASE)
+_RE_INVALID = re.compile(r'[<>:"/\\|?*]')
+
+
+def limpar_nome_emitente(nome_raw):
+    """Limpa o nome do emitente para usar como nome de pasta/arquivo."""
+    # Remove numeros de CNPJ do inicio tipo "34.847.700 "
+    nome = _RE_CNPJ_PREFIX.sub('', nome_raw)
+    # Remove CPF tipo "11543563619"
+    nome = _RE_CPF_SUFFIX.sub('', nome)
+    # Limpa LTDA, MEI, etc
+    nome = _RE_CORP.sub('', nome)
+    # Capitaliza
+    nome = nome.strip().title()
+    # Remove caracteres invalidos para nome de pasta
+    nome = _RE_INVALID.sub('', nome)
+    return nome.strip() or 'Loja_Desconhecida'
+
+
+# Opcoes de gravacao dos PDFs gerados (CPF/Shein): garbage=4 junta fontes e imagens
+# repetidas entre paginas (cada show_pdf_page reembute recursos) e comprime os streams
+_OPCOES_SAVE_PDF = dict(
+    garbage=4, deflate=True, deflate_images=True, deflate_fonts=True,
+    clean=True, use_objstms=1,
+)
+
+# Regex pre-compiladas do fluxo Shein (DANFE, atributos e ordenacao dos resumos)
+_RE_SHEIN_NF = re.compile(r'N[uú]mero:\s*\n?(\d+)', re.IGNORECASE)
+_RE_CNPJ_EMIT = re.compile(r'CNPJ[^:]*:\s*(\d+)')
+_RE_NOME_EMIT = re.compile(r'NOME/RAZ.O SOCIAL[^:]*:\s*(.+)')
+_RE_ITEM_SECAO = re.compile(r'ITEM\s+CONTE.*?QUANT\.\s*\n(.*)', re.DOTALL)
+_RE_ITEM_CODIGO = re.compile(r'^[Il][A-Za-z0-9]{6,}$')
+_RE_ATRIB = re.compile(r'([A-Z][a-z]*/.+)$')
+_RE_PAREN = re.compile(r'\([^)]*\)')
+# Codigo Shein: apos descartar o que nao e ASCII, remove tudo que nao e letra/numero
+# (inclusive '/', espacos e hifens) numa unica passada de str.translate
+_SHEIN_CODE_TRANS = str.maketrans('', '', ''.join(
+    chr(c) for c in range(128) if not chr(c).isalnum()
+))
+_RE_BR_SIZE = re.compile(r'^(.+?)(?:-BR(\d+/?\d*))$')
+_RE_SPLIT_VAR = re.compile(r'[,/]')
+_RE_DIGITS = re.compile(r'(\d+)')
+# Nomes fixos do PDF Shein na pasta de entrada (comparados em minusculas)
+_NOMES_SHEIN = frozenset(('shein crua.pdf', 'shein.pdf'))
+
+
+@lru_cache(maxsize=256)
+def _qtd_int(qtd):
+    """int(float(qtd)) memoizado: poucas quantidades distintas ('1', '2', '1.0'...) se repetem
+    em todos os produtos."""
+    return int(float(qtd))
+
+
+@lru_cache(maxsize=4096)
+def _formatar_chave(chave):
+    """Chave de acesso em grupos de 4 digitos (ex: '3526 0212 ...')."""
+    return ' '.join(chave[i:i + 4] for i in range(0, len(chave), 4))
 
 
 class ProcessadorEtiquetasShopee:
@@ -46,13 +146,23 @@ class ProcessadorEtiquetasShopee:
         self.dados_xml = {}      # nf -> dados completos do XML
         self.cnpj_nome = {}      # cnpj -> nome do emitente (nome limpo)
         self.cnpj_loja = {}      # cnpj -> nome da loja Shopee (extraido do REMETENTE)
+        self._loja_por_nome = None     # indice nome_loja normalizado -> cnpj (ver _cnpj_por_nome_loja)
+        self._loja_por_nome_origem = None
+        self._loja_por_nome_tamanho = 0
         self.fonte_produto = 7   # tamanho da fonte para tabela de produtos (configuravel)
         self.exibicao_produto = 'sku'  # 'sku', 'titulo' ou 'ambos'
         self.dados_xlsx_global = {}    # order_sn -> {produtos, total_itens, total_qtd}
         self.dados_xlsx_tracking = {}  # tracking_number -> order_sn
+        self._tracking_ordenado = []   # chaves de dados_xlsx_tracking ordenadas (indice de prefixo)
         self.dados_lista_global = {}   # chave pedido/tracking -> {produtos, total_itens, total_qtd}
         self.dados_lista_seq_por_pdf = {}  # caminho_pdf -> [dados_pedido em ordem]
         self._easyocr_reader = None    # OCR lazy-load para fallback sem XLSX/XML
+        self._atrib_cache = {}   # atributos Shein -> (modelo, cor, tamanho)
+        self._codigo_cache = {}  # atributos Shein -> codigo limpo
+        self._open_docs = {}     # caminho PDF Shein -> fitz.Document (ver fechar_documentos)
+        # texto do quadrante -> pedido / tracking; so durante um processamento (ver fechar_documentos)
+        self._cache_pedido_texto = {}
+        self._cache_tracking_texto = {}
 
     # ----------------------------------------------------------------
     # LEITURA DOS XMLs
@@ -92,17 +202,7 @@ class ProcessadorEtiquetasShopee:
 
     def _limpar_nome_emitente(self, nome_raw):
         """Limpa o nome do emitente para usar como nome de pasta."""
-        # Remove numeros de CNPJ do inicio tipo "34.847.700 "
-        nome = re.sub(r'^\d[\d.]+\s+', '', nome_raw)
-        # Remove CPF tipo "11543563619"
-        nome = re.sub(r'\s+\d{11}$', '', nome)
-        # Limpa LTDA, MEI, etc
-        nome = re.sub(r'\s+(LTDA|ME|MEI|EPP|EIRELI)\s*$', '', nome, flags=re.IGNORECASE)
-        # Capitaliza
-        nome = nome.strip().title()
-        # Remove caracteres invalidos para nome de pasta
-        nome = re.sub(r'[<>:"/\\|?*]', '', nome)
-        return nome.strip() or 'Loja_Desconhecida'
+        return limpar_nome_emitente(nome_raw)
 
     def _parse_xml(self, conteudo_xml):
         """Extrai dados relevantes do XML da NFe."""
@@ -580,20 +680,44 @@ class ProcessadorEtiquetasShopee:
         print(f"    {len(etiquetas)} etiquetas")
         return etiquetas
 
-    def _extrair_nf_quadrante(self, pagina, clip):
-        """Extrai o numero da NF do texto dentro de um quadrante."""
-        texto = pagina.get_text(clip=clip)
+    @staticmethod
+    def _texto_words_clip(words, clip):
+        """Monta o texto das palavras (get_text("words")) contidas no clip.
 
-        m = re.search(r'Emiss.o:\n(\d+)\n', texto)
+        Equivale a pagina.get_text(clip=clip), mas filtra em Python uma lista
+        de palavras extraida uma unica vez por pagina (evita que o MuPDF
+        reprocesse o content stream a cada clip). Mantem quebras de linha.
+        """
+        x0, y0, x1, y1 = clip.x0, clip.y0, clip.x1, clip.y1
+        linhas = []
+        atual = []
+        chave_atual = None
+        for w in words:
+            if w[0] < x0 or w[2] > x1 or w[1] < y0 or w[3] > y1:
+                continue
+            chave = (w[5], w[6])
+            if chave != chave_atual:
+                if atual:
+                    linhas.append(' '.join(atual))
+                atual = []
+                chave_atual = chave
+            atual.append(w[4])
+        if atual:
+            linhas.append(' '.join(atual))
+        return ''.join(l + '\n' for l in linhas)
+
+    def _extrair_nf_texto(self, texto):
+        """Extrai o numero da NF de um texto de etiqueta (quadrante ou pagina)."""
+        m = _RE_NF_EMISSAO.search(texto)
         if m:
             return m.group(1)
 
         # Padrao alternativo: "NF: 12345" (comum em etiquetas de retirada do comprador)
-        m = re.search(r'NF:\s*(\d+)', texto)
+        m = _RE_NF.search(texto)
         if m:
             return m.group(1)
 
-        m = re.search(r'(\d{4,6})\n\d\n\d{2}-\d{2}-\d{4}', texto)
+        m = _RE_NF_DATE.search(texto)
         if m:
             return m.group(1)
 
@@ -601,7 +725,7 @@ class ProcessadorEtiquetasShopee:
 
     def _extrair_chave_nfe(self, texto):
         """Extrai a chave de acesso da NFe (44 digitos) do texto da etiqueta."""
-        m = re.search(r'(\d{44})', texto)
+        m = _RE_CHAVE44.search(texto)
         return m.group(1) if m else ''
 
     def _extrair_nome_loja_remetente(self, texto):
@@ -693,6 +817,33 @@ class ProcessadorEtiquetasShopee:
         except Exception:
             return None
 
+    def _registrar_loja(self, cnpj, nome_loja):
+        """Grava cnpj -> nome em cnpj_loja mantendo o indice por nome atualizado."""
+        anterior = self.cnpj_loja.get(cnpj)
+        self.cnpj_loja[cnpj] = nome_loja
+        if anterior is not None and anterior != nome_loja:
+            self._loja_por_nome = None  # nome antigo saiu do mapa: reindexar na proxima busca
+        elif anterior is None and self._loja_por_nome is not None:
+            self._loja_por_nome.setdefault(nome_loja.lower().strip(), cnpj)
+            self._loja_por_nome_tamanho += 1
+
+    def _cnpj_por_nome_loja(self, nome_loja):
+        """Retorna o primeiro CNPJ de cnpj_loja cujo nome bate com nome_loja (sem caixa/espacos).
+
+        O indice e refeito se cnpj_loja for substituido (ex.: config do dashboard)
+        ou alterado fora de _registrar_loja.
+        """
+        if (self._loja_por_nome is None
+                or self._loja_por_nome_origem is not self.cnpj_loja
+                or self._loja_por_nome_tamanho != len(self.cnpj_loja)):
+            indice = {}
+            for cnpj, nome in self.cnpj_loja.items():
+                indice.setdefault(nome.lower().strip(), cnpj)
+            self._loja_por_nome = indice
+            self._loja_por_nome_origem = self.cnpj_loja
+            self._loja_por_nome_tamanho = len(self.cnpj_loja)
+        return self._loja_por_nome.get(nome_loja.lower().strip())
+
     def _registrar_loja_sintetica(self, nome_loja, prefixo='LOJA'):
         """Registra loja sintética no mapa CNPJ->nome e retorna a chave."""
         nome_loja = (nome_loja or '').strip()
@@ -700,7 +851,7 @@ class ProcessadorEtiquetasShopee:
             return ''
         cnpj_sintetico = f"{prefixo}_{re.sub(r'[^A-Za-z0-9]', '_', nome_loja)}"
         if cnpj_sintetico not in self.cnpj_loja:
-            self.cnpj_loja[cnpj_sintetico] = nome_loja
+            self._registrar_loja(cnpj_sintetico, nome_loja)
             self.cnpj_nome[cnpj_sintetico] = nome_loja
         return cnpj_sintetico
 
@@ -777,22 +928,21 @@ class ProcessadorEtiquetasShopee:
 
         return unicas, duplicadas
 
-    def _contar_etiquetas_regiao(self, pagina, clip):
-        """Verifica se uma regiao contem uma etiqueta Shopee.
+    def _contar_etiquetas_regiao(self, texto):
+        """Verifica se o texto de uma regiao contem uma etiqueta Shopee.
         Detecta por marcadores: 'Pedido:' ou 'REMETENTE' ou NF numerica.
         """
-        texto = pagina.get_text(clip=clip).strip()
-        if len(texto) < 10:
+        if len(texto.strip()) < 10:
             return False
         # Marcadores de etiqueta Shopee
         tem_pedido = 'Pedido:' in texto or 'Pedido\n' in texto
         tem_remetente = 'REMETENTE' in texto
         tem_danfe = 'DANFE' in texto
-        tem_nf = self._extrair_nf_quadrante(pagina, clip) is not None
+        tem_nf = self._extrair_nf_texto(texto) is not None
         # Basta ter 1 marcador forte ou NF
         return tem_nf or tem_pedido or (tem_remetente and tem_danfe)
 
-    def _detectar_layout_pagina(self, pagina):
+    def _detectar_layout_pagina(self, pagina, words=None):
         """Detecta quantas etiquetas ha na pagina analisando o conteudo.
         Retorna lista de clips (regioes) para recortar.
         Layouts possiveis:
@@ -801,6 +951,7 @@ class ProcessadorEtiquetasShopee:
           - 1 etiqueta (pagina inteira) - fallback
         Deteccao baseada em marcadores de etiqueta (Pedido:, REMETENTE, DANFE), nao apenas NFs.
         Paginas pequenas (<= 420pt largura) sao sempre 1 etiqueta (tamanho de 1 quadrante A4).
+        words: lista de pagina.get_text("words") ja extraida (opcional).
         """
         rect = pagina.rect
         larg = rect.width
@@ -813,6 +964,11 @@ class ProcessadorEtiquetasShopee:
 
         meio_x = larg / 2
         meio_y = alt / 2
+        if words is None:
+            words = pagina.get_text("words")
+
+        def _tem_etiqueta(clip):
+            return self._contar_etiquetas_regiao(self._texto_words_clip(words, clip))
 
         # Testar grid 2x2 primeiro (padrao Shopee)
         quadrantes_2x2 = [
@@ -822,7 +978,7 @@ class ProcessadorEtiquetasShopee:
             fitz.Rect(meio_x, meio_y, larg, alt),
         ]
 
-        etiquetas_2x2 = sum(1 for clip in quadrantes_2x2 if self._contar_etiquetas_regiao(pagina, clip))
+        etiquetas_2x2 = sum(1 for clip in quadrantes_2x2 if _tem_etiqueta(clip))
 
         # Se encontrou 2+ etiquetas no grid 2x2, usar este layout
         if etiquetas_2x2 >= 2:
@@ -834,7 +990,7 @@ class ProcessadorEtiquetasShopee:
             fitz.Rect(0, meio_y, larg, alt),
         ]
 
-        etiquetas_2x1 = sum(1 for clip in quadrantes_2x1 if self._contar_etiquetas_regiao(pagina, clip))
+        etiquetas_2x1 = sum(1 for clip in quadrantes_2x1 if _tem_etiqueta(clip))
 
         if etiquetas_2x1 >= 2:
             return quadrantes_2x1
@@ -930,22 +1086,23 @@ class ProcessadorEtiquetasShopee:
         
         return produtos
 
-    def _detectar_area_tabela_declaracao(self, pag):
+    def _detectar_area_tabela_declaracao(self, pag, textpage=None):
         """Encontra o retangulo da tabela 'IDENTIFICACAO DOS BENS' na pagina de declaracao.
         Retorna fitz.Rect cobrindo desde o cabecalho da tabela ate a linha Total.
+        textpage: TextPage ja extraido da pagina (evita reanalisar a pagina a cada busca).
         """
         try:
             pag_rect = pag.rect
             # Buscar "IDENTIFICAÇÃO DOS BENS" ou variantes
-            rects_id = pag.search_for("IDENTIFICAÇÃO DOS BENS")
+            rects_id = pag.search_for("IDENTIFICAÇÃO DOS BENS", textpage=textpage)
             if not rects_id:
-                rects_id = pag.search_for("IDENTIFICACAO DOS BENS")
+                rects_id = pag.search_for("IDENTIFICACAO DOS BENS", textpage=textpage)
             if not rects_id:
                 # Fallback: buscar cabecalho "SKU"
-                rects_id = pag.search_for("SKU")
+                rects_id = pag.search_for("SKU", textpage=textpage)
 
             # Buscar "Total" (ultima ocorrencia na pagina)
-            rects_total = pag.search_for("Total")
+            rects_total = pag.search_for("Total", textpage=textpage)
 
             if not rects_id:
                 # Nao encontrou cabecalho — retornar terco inferior da pagina como fallback
@@ -1115,12 +1272,17 @@ class ProcessadorEtiquetasShopee:
                 variacao = ' '.join(var_parts) if var_parts else ''
                 # atributos = SKU completo para sorting (compativel com _parsear_atributos_shein)
                 atrib = sku if not variacao else f"{sku}/{variacao}"
+                modelo, cor, tamanho = self._parsear_atributos_shein(atrib)
 
                 produtos.append({
                     'codigo_item': sku,
                     'descricao': '',
                     'atributos': atrib,
                     'qtd': qtd,
+                    'qtd_int': int(qtd),
+                    'modelo': modelo,
+                    'cor': cor,
+                    'tamanho': tamanho,
                 })
             else:
                 i += 1  # linha nao reconhecida, pular
@@ -1128,7 +1290,7 @@ class ProcessadorEtiquetasShopee:
         resultado['produtos_shein'] = produtos
         resultado['total_itens'] = len(produtos)
         if not resultado['total_qtd']:
-            resultado['total_qtd'] = sum(int(p.get('qtd', 1)) for p in produtos)
+            resultado['total_qtd'] = sum(p['qtd_int'] for p in produtos)
 
         return resultado
 
@@ -1166,20 +1328,23 @@ class ProcessadorEtiquetasShopee:
 
     def _recortar_pagina(self, pagina, caminho_pdf):
         """Recorta etiquetas de uma pagina, detectando automaticamente o layout."""
-        quadrantes = self._detectar_layout_pagina(pagina)
+        # Uma unica extracao de palavras por pagina; cada quadrante e filtrado em Python
+        words = pagina.get_text("words")
+        quadrantes = self._detectar_layout_pagina(pagina, words=words)
 
         etiquetas = []
         quadrantes_vazios = 0
         
         for idx, clip in enumerate(quadrantes):
             # Verificar se o quadrante tem conteudo (nao esta vazio)
-            texto_quad = pagina.get_text(clip=clip).strip()
+            texto_quad_bruto = self._texto_words_clip(words, clip)
+            texto_quad = texto_quad_bruto.strip()
             if len(texto_quad) < 10:
                 quadrantes_vazios += 1
                 continue  # Quadrante vazio, pular
 
             # Extrair NF primeiro (necessario para detectar tipo)
-            nf = self._extrair_nf_quadrante(pagina, clip)
+            nf = self._extrair_nf_texto(texto_quad_bruto)
 
             # Detectar tipo de etiqueta (passa nf para distinguir CNPJ vs CPF)
             tipo_etiqueta = self._detectar_tipo_etiqueta(texto_quad, nf_encontrada=nf)
@@ -1207,7 +1372,11 @@ class ProcessadorEtiquetasShopee:
 
             # FONTE PRIMARIA: XLSX (buscar por order_sn ou tracking)
             if self.dados_xlsx_global or self.dados_lista_global:
-                dados_xlsx, chave_dados = self._buscar_dados_xlsx(texto_quad)
+                dados_xlsx, chave_dados = self._buscar_dados_xlsx_por_ids(
+                    order_sn_txt,
+                    self._extrair_tracking_quadrante(texto_quad),
+                    self._extrair_chaves_pedido_texto(texto_quad),
+                )
                 if dados_xlsx:
                     origem_dados = dados_xlsx.get('fonte_dados', 'xlsx')
                     dados_nf = {
@@ -1225,8 +1394,10 @@ class ProcessadorEtiquetasShopee:
                     print(f"    Pag {pagina.number} Q{idx}: Dados {origem_dados} ({chave_dados})")
 
             # FALLBACK: XML (se XLSX nao encontrou produtos) - apenas para CNPJ
-            if tipo_etiqueta == 'cnpj' and not dados_nf.get('produtos') and nf in self.dados_xml:
-                dados_nf = self.dados_xml.get(nf, {})
+            if tipo_etiqueta == 'cnpj' and not dados_nf.get('produtos'):
+                dados_xml_nf = self.dados_xml.get(nf)
+                if dados_xml_nf is not None:
+                    dados_nf = dados_xml_nf
 
             sku = ''
             num_produtos = 1
@@ -1246,7 +1417,7 @@ class ProcessadorEtiquetasShopee:
                     cnpj = self._registrar_loja_sintetica(nome_loja, prefixo=prefixo)
             elif cnpj not in self.cnpj_loja:
                 if nome_loja:
-                    self.cnpj_loja[cnpj] = nome_loja
+                    self._registrar_loja(cnpj, nome_loja)
 
             etiquetas.append({
                 'nf': nf,
@@ -1512,21 +1683,6 @@ class ProcessadorEtiquetasShopee:
         except Exception:
             return None
 
-    # ----------------------------------------------------------------
-    # GERACAO DO CODIGO DE BARRAS
-    # ----------------------------------------------------------------
-    def _gerar_barcode_svg(self, chave):
-        """Gera um codigo de barras Code128 como SVG em bytes."""
-        code128 = barcode.get('code128', chave, writer=SVGWriter())
-        buf = io.BytesIO()
-        code128.write(buf, options={
-            'module_width': 0.2,
-            'module_height': 8,
-            'write_text': False,
-            'quiet_zone': 1,
-        })
-        return buf.getvalue()
-
     # ----------------------------------------------------------------
     # GERACAO DO PDF FINAL (POR LOJA)
     # ----------------------------------------------------------------
@@ -1548,6 +1704,14 @@ class ProcessadorEtiquetasShopee:
         area_util_larg = self.LARGURA_PT - self.MARGEM_ESQUERDA - self.MARGEM_DIREITA
         image_crop_cache = {}
 
+        # Geometria constante durante a geracao (independe da etiqueta).
+        # Nao ha camada estatica a pre-renderizar: cada pagina e so a etiqueta importada
+        # (show_pdf_page ja reaproveita o XObject da pagina de origem) + o numero de ordem.
+        dest_x0 = self.MARGEM_ESQUERDA
+        dest_x1 = self.LARGURA_PT - self.MARGEM_DIREITA
+        dest_y0 = self.MARGEM_TOPO
+        pos_numero = (self.MARGEM_ESQUERDA + 2, self.ALTURA_PT - self.MARGEM_INFERIOR - 8)
+
         com_xml = 0
         sem_xml = 0
 
@@ -1567,8 +1731,9 @@ class ProcessadorEtiquetasShopee:
             )
             pag_principal_idx = len(doc_saida) - 1  # indice da pagina principal
 
-            if render_imagem_meta.get('xref') and render_imagem_meta.get('crop_img'):
-                ix0, iy0, ix1, iy1 = render_imagem_meta.get('crop_img')
+            usa_imagem = bool(render_imagem_meta.get('xref') and render_imagem_meta.get('crop_img'))
+            if usa_imagem:
+                ix0, iy0, ix1, iy1 = render_imagem_meta['crop_img']
                 quad_larg = max(1.0, float(ix1 - ix0))
                 quad_alt = max(1.0, float(iy1 - iy0))
             else:
@@ -1578,21 +1743,15 @@ class ProcessadorEtiquetasShopee:
             alt_etiqueta = quad_alt * escala
 
             # Verificar se tem dados de produto (para contagem).
-            num_prods = len(dados.get('produtos', []))
-            tem_dados_produto = num_prods > 0
+            tem_dados_produto = bool(dados.get('produtos'))
 
             # Manter rodape original do UpSeller: nao encolher a etiqueta,
             # nao mascarar o rodape e nao redesenhar tabela de produtos.
             # A ordenacao por SKU e >1 itens pro final ja foi feita em _ordenar_etiquetas().
 
-            dest_rect = fitz.Rect(
-                self.MARGEM_ESQUERDA,
-                self.MARGEM_TOPO,
-                self.LARGURA_PT - self.MARGEM_DIREITA,
-                self.MARGEM_TOPO + alt_etiqueta
-            )
+            dest_rect = fitz.Rect(dest_x0, dest_y0, dest_x1, dest_y0 + alt_etiqueta)
 
-            if render_imagem_meta.get('xref') and render_imagem_meta.get('crop_img'):
+            if usa_imagem:
                 xref = int(render_imagem_meta['xref'])
                 ix0, iy0, ix1, iy1 = [int(v) for v in render_imagem_meta['crop_img']]
                 key = (pdf_path, xref, ix0, iy0, ix1, iy1)
@@ -1620,7 +1779,7 @@ class ProcessadorEtiquetasShopee:
             # Numero de ordem (subido para nao cortar na impressao)
             try:
                 nova_pag.insert_text(
-                    (self.MARGEM_ESQUERDA + 2, self.ALTURA_PT - self.MARGEM_INFERIOR - 8),
+                    pos_numero,
                     f"p.{numero_ordem}",
                     fontsize=9,
                     fontname="hebo",
@@ -1671,18 +1830,9 @@ class ProcessadorEtiquetasShopee:
 
         y = y_inicio
 
-        # --- Codigo de barras da chave de acesso (so na primeira pagina) ---
+        # --- Respiro no lugar do codigo de barras da chave (so na primeira pagina) ---
         if chave and prod_inicio == 0:
-            try:
-                svg_bytes = self._gerar_barcode_svg(chave)
-                barcode_rect = fitz.Rect(
-                    margem_esq + 5, y,
-                    larg - margem_dir - 5, y + 35
-                )
-                pagina.insert_image(barcode_rect, stream=svg_bytes)
-                y += 37
-            except Exception:
-                y += 5
+            y += 5
 
         # --- Tabela de produtos (layout limpo) ---
         col1_w = 62
@@ -1753,30 +1903,63 @@ class ProcessadorEtiquetasShopee:
     LANIM_CNPJ = 'LANIM_CPF'
     LANIM_NOME = 'CPF'
 
+    @staticmethod
+    def _abrir_linhas_xlsx(caminho):
+        """Abre a primeira planilha de um XLSX para leitura de valores.
+
+        Retorna (linhas, fechar): iterador de linhas (a primeira e o cabecalho)
+        e a funcao que libera o arquivo. Usa python-calamine quando instalado;
+        senao openpyxl em modo read-only. Numeros inteiros vindos como float do
+        calamine sao convertidos para int (mesmo valor que o openpyxl devolve).
+        """
+        if CalamineWorkbook is not None:
+            try:
+                wb_cal = CalamineWorkbook.from_path(caminho)
+                try:
+                    linhas = wb_cal.get_sheet_by_index(0).to_python(skip_empty_area=False)
+                finally:
+                    wb_cal.close()
+                linhas = (
+                    [int(v) if isinstance(v, float) and v.is_integer() else v for v in row]
+                    for row in linhas
+                )
+                return linhas, lambda: None
+            except Exception:
+                pass  # formato nao suportado pelo calamine: tentar openpyxl
+
+        import openpyxl as xl
+        wb = xl.load_workbook(caminho, read_only=True, data_only=True)
+        return wb.active.iter_rows(values_only=True), wb.close
+
     def carregar_xlsx_pedidos(self, caminho_xlsx):
         """Carrega dados de pedidos do XLSX (lanim2.xlsx) para etiquetas CPF.
         Retorna dict: order_sn -> {produtos: [...], total_itens, total_qtd}
         """
-        import openpyxl as xl
-        wb = xl.load_workbook(caminho_xlsx)
-        ws = wb.active
+        linhas, fechar = self._abrir_linhas_xlsx(caminho_xlsx)
+        try:
+            return self._carregar_linhas_pedidos(linhas)
+        finally:
+            fechar()
+
+    def _carregar_linhas_pedidos(self, linhas):
+        """Monta order_sn -> dados a partir das linhas de um XLSX de declaracao."""
         dados_pedidos = {}
 
         # Descobrir indices das colunas pelo cabecalho
         cabecalho = {}
-        for idx, cell in enumerate(ws[1]):
-            if cell.value:
-                cabecalho[str(cell.value).strip().lower()] = idx
+        for idx, valor in enumerate(next(linhas, ())):
+            if valor:
+                cabecalho[str(valor).strip().lower()] = idx
 
         col_order = cabecalho.get('order_sn', None)
         col_info = cabecalho.get('product_info', None)
 
         if col_order is None or col_info is None:
             print("  AVISO: Colunas order_sn ou product_info nao encontradas no XLSX")
-            wb.close()
             return dados_pedidos
 
-        for row in ws.iter_rows(min_row=2, max_col=ws.max_column, values_only=True):
+        chaves_por_pedido = {}  # order_sn -> {(codigo, descricao, variacao)} ja acumulados
+        for row in linhas:
             if row is None or len(row) <= max(col_order, col_info):
                 continue
             order_sn = str(row[col_order] or '').strip()
@@ -1786,102 +1969,73 @@ class ProcessadorEtiquetasShopee:
                 continue
 
             # Parsear product_info: pode ter multiplos blocos [N]
-            produtos = []
-            # Dividir por blocos [N]
-            blocos = re.split(r'\[\d+\]\s*', product_info)
-            for bloco in blocos:
-                if not bloco.strip():
-                    continue
-
-                # Extrair Parent SKU
-                m_sku = re.search(r'Parent SKU Reference No\.:\s*([^;]+)', bloco)
-                codigo = m_sku.group(1).strip() if m_sku else ''
-                # Fallback: SKU Reference No.
-                if not codigo:
-                    m_sku2 = re.search(r'SKU Reference No\.:\s*([^;]+)', bloco)
-                    codigo = m_sku2.group(1).strip() if m_sku2 else ''
-
-                # Extrair quantidade
-                m_qtd = re.search(r'Quantity:\s*(\d+)', bloco)
-                qtd = m_qtd.group(1) if m_qtd else '1'
-
-                # Extrair nome do produto
-                m_nome = re.search(r'Product Name:\s*([^;]+)', bloco)
-                descricao = m_nome.group(1).strip() if m_nome else ''
-
-                # Extrair Variation Name (usado para etiquetas CPF)
-                m_var = re.search(r'Variation Name:\s*([^;]+)', bloco)
-                variacao = m_var.group(1).strip() if m_var else ''
-
-                if codigo or descricao or variacao:
-                    produtos.append({
-                        'codigo': codigo,
-                        'descricao': descricao,
-                        'variacao': variacao,
-                        'qtd': qtd,
-                    })
+            produtos, total_qtd = self._parsear_product_info(product_info)
 
             # Acumular apenas produtos NOVOS se o mesmo order_sn aparecer em multiplas linhas
             if order_sn in dados_pedidos:
-                existentes = dados_pedidos[order_sn]['produtos']
-                chaves_existentes = set()
-                for p in existentes:
-                    chaves_existentes.add((p.get('codigo', ''), p.get('descricao', ''), p.get('variacao', '')))
+                pedido = dados_pedidos[order_sn]
+                existentes = pedido['produtos']
+                chaves_existentes = chaves_por_pedido[order_sn]
                 for p in produtos:
                     chave_p = (p.get('codigo', ''), p.get('descricao', ''), p.get('variacao', ''))
                     if chave_p not in chaves_existentes:
                         existentes.append(p)
                         chaves_existentes.add(chave_p)
-                dados_pedidos[order_sn]['total_itens'] = len(existentes)
-                dados_pedidos[order_sn]['total_qtd'] = sum(
-                    int(float(p.get('qtd', 1))) for p in existentes
-                )
+                        pedido['total_qtd'] += int(float(p.get('qtd', 1)))
+                pedido['total_itens'] = len(existentes)
             else:
-                total_qtd = sum(int(float(p.get('qtd', 1))) for p in produtos)
                 dados_pedidos[order_sn] = {
                     'produtos': produtos,
                     'total_itens': len(produtos),
                     'total_qtd': total_qtd,
                 }
+                chaves_por_pedido[order_sn] = {
+                    (p.get('codigo', ''), p.get('descricao', ''), p.get('variacao', '')) for p in produtos
+                }
 
-        wb.close()
         print(f"  XLSX: {len(dados_pedidos)} pedidos carregados")
         return dados_pedidos
 
     def _parsear_product_info(self, product_info):
         """Parseia o campo product_info do XLSX da Shopee.
-        Retorna lista de produtos: [{codigo, descricao, variacao, qtd}, ...]
+        Retorna (produtos, total_qtd): [{codigo, descricao, variacao, qtd}, ...] e a
+        soma das quantidades, acumulada durante o parse.
+
+        Os valores sao internados (sys.intern): o mesmo SKU/variacao se repete
+        em milhares de linhas e passa a ocupar uma unica string na memoria.
         """
+        intern = sys.intern
         produtos = []
-        blocos = re.split(r'\[\d+\]\s*', product_info)
+        total_qtd = 0
+        blocos = _RE_BLOCO.split(product_info)
         for bloco in blocos:
-            if not bloco.strip():
+            # isspace() evita alocar uma copia com strip() so para testar se esta vazio
+            if not bloco or bloco.isspace():
                 continue
 
-            m_sku = re.search(r'Parent SKU Reference No\.:\s*([^;]+)', bloco)
-            codigo = m_sku.group(1).strip() if m_sku else ''
-            if not codigo:
-                m_sku2 = re.search(r'SKU Reference No\.:\s*([^;]+)', bloco)
-                codigo = m_sku2.group(1).strip() if m_sku2 else ''
+            # Primeira ocorrencia de cada campo (mesma semantica do re.search)
+            campos = {}
+            for m in _RE_FIELDS.finditer(bloco):
+                campos.setdefault(m.group(1), m.group(2).strip())
 
-            m_qtd = re.search(r'Quantity:\s*(\d+)', bloco)
-            qtd = m_qtd.group(1) if m_qtd else '1'
+            codigo = campos.get('Parent SKU Reference No.') or campos.get('SKU Reference No.', '')
 
-            m_nome = re.search(r'Product Name:\s*([^;]+)', bloco)
-            descricao = m_nome.group(1).strip() if m_nome else ''
+            m_qtd = _RE_DIGITOS.match(campos.get('Quantity', ''))
+            qtd = m_qtd.group(0) if m_qtd else '1'
 
-            m_var = re.search(r'Variation Name:\s*([^;]+)', bloco)
-            variacao = m_var.group(1).strip() if m_var else ''
+            descricao = campos.get('Product Name', '')
+            variacao = campos.get('Variation Name', '')
 
             if codigo or descricao or variacao:
                 produtos.append({
-                    'codigo': codigo,
-                    'descricao': descricao,
-                    'variacao': variacao,
-                    'qtd': qtd,
+                    'codigo': intern(codigo),
+                    'descricao': intern(descricao),
+                    'variacao': intern(variacao),
+                    'qtd': intern(qtd),
                 })
+                total_qtd += int(qtd)  # qtd so tem digitos (_RE_DIGITOS)
 
-        return produtos
+        return produtos, total_qtd
 
     def _normalizar_coluna_xlsx(self, nome_coluna):
         txt = self._remover_acentos(str(nome_coluna or ''))
@@ -1922,227 +2076,308 @@ class ProcessadorEtiquetasShopee:
         """Carrega dados de TODOS os XLSX da pasta para fallback quando XML nao existe.
         Popula self.dados_xlsx_global (order_sn -> dados) e
         self.dados_xlsx_tracking (tracking -> order_sn).
-        """
-        import openpyxl as xl
 
-        xlsx_files = [f for f in os.listdir(pasta)
-                      if f.lower().endswith(('.xlsx', '.xls'))
-                      and not f.startswith('_')
-                      and not f.startswith('~')
-                      and f != 'planilha_custos.xlsx']
+        Com mais de um XLSX, a leitura de cada arquivo roda num processo separado
+        (openpyxl + regex sao CPU-bound); a mesclagem e feita aqui, na ordem dos arquivos.
+        """
+        with os.scandir(pasta) as it:
+            xlsx_files = [e.name for e in it
+                          if e.name.lower().endswith(('.xlsx', '.xls'))
+                          and not e.name.startswith(('_', '~'))
+                          and e.name != 'planilha_custos.xlsx'
+                          and e.is_file()]
 
         if not xlsx_files:
             return
 
-        for xlsx_nome in sorted(xlsx_files):
-            caminho = os.path.join(pasta, xlsx_nome)
+        xlsx_files = sorted(xlsx_files)
+        caminhos = [os.path.join(pasta, f) for f in xlsx_files]
+
+        resultados = None
+        if len(caminhos) > 1 and _pode_usar_processos():
             try:
-                wb = xl.load_workbook(caminho, read_only=False)
-                ws = wb.active
-
-                # Descobrir indices das colunas pelo cabecalho
-                cabecalho = {}
-                for idx, cell in enumerate(ws[1]):
-                    if cell.value:
-                        cabecalho[self._normalizar_coluna_xlsx(cell.value)] = idx
-
-                idx_tracking = cabecalho.get('tracking_number', cabecalho.get('tracking number', -1))
-                idx_order = cabecalho.get('order_sn', cabecalho.get('order sn', -1))
-                idx_product = cabecalho.get('product_info', cabecalho.get('product info', -1))
-
-                def _registrar_produtos(order_key, produtos, tracking_key=''):
-                    if not order_key or not produtos:
-                        return
-                    if order_key not in self.dados_xlsx_global:
-                        self.dados_xlsx_global[order_key] = {
-                            'produtos': list(produtos),
-                            'total_itens': len(produtos),
-                            'total_qtd': sum(int(float(p.get('qtd', 1) or 1)) for p in produtos),
-                            'fonte_dados': 'xlsx',
-                        }
-                    else:
-                        existentes = self.dados_xlsx_global[order_key]['produtos']
-                        chaves_existentes = set()
-                        for p in existentes:
-                            chaves_existentes.add((p.get('codigo', ''), p.get('descricao', ''), p.get('variacao', '')))
-                        for p in produtos:
-                            chave_p = (p.get('codigo', ''), p.get('descricao', ''), p.get('variacao', ''))
-                            if chave_p not in chaves_existentes:
-                                existentes.append(p)
-                                chaves_existentes.add(chave_p)
-                        self.dados_xlsx_global[order_key]['total_itens'] = len(existentes)
-                        self.dados_xlsx_global[order_key]['total_qtd'] = sum(
-                            int(float(p.get('qtd', 1) or 1)) for p in existentes
-                        )
-                        self.dados_xlsx_global[order_key]['fonte_dados'] = 'xlsx'
-                    if tracking_key:
-                        self.dados_xlsx_tracking[tracking_key] = order_key
-
-                count = 0
-                if idx_order != -1 and idx_product != -1:
-                    # Formato legado: colunas order_sn/tracking_number/product_info
-                    for row in ws.iter_rows(min_row=2, values_only=True):
-                        if row is None:
-                            continue
-                        order_sn = str(row[idx_order] or '').strip() if len(row) > idx_order else ''
-                        tracking = str(row[idx_tracking] or '').strip() if idx_tracking >= 0 and len(row) > idx_tracking else ''
-                        product_info = str(row[idx_product] or '').strip() if len(row) > idx_product else ''
+                max_workers = min(len(caminhos), os.cpu_count() or 1)
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    resultados = list(executor.map(_ler_registros_xlsx_worker, caminhos))
+            except Exception as e:
+                print(f"    Aviso: leitura paralela de XLSX indisponivel ({e}), lendo em sequencia")
+                resultados = None
+        if resultados is None:
+            resultados = [self._ler_registros_xlsx(c) for c in caminhos]
 
-                        if not order_sn or not product_info:
-                            continue
+        def _chave_produto(p):
+            return (p.get('codigo', ''), p.get('descricao', ''), p.get('variacao', ''))
 
-                        produtos = self._parsear_product_info(product_info)
-                        if not produtos:
-                            continue
+        chaves_por_pedido = {}  # order_key -> {(codigo, descricao, variacao)} ja acumulados
 
-                        order_key = self._normalizar_chave_pedido(order_sn)
-                        tracking_key = self._normalizar_chave_pedido(tracking)
-                        if not order_key:
-                            continue
+        def _registrar_produtos(order_key, produtos, total_qtd, tracking_key=''):
+            if not order_key or not produtos:
+                return
+            if order_key not in self.dados_xlsx_global:
+                self.dados_xlsx_global[order_key] = {
+                    'produtos': list(produtos),
+                    'total_itens': len(produtos),
+                    'total_qtd': total_qtd,
+                    'fonte_dados': 'xlsx',
+                }
+                chaves_por_pedido[order_key] = {_chave_produto(p) for p in produtos}
+            else:
+                pedido = self.dados_xlsx_global[order_key]
+                existentes = pedido['produtos']
+                chaves_existentes = chaves_por_pedido.get(order_key)
+                if chaves_existentes is None:
+                    # Pedido carregado numa chamada anterior: indexar uma unica vez
+                    chaves_existentes = {_chave_produto(p) for p in existentes}
+                    chaves_por_pedido[order_key] = chaves_existentes
+                for p in produtos:
+                    chave_p = _chave_produto(p)
+                    if chave_p not in chaves_existentes:
+                        existentes.append(p)
+                        chaves_existentes.add(chave_p)
+                        pedido['total_qtd'] += int(float(p.get('qtd', 1) or 1))
+                pedido['total_itens'] = len(existentes)
+                pedido['fonte_dados'] = 'xlsx'
+            if tracking_key:
+                self.dados_xlsx_tracking[tracking_key] = order_key
+
+        for xlsx_nome, (registros, count, erro) in zip(xlsx_files, resultados):
+            for order_key, produtos, total_qtd, tracking_key, chaves_extras in registros:
+                _registrar_produtos(order_key, produtos, total_qtd, tracking_key=tracking_key)
+                # Mapeia outras chaves extraidas (UP/MEL/etc) para o mesmo pedido.
+                for chave_extra in chaves_extras:
+                    self.dados_xlsx_tracking[chave_extra] = order_key
+
+            if erro:
+                print(f"    XLSX erro: {xlsx_nome} - {erro}")
+            elif count > 0:
+                print(f"    {xlsx_nome}: {count} pedidos")
 
-                        _registrar_produtos(order_key, produtos, tracking_key=tracking_key)
-                        count += 1
-                else:
-                    # Formato "Lista de Resumo" do UpSeller (colunas visuais da tabela)
-                    idx_col_pedido = -1
-                    idx_col_titulo = -1
-                    idx_col_sku = -1
-                    idx_col_qtd = -1
-
-                    for nome, idx in cabecalho.items():
-                        if idx_col_pedido == -1 and (
-                            'pedido' in nome or 'rastreio' in nome or 'order' in nome or 'tracking' in nome
-                        ):
-                            idx_col_pedido = idx
-                        if idx_col_titulo == -1 and (
-                            'titulo' in nome or 'title' in nome or 'variacao' in nome or 'variation' in nome
-                        ):
-                            idx_col_titulo = idx
-                        if idx_col_sku == -1 and ('sku' == nome or nome.startswith('sku ' ) or nome.startswith('sku(')):
-                            idx_col_sku = idx
-                        if idx_col_qtd == -1 and ('qtd' in nome or 'quant' in nome or 'qty' in nome):
-                            idx_col_qtd = idx
-
-                    if idx_col_pedido == -1 and ws.max_column >= 2:
-                        idx_col_pedido = 1  # coluna 2 no layout padrao da lista
-                    if idx_col_titulo == -1 and ws.max_column >= 3:
-                        idx_col_titulo = 2
-                    if idx_col_sku == -1 and ws.max_column >= 4:
-                        idx_col_sku = 3
-                    if idx_col_qtd == -1 and ws.max_column >= 6:
-                        idx_col_qtd = 5
-
-                    if idx_col_pedido == -1 or (idx_col_titulo == -1 and idx_col_sku == -1):
-                        wb.close()
+        print(f"  Total XLSX: {len(self.dados_xlsx_global)} pedidos, {len(self.dados_xlsx_tracking)} trackings")
+
+    def _ler_registros_xlsx(self, caminho):
+        """Le um XLSX de pedidos sem alterar o estado do processador.
+
+        Retorna (registros, count, erro): registros e a lista, na ordem das linhas,
+        de (order_key, produtos, total_qtd, tracking_key, chaves_extras) a registrar; erro e
+        a mensagem da excecao (as linhas lidas antes dela sao mantidas) ou None.
+        """
+        registros = []
+        count = 0
+        fechar = None
+        try:
+            linhas, fechar = self._abrir_linhas_xlsx(caminho)
+
+            # Descobrir indices das colunas pelo cabecalho
+            header_row = tuple(next(linhas, ()))
+            n_colunas = len(header_row)
+            cabecalho = {}
+            for idx, valor in enumerate(header_row):
+                if valor:
+                    cabecalho[self._normalizar_coluna_xlsx(valor)] = idx
+
+            idx_tracking = cabecalho.get('tracking_number', cabecalho.get('tracking number', -1))
+            idx_order = cabecalho.get('order_sn', cabecalho.get('order sn', -1))
+            idx_product = cabecalho.get('product_info', cabecalho.get('product info', -1))
+
+            if idx_order != -1 and idx_product != -1:
+                # Formato legado: colunas order_sn/tracking_number/product_info
+                for row in linhas:
+                    if row is None:
                         continue
+                    order_sn = str(row[idx_order] or '').strip() if len(row) > idx_order else ''
+                    tracking = str(row[idx_tracking] or '').strip() if idx_tracking >= 0 and len(row) > idx_tracking else ''
+                    product_info = str(row[idx_product] or '').strip() if len(row) > idx_product else ''
 
-                    ultimo_order_key = ''
-                    for row in ws.iter_rows(min_row=2, values_only=True):
-                        if row is None:
-                            continue
+                    if not order_sn or not product_info:
+                        continue
 
-                        pedido_raw = str(row[idx_col_pedido] or '').strip() if len(row) > idx_col_pedido else ''
-                        titulo_raw = str(row[idx_col_titulo] or '').strip() if idx_col_titulo >= 0 and len(row) > idx_col_titulo else ''
-                        sku_raw = str(row[idx_col_sku] or '').strip() if idx_col_sku >= 0 and len(row) > idx_col_sku else ''
-                        qtd_raw = row[idx_col_qtd] if idx_col_qtd >= 0 and len(row) > idx_col_qtd else 1
+                    produtos, total_qtd = self._parsear_product_info(product_info)
+                    if not produtos:
+                        continue
 
-                        chaves = self._extrair_chaves_pedido_texto(pedido_raw)
-                        order_key, tracking_key = self._escolher_chave_principal_resumo(chaves)
-                        if order_key:
-                            ultimo_order_key = order_key
-                        else:
-                            order_key = ultimo_order_key
+                    order_key = self._normalizar_chave_pedido(order_sn)
+                    tracking_key = self._normalizar_chave_pedido(tracking)
+                    if not order_key:
+                        continue
 
-                        if not order_key:
-                            continue
+                    registros.append((order_key, produtos, total_qtd, tracking_key, ()))
+                    count += 1
+            else:
+                # Formato "Lista de Resumo" do UpSeller (colunas visuais da tabela)
+                idx_col_pedido = -1
+                idx_col_titulo = -1
+                idx_col_sku = -1
+                idx_col_qtd = -1
+
+                for nome, idx in cabecalho.items():
+                    if idx_col_pedido == -1 and (
+                        'pedido' in nome or 'rastreio' in nome or 'order' in nome or 'tracking' in nome
+                    ):
+                        idx_col_pedido = idx
+                    if idx_col_titulo == -1 and (
+                        'titulo' in nome or 'title' in nome or 'variacao' in nome or 'variation' in nome
+                    ):
+                        idx_col_titulo = idx
+                    if idx_col_sku == -1 and ('sku' == nome or nome.startswith('sku ' ) or nome.startswith('sku(')):
+                        idx_col_sku = idx
+                    if idx_col_qtd == -1 and ('qtd' in nome or 'quant' in nome or 'qty' in nome):
+                        idx_col_qtd = idx
+
+                if idx_col_pedido == -1 and n_colunas >= 2:
+                    idx_col_pedido = 1  # coluna 2 no layout padrao da lista
+                if idx_col_titulo == -1 and n_colunas >= 3:
+                    idx_col_titulo = 2
+                if idx_col_sku == -1 and n_colunas >= 4:
+                    idx_col_sku = 3
+                if idx_col_qtd == -1 and n_colunas >= 6:
+                    idx_col_qtd = 5
+
+                if idx_col_pedido == -1 or (idx_col_titulo == -1 and idx_col_sku == -1):
+                    return registros, count, None
+
+                ultimo_order_key = ''
+                for row in linhas:
+                    if row is None:
+                        continue
 
-                        # Linhas de observacoes/notas nao sao produtos.
-                        titulo_norm = self._remover_acentos(titulo_raw).lower()
-                        if (
-                            'notas do comprador' in titulo_norm or
-                            'observacoes' in titulo_norm or
-                            'internal notes' in titulo_norm or
-                            'customer notes' in titulo_norm
-                        ):
-                            continue
+                    pedido_raw = str(row[idx_col_pedido] or '').strip() if len(row) > idx_col_pedido else ''
+                    titulo_raw = str(row[idx_col_titulo] or '').strip() if idx_col_titulo >= 0 and len(row) > idx_col_titulo else ''
+                    sku_raw = str(row[idx_col_sku] or '').strip() if idx_col_sku >= 0 and len(row) > idx_col_sku else ''
+                    qtd_raw = row[idx_col_qtd] if idx_col_qtd >= 0 and len(row) > idx_col_qtd else 1
 
-                        linhas_titulo = [ln.strip() for ln in re.split(r'[\r\n]+', titulo_raw) if str(ln).strip()]
-                        descricao = linhas_titulo[0] if linhas_titulo else ''
-                        variacao = ' / '.join(linhas_titulo[1:]) if len(linhas_titulo) > 1 else ''
+                    chaves = self._extrair_chaves_pedido_texto(pedido_raw)
+                    order_key, tracking_key = self._escolher_chave_principal_resumo(chaves)
+                    if order_key:
+                        ultimo_order_key = order_key
+                    else:
+                        order_key = ultimo_order_key
 
-                        # Sem info de produto, ignora a linha.
-                        if not sku_raw and not descricao and not variacao:
-                            continue
+                    if not order_key:
+                        continue
 
-                        try:
-                            qtd_val = int(float(str(qtd_raw).replace(',', '.')))
-                        except Exception:
-                            qtd_val = 1
-                        if qtd_val <= 0:
-                            qtd_val = 1
+                    # Linhas de observacoes/notas nao sao produtos.
+                    titulo_norm = self._remover_acentos(titulo_raw).lower()
+                    if (
+                        'notas do comprador' in titulo_norm or
+                        'observacoes' in titulo_norm or
+                        'internal notes' in titulo_norm or
+                        'customer notes' in titulo_norm
+                    ):
+                        continue
 
-                        produto = {
-                            'codigo': sku_raw,
-                            'descricao': descricao,
-                            'variacao': variacao,
-                            'qtd': str(qtd_val),
-                        }
-                        _registrar_produtos(order_key, [produto], tracking_key=tracking_key)
+                    linhas_titulo = [ln.strip() for ln in re.split(r'[\r\n]+', titulo_raw) if str(ln).strip()]
+                    descricao = linhas_titulo[0] if linhas_titulo else ''
+                    variacao = ' / '.join(linhas_titulo[1:]) if len(linhas_titulo) > 1 else ''
 
-                        # Mapeia outras chaves extraidas (UP/MEL/etc) para o mesmo pedido.
-                        for chave_extra in chaves:
-                            if chave_extra and chave_extra != order_key:
-                                self.dados_xlsx_tracking[chave_extra] = order_key
+                    # Sem info de produto, ignora a linha.
+                    if not sku_raw and not descricao and not variacao:
+                        continue
 
-                        count += 1
+                    try:
+                        qtd_val = int(float(str(qtd_raw).replace(',', '.')))
+                    except Exception:
+                        qtd_val = 1
+                    if qtd_val <= 0:
+                        qtd_val = 1
 
-                wb.close()
-                if count > 0:
-                    print(f"    {xlsx_nome}: {count} pedidos")
+                    produto = {
+                        'codigo': sku_raw,
+                        'descricao': descricao,
+                        'variacao': variacao,
+                        'qtd': str(qtd_val),
+                    }
+                    chaves_extras = tuple(c for c in chaves if c and c != order_key)
+                    registros.append((order_key, [produto], qtd_val, tracking_key, chaves_extras))
+                    count += 1
 
-            except Exception as e:
-                print(f"    XLSX erro: {xlsx_nome} - {e}")
+            return registros, count, None
 
-        print(f"  Total XLSX: {len(self.dados_xlsx_global)} pedidos, {len(self.dados_xlsx_tracking)} trackings")
+        except Exception as e:
+            return registros, count, str(e)
+        finally:
+            if fechar is not None:
+                fechar()
 
     def _extrair_pedido_texto(self, texto):
-        """Extrai o numero do pedido (order_sn) do texto da etiqueta."""
+        """Extrai o numero do pedido (order_sn) do texto da etiqueta.
+        Memoizada na instancia (o mesmo quadrante e consultado mais de uma vez); o cache
+        e descartado em fechar_documentos, sem guardar textos entre processamentos."""
+        cache = self._cache_pedido_texto
+        if texto in cache:
+            return cache[texto]
+        pedido = None
         # Padrao Shopee: algo como 2602061BMTVXW0 (alfanumerico ~15 chars)
-        m = re.search(r'Pedido[:\s]*\n?([A-Z0-9]{12,20})', texto, re.IGNORECASE)
-        if m:
-            return m.group(1).strip()
-        # Padrao order_sn Shopee: YYMMDD + alfanumerico (ex: 260210A88XUUY8)
-        # Aparece em linha propria, 12-16 chars, comeca com 6 digitos (data)
-        # Nao confundir com chave NFe (44 digitos puros) nem tracking (BR...)
-        m = re.search(r'\n(\d{6}[A-Z0-9]{6,10})\n', texto)
+        m = _RE_PEDIDO.search(texto)
+        if not m:
+            # Padrao order_sn Shopee: YYMMDD + alfanumerico (ex: 260210A88XUUY8)
+            # Aparece em linha propria, 12-16 chars, comeca com 6 digitos (data)
+            # Nao confundir com chave NFe (44 digitos puros) nem tracking (BR...)
+            m = _RE_PEDIDO_ORDER_SN.search(texto)
         if m:
-            return m.group(1).strip()
-        return None
+            pedido = m.group(1).strip()
+        cache[texto] = pedido
+        return pedido
 
     def _extrair_tracking_quadrante(self, texto):
-        """Extrai o tracking number (BR...) do texto de um quadrante."""
-        m = re.search(r'(BR\w{10,20})', texto)
-        return m.group(1) if m else None
+        """Extrai o tracking number (BR...) do texto de um quadrante (memoizada como acima)."""
+        cache = self._cache_tracking_texto
+        if texto in cache:
+            return cache[texto]
+        m = _RE_TRACKING.search(texto)
+        tracking = cache[texto] = m.group(1) if m else None
+        return tracking
+
+    def _trackings_com_prefixo_comum(self, chave):
+        """Retorna as chaves de dados_xlsx_tracking que sao prefixo de `chave`
+        ou que comecam com `chave` (match parcial de tracking).
+
+        Usa uma lista ordenada (bisect) no lugar da varredura linear do dict;
+        o indice e refeito quando novas chaves sao carregadas (so ha insercoes).
+        """
+        if len(self._tracking_ordenado) != len(self.dados_xlsx_tracking):
+            self._tracking_ordenado = sorted(self.dados_xlsx_tracking)
+        ordenado = self._tracking_ordenado
+
+        encontrados = []
+        # Chaves XLSX que comecam com `chave`: faixa contigua a partir do ponto de insercao
+        i = bisect_left(ordenado, chave)
+        while i < len(ordenado) and ordenado[i].startswith(chave):
+            encontrados.append(ordenado[i])
+            i += 1
+        # Chaves XLSX que sao prefixo (proprio) de `chave`
+        for n in range(1, len(chave)):
+            prefixo = chave[:n]
+            if prefixo in self.dados_xlsx_tracking:
+                encontrados.append(prefixo)
+        return encontrados
 
     def _buscar_dados_xlsx(self, texto_quadrante):
         """Busca dados do XLSX usando order_sn ou tracking extraidos do texto.
         Retorna (dados_pedido, order_sn) ou (None, None).
         """
+        return self._buscar_dados_xlsx_por_ids(
+            self._extrair_pedido_texto(texto_quadrante),
+            self._extrair_tracking_quadrante(texto_quadrante),
+            self._extrair_chaves_pedido_texto(texto_quadrante),
+        )
+
+    def _buscar_dados_xlsx_por_ids(self, order_sn, tracking, chaves_texto=()):
+        """Como _buscar_dados_xlsx, mas com os identificadores ja extraidos do texto
+        (para quem ja os tem em maos nao varrer o mesmo texto de novo).
+        """
         # Consolidar chaves candidatas presentes na etiqueta.
         chaves = []
-        order_sn = self._extrair_pedido_texto(texto_quadrante)
         if order_sn:
             k = self._normalizar_chave_pedido(order_sn)
             if k:
                 chaves.append(k)
 
-        tracking = self._extrair_tracking_quadrante(texto_quadrante)
         if tracking:
             k = self._normalizar_chave_pedido(tracking)
             if k and k not in chaves:
                 chaves.append(k)
 
-        for k in self._extrair_chaves_pedido_texto(texto_quadrante):
+        for k in chaves_texto:
             if k not in chaves:
                 chaves.append(k)
 
@@ -2187,10 +2422,10 @@ class ProcessadorEtiquetasShopee:
                 if order_k in self.dados_xlsx_global:
                     _acumular(self.dados_xlsx_global[order_k], order_k, 'xlsx')
             # Match parcial de tracking
-            for tracking_xlsx, osn in self.dados_xlsx_tracking.items():
-                if tracking_xlsx.startswith(chave) or chave.startswith(tracking_xlsx):
-                    if osn in self.dados_xlsx_global:
-                        _acumular(self.dados_xlsx_global[osn], osn, 'xlsx')
+            for tracking_xlsx in self._trackings_com_prefixo_comum(chave):
+                osn = self.dados_xlsx_tracking[tracking_xlsx]
+                if osn in self.dados_xlsx_global:
+                    _acumular(self.dados_xlsx_global[osn], osn, 'xlsx')
 
         if acumulado:
             acumulado['fonte_dados'] = 'xlsx'
@@ -2951,7 +3186,9 @@ class ProcessadorEtiquetasShopee:
 
         for num_pag in range(len(doc)):
             pagina = doc[num_pag]
-            texto = pagina.get_text()
+            # Uma unica extracao por pagina: blocos servem para o texto e para o auto-crop
+            blocks = pagina.get_text("blocks")
+            texto = ''.join(b[4] for b in blocks if b[6] == 0)
             render_imagem_meta = None
 
             # Pagina de lista de separacao nao e etiqueta de envio.
@@ -2962,12 +3199,18 @@ class ProcessadorEtiquetasShopee:
             if tipo == 'cpf':
                 # Auto-crop: detectar bounding box do conteudo real
                 # (lanim.pdf e A4 mas conteudo esta no canto superior esquerdo)
-                blocks = pagina.get_text("blocks")
                 if blocks:
-                    x0 = min(b[0] for b in blocks)
-                    y0 = min(b[1] for b in blocks)
-                    x1 = max(b[2] for b in blocks)
-                    y1 = max(b[3] for b in blocks)
+                    # Uma unica passada pelos blocos para os quatro extremos
+                    x0, y0, x1, y1 = blocks[0][:4]
+                    for b in blocks:
+                        if b[0] < x0:
+                            x0 = b[0]
+                        if b[1] < y0:
+                            y0 = b[1]
+                        if b[2] > x1:
+                            x1 = b[2]
+                        if b[3] > y1:
+                            y1 = b[3]
                     # Pequena margem de seguranca (2pt)
                     clip = fitz.Rect(
                         max(0, x0 - 2), max(0, y0 - 2),
@@ -3001,18 +3244,7 @@ class ProcessadorEtiquetasShopee:
 
             if tipo == 'retirada':
                 # Extrair NF do texto
-                nf = None
-                m = re.search(r'Emiss.o:\n(\d+)\n', texto)
-                if m:
-                    nf = m.group(1)
-                else:
-                    m = re.search(r'NF:\s*(\d+)', texto)
-                    if m:
-                        nf = m.group(1)
-                    else:
-                        m = re.search(r'(\d{4,6})\n\d\n\d{2}-\d{2}-\d{4}', texto)
-                        if m:
-                            nf = m.group(1)
+                nf = self._extrair_nf_texto(texto)
 
                 # Classificar tipo real da etiqueta pelo conteudo
                 # (mesmo criterio usado no path com recorte de 4-quadrantes).
@@ -3028,16 +3260,23 @@ class ProcessadorEtiquetasShopee:
                 else:
                     dados_nf = {}
 
+                # Identificadores da pagina extraidos uma unica vez e reaproveitados
+                chave_nfe = self._extrair_chave_nfe(texto)
+
                 # FONTE PRIMARIA: XLSX (buscar por order_sn ou tracking)
                 if self.dados_xlsx_global or self.dados_lista_global:
-                    dados_xlsx_ret, chave_dados = self._buscar_dados_xlsx(texto)
+                    dados_xlsx_ret, chave_dados = self._buscar_dados_xlsx_por_ids(
+                        self._extrair_pedido_texto(texto),
+                        self._extrair_tracking_quadrante(texto),
+                        self._extrair_chaves_pedido_texto(texto),
+                    )
                     if dados_xlsx_ret:
                         origem_dados = dados_xlsx_ret.get('fonte_dados', 'xlsx')
                         dados_nf = {
                             'nf': nf,
                             'serie': '',
                             'data_emissao': '',
-                            'chave': self._extrair_chave_nfe(texto),
+                            'chave': chave_nfe,
                             'cnpj_emitente': '',
                             'nome_emitente': '',
                             'produtos': dados_xlsx_ret['produtos'],
@@ -3055,7 +3294,7 @@ class ProcessadorEtiquetasShopee:
                             'nf': nf,
                             'serie': '',
                             'data_emissao': '',
-                            'chave': self._extrair_chave_nfe(texto),
+                            'chave': chave_nfe,
                             'cnpj_emitente': '',
                             'nome_emitente': '',
                             'produtos': dados_seq.get('produtos', []),
@@ -3073,7 +3312,7 @@ class ProcessadorEtiquetasShopee:
                             'nf': nf,
                             'serie': '',
                             'data_emissao': '',
-                            'chave': self._extrair_chave_nfe(texto),
+                            'chave': chave_nfe,
                             'cnpj_emitente': '',
                             'nome_emitente': '',
                             'produtos': dados_txt.get('produtos', []),
@@ -3091,7 +3330,7 @@ class ProcessadorEtiquetasShopee:
                             'nf': nf,
                             'serie': '',
                             'data_emissao': '',
-                            'chave': self._extrair_chave_nfe(texto),
+                            'chave': chave_nfe,
                             'cnpj_emitente': '',
                             'nome_emitente': '',
                             'produtos': dados_ocr.get('produtos', []),
@@ -3127,10 +3366,10 @@ class ProcessadorEtiquetasShopee:
                 _tracking = ''
                 _order_sn = ''
                 try:
-                    _m_track = re.search(r'(BR[0-9A-Z]{10,20}BR|BR[0-9A-Z]{10,20})', texto)
+                    _m_track = _RE_TRACKING_BR.search(texto)
                     if _m_track:
                         _tracking = _m_track.group(1)
-                    _m_order = re.search(r'\b(\d{6}[A-Z0-9]{6,12})\b', texto.upper())
+                    _m_order = _RE_ORDER_SN.search(texto.upper())
                     if _m_order:
                         _order_sn = _m_order.group(1)
                 except Exception:
@@ -3167,11 +3406,7 @@ class ProcessadorEtiquetasShopee:
 
                 if nome_loja_cpf:
                     # Procurar CNPJ real correspondente ao nome da loja
-                    cnpj_encontrado = None
-                    for cnpj_real, nome_real in self.cnpj_loja.items():
-                        if nome_real.lower().strip() == nome_loja_cpf.lower().strip():
-                            cnpj_encontrado = cnpj_real
-                            break
+                    cnpj_encontrado = self._cnpj_por_nome_loja(nome_loja_cpf)
                     if cnpj_encontrado:
                         cpf_cnpj = cnpj_encontrado
                         cpf_nome = nome_loja_cpf
@@ -3179,7 +3414,7 @@ class ProcessadorEtiquetasShopee:
                         # Nome encontrado mas sem CNPJ correspondente
                         cpf_cnpj = f"CPF_{re.sub(r'[^A-Za-z0-9]', '_', nome_loja_cpf)}"
                         cpf_nome = nome_loja_cpf
-                        self.cnpj_loja[cpf_cnpj] = nome_loja_cpf
+                        self._registrar_loja(cpf_cnpj, nome_loja_cpf)
                         self.cnpj_nome[cpf_cnpj] = nome_loja_cpf
 
                 # Registrar mapeamento fallback se necessario
@@ -3207,7 +3442,7 @@ class ProcessadorEtiquetasShopee:
                 # Extrair tracking para deduplicacao cross-loja
                 _cpf_tracking = ''
                 try:
-                    _m_cpf_track = re.search(r'(BR[0-9A-Z]{10,20}BR|BR[0-9A-Z]{10,20})', texto)
+                    _m_cpf_track = _RE_TRACKING_BR.search(texto)
                     if _m_cpf_track:
                         _cpf_tracking = _m_cpf_track.group(1)
                 except Exception:
@@ -3255,11 +3490,18 @@ class ProcessadorEtiquetasShopee:
 
         Retorna lista de etiquetas CPF.
         """
-        # Detectar todos os PDFs lanim*.pdf
+        # Uma unica leitura do diretorio: PDFs lanim*.pdf e XLSX candidatos
         pdfs_cpf = []
-        for f in os.listdir(pasta_entrada):
-            if f.lower().startswith('lanim') and f.lower().endswith('.pdf'):
-                pdfs_cpf.append(f)
+        xlsx_encontrados = []
+        with os.scandir(pasta_entrada) as it:
+            for entry in it:
+                nome = entry.name
+                nome_lower = nome.lower()
+                if nome_lower.startswith('lanim') and nome_lower.endswith('.pdf'):
+                    pdfs_cpf.append(nome)
+                elif (nome_lower.endswith(('.xlsx', '.xls')) and not nome.startswith('_')
+                      and nome != 'planilha_custos.xlsx'):
+                    xlsx_encontrados.append(nome)
 
         if not pdfs_cpf:
             return []
@@ -3274,11 +3516,6 @@ class ProcessadorEtiquetasShopee:
             print(f"  Usando lanim2.xlsx")
         else:
             # Buscar qualquer XLSX que nao seja planilha de custos ou config
-            xlsx_encontrados = []
-            for f in os.listdir(pasta_entrada):
-                if f.lower().endswith(('.xlsx', '.xls')) and not f.startswith('_') and f != 'planilha_custos.xlsx':
-                    xlsx_encontrados.append(f)
-
             for xlsx_nome in xlsx_encontrados:
                 caminho_xlsx = os.path.join(pasta_entrada, xlsx_nome)
                 try:
@@ -3292,105 +3529,134 @@ class ProcessadorEtiquetasShopee:
             if not dados_xlsx and not xlsx_encontrados:
                 print(f"  AVISO: Nenhum XLSX de declaracao encontrado, etiquetas CPF sem dados de produto")
 
+        pdfs_cpf = sorted(pdfs_cpf)
+        caminhos_pdf = [os.path.join(pasta_entrada, f) for f in pdfs_cpf]
+
+        # Extracao de texto (MuPDF) em paralelo por PDF, em processos: PyMuPDF nao e
+        # thread-safe. A montagem das etiquetas (que altera cnpj_loja) segue em ordem.
+        quadrantes_por_pdf = None
+        if len(caminhos_pdf) > 1 and _pode_usar_processos():
+            try:
+                max_workers = min(len(caminhos_pdf), os.cpu_count() or 1)
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    quadrantes_por_pdf = list(executor.map(_extrair_quadrantes_cpf_worker, caminhos_pdf))
+            except Exception as e:
+                print(f"  Aviso: leitura paralela dos PDFs CPF indisponivel ({e}), lendo em sequencia")
+                quadrantes_por_pdf = None
+        if quadrantes_por_pdf is None:
+            quadrantes_por_pdf = [None] * len(caminhos_pdf)
+
         etiquetas = []
-        for pdf_cpf in sorted(pdfs_cpf):
-            caminho_pdf = os.path.join(pasta_entrada, pdf_cpf)
-            etqs = self._carregar_pdf_cpf_smart(caminho_pdf, dados_xlsx)
+        for pdf_cpf, caminho_pdf, quadrantes in zip(pdfs_cpf, caminhos_pdf, quadrantes_por_pdf):
+            etqs = self._carregar_pdf_cpf_smart(caminho_pdf, dados_xlsx, quadrantes=quadrantes)
             etiquetas.extend(etqs)
             if len(pdfs_cpf) > 1:
                 print(f"  {pdf_cpf}: {len(etqs)} etiquetas CPF")
         return etiquetas
 
-    def _carregar_pdf_cpf_smart(self, caminho_pdf, dados_xlsx=None):
+    def _extrair_quadrantes_cpf(self, caminho_pdf):
+        """Le um PDF CPF e retorna [(num_pag, idx, clip, texto_quad), ...] dos quadrantes com texto.
+        clip vem como tupla (x0, y0, x1, y1) para poder atravessar processos.
+        """
+        quadrantes_texto = []
+        doc = fitz.open(caminho_pdf)
+        try:
+            for num_pag in range(len(doc)):
+                pagina = doc[num_pag]
+
+                # Detectar layout da pagina
+                # Apenas paginas grandes (A4 ~595x842) podem ter grid 2x2/2x1
+                # Paginas pequenas (~297x419) sao sempre 1 etiqueta por pagina
+                rect = pagina.rect
+                eh_pagina_grande = rect.width > 400 and rect.height > 600
+
+                # Palavras extraidas uma vez; layout e quadrantes filtram em Python
+                words = pagina.get_text("words")
+                if eh_pagina_grande:
+                    quadrantes = self._detectar_layout_pagina(pagina, words=words)
+                else:
+                    quadrantes = [pagina.rect]  # pagina inteira = 1 etiqueta
+
+                for idx, clip in enumerate(quadrantes):
+                    texto_quad = self._texto_words_clip(words, clip).strip()
+                    if len(texto_quad) < 10:
+                        continue  # Quadrante vazio
+                    quadrantes_texto.append((num_pag, idx, tuple(clip), texto_quad))
+        finally:
+            doc.close()
+        return quadrantes_texto
+
+    def _carregar_pdf_cpf_smart(self, caminho_pdf, dados_xlsx=None, quadrantes=None):
         """Carrega etiquetas CPF de um PDF, detectando layout de cada pagina.
         Paginas com grid (2x2/2x1) sao recortadas por quadrante.
         Paginas com 1 etiqueta sao processadas inteiras (com auto-crop).
         Todas sao marcadas como tipo_especial='cpf' e recebem dados do XLSX.
+        quadrantes: resultado de _extrair_quadrantes_cpf ja calculado (opcional).
         """
         print(f"  Carregando (cpf): {os.path.basename(caminho_pdf)}")
-        doc = fitz.open(caminho_pdf)
+        if quadrantes is None:
+            quadrantes = self._extrair_quadrantes_cpf(caminho_pdf)
         etiquetas = []
 
-        for num_pag in range(len(doc)):
-            pagina = doc[num_pag]
+        for num_pag, idx, clip, texto_quad in quadrantes:
+            clip = fitz.Rect(clip)
 
-            # Detectar layout da pagina
-            # Apenas paginas grandes (A4 ~595x842) podem ter grid 2x2/2x1
-            # Paginas pequenas (~297x419) sao sempre 1 etiqueta por pagina
-            rect = pagina.rect
-            eh_pagina_grande = rect.width > 400 and rect.height > 600
+            # Extrair order_sn do texto deste quadrante
+            order_sn = self._extrair_pedido_texto(texto_quad)
 
-            if eh_pagina_grande:
-                quadrantes = self._detectar_layout_pagina(pagina)
-            else:
-                quadrantes = [pagina.rect]  # pagina inteira = 1 etiqueta
+            dados_pedido = {}
+            if order_sn and dados_xlsx:
+                dados_pedido = dados_xlsx.get(order_sn, {})
 
-            for idx, clip in enumerate(quadrantes):
-                texto_quad = pagina.get_text(clip=clip).strip()
-                if len(texto_quad) < 10:
-                    continue  # Quadrante vazio
+            # Extrair nome da loja do REMETENTE
+            nome_loja_cpf = self._extrair_nome_loja_remetente(texto_quad)
+            cpf_cnpj = self.LANIM_CNPJ
+            cpf_nome = self.LANIM_NOME
 
-                # Extrair order_sn do texto deste quadrante
-                order_sn = self._extrair_pedido_texto(texto_quad)
-
-                dados_pedido = {}
-                if order_sn and dados_xlsx:
-                    dados_pedido = dados_xlsx.get(order_sn, {})
-
-                # Extrair nome da loja do REMETENTE
-                nome_loja_cpf = self._extrair_nome_loja_remetente(texto_quad)
-                cpf_cnpj = self.LANIM_CNPJ
-                cpf_nome = self.LANIM_NOME
-
-                if nome_loja_cpf:
-                    cnpj_encontrado = None
-                    for cnpj_real, nome_real in self.cnpj_loja.items():
-                        if nome_real.lower().strip() == nome_loja_cpf.lower().strip():
-                            cnpj_encontrado = cnpj_real
-                            break
-                    if cnpj_encontrado:
-                        cpf_cnpj = cnpj_encontrado
-                        cpf_nome = nome_loja_cpf
-                    else:
-                        cpf_cnpj = f"CPF_{re.sub(r'[^A-Za-z0-9]', '_', nome_loja_cpf)}"
-                        cpf_nome = nome_loja_cpf
-                        self.cnpj_loja[cpf_cnpj] = nome_loja_cpf
-                        self.cnpj_nome[cpf_cnpj] = nome_loja_cpf
-
-                if cpf_cnpj == self.LANIM_CNPJ and self.LANIM_CNPJ not in self.cnpj_nome:
-                    self.cnpj_nome[self.LANIM_CNPJ] = self.LANIM_NOME
-
-                produtos = dados_pedido.get('produtos', [])
-                sku = produtos[0].get('codigo', '') if produtos else ''
-                num_produtos = len(produtos) if produtos else 1
-
-                nf_id = order_sn or f'CPF_pag{num_pag}_q{idx}'
-
-                dados_ficticio = {
-                    'nf': nf_id,
-                    'serie': '',
-                    'data_emissao': '',
-                    'chave': '',
-                    'cnpj_emitente': cpf_cnpj,
-                    'nome_emitente': cpf_nome,
-                    'produtos': produtos,
-                    'total_itens': dados_pedido.get('total_itens', len(produtos)),
-                    'total_qtd': dados_pedido.get('total_qtd', 0),
-                }
+            if nome_loja_cpf:
+                cnpj_encontrado = self._cnpj_por_nome_loja(nome_loja_cpf)
+                if cnpj_encontrado:
+                    cpf_cnpj = cnpj_encontrado
+                    cpf_nome = nome_loja_cpf
+                else:
+                    cpf_cnpj = f"CPF_{re.sub(r'[^A-Za-z0-9]', '_', nome_loja_cpf)}"
+                    cpf_nome = nome_loja_cpf
+                    self._registrar_loja(cpf_cnpj, nome_loja_cpf)
+                    self.cnpj_nome[cpf_cnpj] = nome_loja_cpf
+
+            if cpf_cnpj == self.LANIM_CNPJ and self.LANIM_CNPJ not in self.cnpj_nome:
+                self.cnpj_nome[self.LANIM_CNPJ] = self.LANIM_NOME
+
+            produtos = dados_pedido.get('produtos', [])
+            sku = produtos[0].get('codigo', '') if produtos else ''
+            num_produtos = len(produtos) if produtos else 1
+
+            nf_id = order_sn or f'CPF_pag{num_pag}_q{idx}'
+
+            dados_ficticio = {
+                'nf': nf_id,
+                'serie': '',
+                'data_emissao': '',
+                'chave': '',
+                'cnpj_emitente': cpf_cnpj,
+                'nome_emitente': cpf_nome,
+                'produtos': produtos,
+                'total_itens': dados_pedido.get('total_itens', len(produtos)),
+                'total_qtd': dados_pedido.get('total_qtd', 0),
+            }
 
-                etiquetas.append({
-                    'nf': nf_id,
-                    'sku': sku,
-                    'num_produtos': num_produtos,
-                    'cnpj': cpf_cnpj,
-                    'clip': clip,
-                    'pagina_idx': num_pag,
-                    'caminho_pdf': caminho_pdf,
-                    'dados_xml': dados_ficticio,
-                    'tipo_especial': 'cpf',
-                })
+            etiquetas.append({
+                'nf': nf_id,
+                'sku': sku,
+                'num_produtos': num_produtos,
+                'cnpj': cpf_cnpj,
+                'clip': clip,
+                'pagina_idx': num_pag,
+                'caminho_pdf': caminho_pdf,
+                'dados_xml': dados_ficticio,
+                'tipo_especial': 'cpf',
+            })
 
-        doc.close()
         print(f"    {len(etiquetas)} etiquetas (cpf)")
         return etiquetas
 
@@ -3473,67 +3739,47 @@ class ProcessadorEtiquetasShopee:
 
         y_top_tabela = y_inicio + 2
 
+        # Colunas por modo (resolvido uma vez, fora do loop):
+        # titulo -> descricao/titulo + variacao; ambos -> SKU + descricao; sku -> SKU + variacao
+        if modo == 'titulo':
+            def _textos(codigo, descricao, variacao):
+                return descricao or codigo, variacao
+        elif modo == 'ambos':
+            def _textos(codigo, descricao, variacao):
+                return codigo, descricao or variacao
+        else:
+            def _textos(codigo, descricao, variacao):
+                return codigo, variacao
+
+        def _trunc(texto, max_len):
+            return texto if len(texto) <= max_len else texto[:max_len - 2] + '..'
+
+        insert_text = pagina.insert_text
+        draw_line = pagina.draw_line
+        x_direita = larg_pagina - margem_dir
+        cinza = (0.6, 0.6, 0.6)
+        ultimo_idx = len(produtos) - 1
+
         # Linhas de produtos
         for i_prod, prod in enumerate(produtos[:10]):
             if y + line_h > y_limite:
                 break
 
-            codigo = prod.get('codigo', '')
-            descricao = prod.get('descricao', '')
-            variacao = prod.get('variacao', '')
+            texto1, texto2 = _textos(
+                prod.get('codigo', ''), prod.get('descricao', ''), prod.get('variacao', '')
+            )
+            texto1 = _trunc(texto1, 10)
+            texto2 = _trunc(texto2, 45)
             qtd = str(int(float(prod.get('qtd', '1'))))
 
-            if modo == 'titulo':
-                # Col1: descricao/titulo, Col2: variacao
-                texto1 = descricao or codigo
-                max_t1 = 10
-                if len(texto1) > max_t1:
-                    texto1 = texto1[:max_t1 - 2] + '..'
-                texto2 = variacao
-                max_t2 = 45
-                if len(texto2) > max_t2:
-                    texto2 = texto2[:max_t2 - 2] + '..'
-            elif modo == 'ambos':
-                # Col1: SKU, Col2: descricao/titulo
-                texto1 = codigo
-                max_t1 = 10
-                if len(texto1) > max_t1:
-                    texto1 = texto1[:max_t1 - 2] + '..'
-                texto2 = descricao or variacao
-                max_t2 = 45
-                if len(texto2) > max_t2:
-                    texto2 = texto2[:max_t2 - 2] + '..'
-            else:
-                # Modo SKU (padrao): Col1: SKU, Col2: variacao
-                texto1 = codigo
-                max_t1 = 10
-                if len(texto1) > max_t1:
-                    texto1 = texto1[:max_t1 - 2] + '..'
-                texto2 = variacao
-                max_t2 = 45
-                if len(texto2) > max_t2:
-                    texto2 = texto2[:max_t2 - 2] + '..'
-
-            pagina.insert_text(
-                (col_sku, y), texto1 if texto1 else "-",
-                fontsize=fs_destaque, fontname=fonte_bold, color=preto
-            )
-            pagina.insert_text(
-                (col_var, y), texto2.upper() if texto2 else "-",
-                fontsize=fs, fontname=fonte, color=preto
-            )
-            pagina.insert_text(
-                (col_qtd, y), qtd,
-                fontsize=fs_qtd, fontname=fonte_bold, color=preto
-            )
+            insert_text((col_sku, y), texto1 or "-", fontsize=fs_destaque, fontname=fonte_bold, color=preto)
+            insert_text((col_var, y), texto2.upper() if texto2 else "-", fontsize=fs, fontname=fonte, color=preto)
+            insert_text((col_qtd, y), qtd, fontsize=fs_qtd, fontname=fonte_bold, color=preto)
             y += line_h
 
             # Linha divisoria entre produtos (exceto apos o ultimo)
-            if i_prod < len(produtos) - 1 and y + line_h <= y_limite:
-                pagina.draw_line(
-                    (margem_esq, y - 1), (larg_pagina - margem_dir, y - 1),
-                    color=(0.6, 0.6, 0.6), width=0.3
-                )
+            if i_prod < ultimo_idx and y + line_h <= y_limite:
+                draw_line((margem_esq, y - 1), (x_direita, y - 1), color=cinza, width=0.3)
 
         # Garantir que linhas nao ultrapassem o limite
         y_final = min(y, y_limite)
@@ -3614,7 +3860,7 @@ class ProcessadorEtiquetasShopee:
             doc.close()
 
         total = len(doc_saida)
-        doc_saida.save(caminho_saida)
+        doc_saida.save(caminho_saida, **_OPCOES_SAVE_PDF)
         doc_saida.close()
         return total
 
@@ -3627,19 +3873,19 @@ class ProcessadorEtiquetasShopee:
         dados = {}
 
         # NF
-        m = re.search(r'N[uú]mero:\s*\n?(\d+)', texto, re.IGNORECASE)
+        m = _RE_SHEIN_NF.search(texto)
         dados['nf'] = m.group(1) if m else ''
 
         # Chave de acesso (44 digitos)
-        m = re.search(r'(\d{44})', texto)
+        m = _RE_CHAVE44.search(texto)
         dados['chave'] = m.group(1) if m else ''
 
         # CNPJ emitente
-        m = re.search(r'CNPJ[^:]*:\s*(\d+)', texto)
+        m = _RE_CNPJ_EMIT.search(texto)
         dados['cnpj_emitente'] = m.group(1) if m else ''
 
         # Nome emitente
-        m = re.search(r'NOME/RAZ.O SOCIAL[^:]*:\s*(.+)', texto)
+        m = _RE_NOME_EMIT.search(texto)
         nome_raw = m.group(1).strip() if m else ''
         dados['nome_emitente'] = nome_raw
 
@@ -3650,42 +3896,46 @@ class ProcessadorEtiquetasShopee:
         # Produtos: ITEM | CONTEUDO | ATRIBUTOS | QUANT
         produtos = []
         # Pegar tudo apos "ITEM" header
-        m_secao = re.search(r'ITEM\s+CONTE.*?QUANT\.\s*\n(.*)', texto, re.DOTALL)
+        m_secao = _RE_ITEM_SECAO.search(texto)
         if m_secao:
             secao = m_secao.group(1).strip()
-            linhas = [l.strip() for l in secao.split('\n') if l.strip()]
 
-            # Dividir linhas em blocos por item code (I + alfanumerico, ex: I38cnk94dfzb)
+            # Dividir linhas em blocos por item code (I + alfanumerico, ex: I38cnk94dfzb),
+            # guardando na mesma passada o indice da ultima linha so numerica (quantidade)
             blocos = []
             bloco_atual = []
-            for l in linhas:
-                if re.match(r'^[Il][A-Za-z0-9]{6,}$', l) and bloco_atual:
-                    blocos.append(bloco_atual)
+            idx_qtd_atual = 0
+            for l in secao.split('\n'):
+                l = l.strip()
+                if not l:
+                    continue
+                if bloco_atual and _RE_ITEM_CODIGO.match(l):
+                    blocos.append((bloco_atual, idx_qtd_atual))
                     bloco_atual = [l]
+                    idx_qtd_atual = 0
                 else:
+                    if bloco_atual and l.isdecimal():
+                        idx_qtd_atual = len(bloco_atual)
                     bloco_atual.append(l)
             if bloco_atual:
-                blocos.append(bloco_atual)
+                blocos.append((bloco_atual, idx_qtd_atual))
 
-            for bloco in blocos:
-                if not bloco:
-                    continue
+            for bloco, idx_qtd in blocos:
                 item_code = bloco[0]
                 # Quantidade e a ultima linha que e so um numero
-                qtd_str = '1'
-                idx_qtd = len(bloco)
-                for j in range(len(bloco) - 1, 0, -1):
-                    if re.match(r'^\d+$', bloco[j]):
-                        qtd_str = bloco[j]
-                        idx_qtd = j
-                        break
+                if idx_qtd:
+                    qtd_str = bloco[idx_qtd]
+                else:
+                    qtd_str = '1'
+                    idx_qtd = len(bloco)
 
                 # Juntar linhas entre item_code e qtd
                 meio = ''.join(bloco[1:idx_qtd])
 
                 # Separar descricao de atributos
                 # Atributos comecam onde aparece algo com / (tipo Rakka/Roxo...)
-                m_atrib = re.search(r'([A-Z][a-z]*/.+)$', meio)
+                # Sem '/' o regex nunca casa: evita acionar o motor de regex
+                m_atrib = _RE_ATRIB.search(meio) if '/' in meio else None
                 if m_atrib:
                     atrib = m_atrib.group(1)
                     desc = meio[:m_atrib.start()].strip()
@@ -3693,16 +3943,22 @@ class ProcessadorEtiquetasShopee:
                     atrib = ''
                     desc = meio
 
+                # modelo/cor/tamanho parseados uma unica vez aqui (ordenacao, PDF e resumo)
+                modelo, cor, tamanho = self._parsear_atributos_shein(atrib)
                 produtos.append({
                     'codigo_item': item_code,
                     'descricao': desc,
                     'atributos': atrib,
                     'qtd': qtd_str,
+                    'qtd_int': int(qtd_str),
+                    'modelo': modelo,
+                    'cor': cor,
+                    'tamanho': tamanho,
                 })
 
         dados['produtos_shein'] = produtos
         dados['total_itens'] = len(produtos)
-        dados['total_qtd'] = sum(int(float(p.get('qtd', 1))) for p in produtos)
+        dados['total_qtd'] = sum(p['qtd_int'] for p in produtos)
 
         return dados
 
@@ -3713,17 +3969,14 @@ class ProcessadorEtiquetasShopee:
         """
         if not atributos:
             return ''
-        # Remover texto entre parenteses (incluindo chines)
-        limpo = re.sub(r'\([^)]*\)', '', atributos)
-        # Remover / e espacos
-        limpo = limpo.replace('/', '')
-        # Remover espacos
-        limpo = limpo.replace(' ', '')
-        # Manter apenas letras, numeros e hifen
-        limpo = re.sub(r'[^A-Za-z0-9\-]', '', limpo)
-        # Remover hifens extras
-        limpo = re.sub(r'-+', '', limpo)
-        return limpo
+        codigo = self._codigo_cache.get(atributos)
+        if codigo is None:
+            # Remover texto entre parenteses (incluindo chines)
+            limpo = _RE_PAREN.sub('', atributos)
+            # Manter apenas letras e numeros ASCII (sem /, espacos e hifens)
+            codigo = limpo.encode('ascii', 'ignore').decode('ascii').translate(_SHEIN_CODE_TRANS)
+            self._codigo_cache[atributos] = codigo
+        return codigo
 
     def _parsear_atributos_shein(self, atributos):
         """Parseia atributos Shein em modelo, cor e tamanho.
@@ -3732,10 +3985,14 @@ class ProcessadorEtiquetasShopee:
         """
         if not atributos:
             return '', '', ''
+        # Os mesmos atributos se repetem muito entre pedidos: parse uma vez por string
+        resultado = self._atrib_cache.get(atributos)
+        if resultado is not None:
+            return resultado
         # Remover texto chines entre parenteses
-        limpo = re.sub(r'\([^)]*\)', '', atributos).strip()
+        limpo = _RE_PAREN.sub('', atributos).strip()
         # Separar tamanho: -BR39/40
-        m = re.match(r'^(.+?)(?:-BR(\d+/?\d*))$', limpo)
+        m = _RE_BR_SIZE.match(limpo)
         if m:
             modelo_cor = m.group(1)
             tamanho = 'BR' + m.group(2)
@@ -3750,7 +4007,60 @@ class ProcessadorEtiquetasShopee:
         else:
             modelo = modelo_cor.strip()
             cor = ''
-        return modelo, cor, tamanho
+        resultado = (modelo, cor, tamanho)
+        self._atrib_cache[atributos] = resultado
+        return resultado
+
+    def fechar_documentos(self):
+        """Fecha os PDFs Shein mantidos abertos entre processar_shein e gerar_pdf_shein
+        e descarta os caches de texto das etiquetas do processamento."""
+        for doc in self._open_docs.values():
+            try:
+                doc.close()
+            except Exception:
+                pass
+        self._open_docs.clear()
+        self._cache_pedido_texto.clear()
+        self._cache_tracking_texto.clear()
+
+    def _extrair_pares_shein(self, doc):
+        """Le os pares (etiqueta, DANFE/Declaracao) de um PDF Shein ja aberto.
+        Retorna [(i, tipo_par, texto_par, rect_etiqueta, rect_par, rect_tabela), ...] com
+        tipo_par 'danfe', 'declaracao' ou None e retangulos como tuplas (atravessam processos).
+        """
+        pares = []
+        n_pags = len(doc)
+        for i in range(0, n_pags - 1, 2):
+            pag_etiqueta = doc[i]
+            pag_par = doc[i + 1]
+            # Um unico TextPage por pagina: serve ao get_text e as buscas da tabela da declaracao
+            textpage = pag_par.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+            texto_par = pag_par.get_text(textpage=textpage)
+            texto_par_upper = texto_par.upper()
+
+            # Determinar tipo do par
+            eh_danfe = 'DANFE' in texto_par_upper and 'CHAVE' in texto_par_upper
+            eh_declaracao = (
+                ('DECLARAÇÃO DE CONTEÚDO' in texto_par or 'DECLARACAO DE CONTEUDO' in texto_par_upper)
+                and ('IDENTIFICAÇÃO DOS BENS' in texto_par or 'IDENTIFICACAO DOS BENS' in texto_par_upper)
+            )
+
+            rect_tabela = None
+            if eh_danfe:
+                tipo_par = 'danfe'
+            elif eh_declaracao:
+                tipo_par = 'declaracao'
+                clip_tabela = self._detectar_area_tabela_declaracao(pag_par, textpage=textpage)
+                if clip_tabela is not None:
+                    rect_tabela = tuple(clip_tabela)
+            else:
+                tipo_par = None
+
+            pares.append((
+                i, tipo_par, texto_par,
+                tuple(pag_etiqueta.rect), tuple(pag_par.rect), rect_tabela,
+            ))
+        return pares
 
     def processar_shein(self, pasta_entrada, pdfs_extras=None):
         """Processa etiquetas Shein de 'shein crua.pdf', 'shein.pdf' ou PDFs auto-detectados.
@@ -3761,12 +4071,12 @@ class ProcessadorEtiquetasShopee:
         caminhos_shein = list(pdfs_extras) if pdfs_extras else []
 
         # Buscar arquivo shein nomeado (case-insensitive para funcionar no Linux/Railway)
-        nomes_shein = ['shein crua.pdf', 'shein.pdf']
-        for f in os.listdir(pasta_entrada):
-            if f.lower() in nomes_shein:
-                caminho_fixo = os.path.join(pasta_entrada, f)
-                if caminho_fixo not in caminhos_shein:
-                    caminhos_shein.append(caminho_fixo)
+        with os.scandir(pasta_entrada) as entradas:
+            for entrada in entradas:
+                if entrada.name.lower() in _NOMES_SHEIN and entrada.is_file():
+                    caminho_fixo = os.path.join(pasta_entrada, entrada.name)
+                    if caminho_fixo not in caminhos_shein:
+                        caminhos_shein.append(caminho_fixo)
 
         if not caminhos_shein:
             return []
@@ -3777,26 +4087,33 @@ class ProcessadorEtiquetasShopee:
         n_declaracao = 0
         n_skip = 0
 
-        for caminho in caminhos_shein:
+        # Leitura dos PDFs (MuPDF) em paralelo, em processos: PyMuPDF nao e thread-safe.
+        # O parse dos pares (que altera cnpj_nome) segue em ordem no processo principal.
+        pares_por_pdf = None
+        if len(caminhos_shein) > 1 and _pode_usar_processos():
+            try:
+                max_workers = min(len(caminhos_shein), os.cpu_count() or 1, 4)
+                with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                    pares_por_pdf = list(executor.map(_extrair_pares_shein_worker, caminhos_shein))
+            except Exception as e:
+                print(f"    Aviso: leitura paralela dos PDFs Shein indisponivel ({e}), lendo em sequencia")
+                pares_por_pdf = None
+        if pares_por_pdf is None:
+            pares_por_pdf = []
+            for caminho in caminhos_shein:
+                # Documento fica aberto para gerar_pdf_shein reaproveitar (fechado em fechar_documentos)
+                doc = self._open_docs.get(caminho)
+                if doc is None:
+                    doc = fitz.open(caminho)
+                    self._open_docs[caminho] = doc
+                pares_por_pdf.append(self._extrair_pares_shein(doc))
+
+        for caminho, pares in zip(caminhos_shein, pares_por_pdf):
             print(f"    Shein: {os.path.basename(caminho)}")
-            doc = fitz.open(caminho)
-            n_pags = len(doc)
-
-            # Processar em pares: pag_par (etiqueta) + pag_impar (DANFE ou Declaracao)
-            for i in range(0, n_pags - 1, 2):
-                pag_etiqueta = doc[i]
-                pag_par = doc[i + 1]
-                texto_par = pag_par.get_text()
-                texto_par_upper = texto_par.upper()
-
-                # Determinar tipo do par
-                eh_danfe = 'DANFE' in texto_par_upper and 'CHAVE' in texto_par_upper
-                eh_declaracao = (
-                    ('DECLARAÇÃO DE CONTEÚDO' in texto_par or 'DECLARACAO DE CONTEUDO' in texto_par_upper)
-                    and ('IDENTIFICAÇÃO DOS BENS' in texto_par or 'IDENTIFICACAO DOS BENS' in texto_par_upper)
-                )
 
-                if eh_danfe:
+            # Pares: pag_par (etiqueta) + pag_impar (DANFE ou Declaracao)
+            for i, tipo_par, texto_par, rect_etiqueta, rect_par, rect_tabela in pares:
+                if tipo_par == 'danfe':
                     # --- Pipeline DANFE existente (inalterado) ---
                     dados_danfe = self._parse_shein_danfe(texto_par)
                     nf = dados_danfe.get('nf', '')
@@ -3818,8 +4135,8 @@ class ProcessadorEtiquetasShopee:
                         'pag_etiqueta_idx': i,
                         'pag_danfe_idx': i + 1,
                         'caminho_pdf': caminho,
-                        'clip_etiqueta': pag_etiqueta.rect,
-                        'clip_danfe': pag_par.rect,
+                        'clip_etiqueta': fitz.Rect(rect_etiqueta),
+                        'clip_danfe': fitz.Rect(rect_par),
                         'dados_danfe': dados_danfe,
                         'dados_xml': dados_xml,
                         'tipo_especial': 'shein',
@@ -3827,14 +4144,14 @@ class ProcessadorEtiquetasShopee:
                     })
                     n_danfe += 1
 
-                elif eh_declaracao:
+                elif tipo_par == 'declaracao':
                     # --- Pipeline Declaracao de Conteudo (novo) ---
                     dados_decl = self._parse_declaracao_conteudo(texto_par)
                     tracking = dados_decl.get('tracking', '')
                     cnpj = dados_decl.get('cnpj_emitente', '')
 
-                    # Detectar area da tabela "IDENTIFICACAO DOS BENS" para recorte
-                    clip_tabela = self._detectar_area_tabela_declaracao(pag_par)
+                    # Area da tabela "IDENTIFICACAO DOS BENS" (detectada na leitura do PDF)
+                    clip_tabela = fitz.Rect(rect_tabela) if rect_tabela is not None else None
 
                     # Usar tracking como identificador (declaracoes nao tem NF)
                     nf_id = tracking if tracking else f'DECL_{i}_{os.path.basename(caminho)}'
@@ -3845,8 +4162,8 @@ class ProcessadorEtiquetasShopee:
                         'pag_etiqueta_idx': i,
                         'pag_danfe_idx': i + 1,
                         'caminho_pdf': caminho,
-                        'clip_etiqueta': pag_etiqueta.rect,
-                        'clip_danfe': pag_par.rect,
+                        'clip_etiqueta': fitz.Rect(rect_etiqueta),
+                        'clip_danfe': fitz.Rect(rect_par),
                         'clip_tabela_declaracao': clip_tabela,
                         'dados_danfe': dados_decl,
                         'dados_xml': {},
@@ -3860,8 +4177,6 @@ class ProcessadorEtiquetasShopee:
                     print(f"      Par {i}/{i+1}: pagina {i+1} nao reconhecida (nem DANFE nem Declaracao), pulando")
                     n_skip += 1
 
-            doc.close()
-
         total = n_danfe + n_declaracao
         desc_parts = []
         if n_danfe:
@@ -3884,11 +4199,11 @@ class ProcessadorEtiquetasShopee:
         def _chave(etq):
             prods = etq.get('dados_danfe', {}).get('produtos_shein', [])
             if prods:
-                atrib = prods[0].get('atributos', '')
-                modelo, cor, tamanho = self._parsear_atributos_shein(atrib)
+                prod = prods[0]
+                modelo, cor, tamanho = prod['modelo'], prod['cor'], prod['tamanho']
             else:
                 modelo, cor, tamanho = '', '', ''
-            m = re.search(r'(\d+)', tamanho)
+            m = _RE_DIGITS.search(tamanho)
             num_val = int(m.group(1)) if m else 99999
             return (modelo.casefold(), _total_qtd(etq), cor.casefold(), num_val)
 
@@ -3922,14 +4237,24 @@ class ProcessadorEtiquetasShopee:
         faixa_lateral = 28
 
         # Abrir PDF de origem
-        pdfs_usados = set(e['caminho_pdf'] for e in etiquetas_shein)
-        docs_abertos = {p: fitz.open(p) for p in pdfs_usados}
+        # (reaproveita os documentos ja abertos por processar_shein). Um unico Document por
+        # caminho tambem importa para o show_pdf_page: ele embute cada pagina de origem uma
+        # so vez no doc_saida (cache Graftmaps/ShownPages por documento de origem).
+        # Abertura sob demanda, no mesmo laco das paginas: cada caminho e aberto uma vez.
+        docs_abertos = {}
+        docs_locais = []
 
         doc_saida = fitz.open()
 
         for idx, etq in enumerate(etiquetas_shein):
             pdf_path = etq['caminho_pdf']
-            doc_entrada = docs_abertos[pdf_path]
+            doc_entrada = docs_abertos.get(pdf_path)
+            if doc_entrada is None:
+                doc_entrada = self._open_docs.get(pdf_path)
+                if doc_entrada is None:
+                    doc_entrada = fitz.open(pdf_path)
+                    docs_locais.append(doc_entrada)
+                docs_abertos[pdf_path] = doc_entrada
             pag_etiq_idx = etq['pag_etiqueta_idx']
             clip_etiq = etq['clip_etiqueta']
             dados_danfe = etq['dados_danfe']
@@ -3937,6 +4262,8 @@ class ProcessadorEtiquetasShopee:
             tipo_par = etq.get('tipo_par', 'danfe')
 
             nova_pag = doc_saida.new_page(width=larg, height=alt)
+            # Textos e linhas da pagina acumulados num unico Shape (um commit por pagina)
+            shape = nova_pag.new_shape()
             etiq_larg = clip_etiq.width
             etiq_alt = clip_etiq.height
 
@@ -4030,29 +4357,20 @@ class ProcessadorEtiquetasShopee:
                 # --- Faixa lateral direita: barcode vertical + texto ---
                 x_lateral = larg - margem_dir - faixa_lateral
                 if chave:
-                    nova_pag.insert_text(
+                    shape.insert_text(
                         (larg - margem_dir - 5, margem_topo + 8),
                         "DANFE", fontsize=7, fontname=fonte_bold, color=preto, rotate=270
                     )
-                    nova_pag.insert_text(
+                    shape.insert_text(
                         (larg - margem_dir - 13, margem_topo + 8),
                         "Simplificado", fontsize=5, fontname=fonte, color=preto, rotate=270
                     )
-                    chave_fmt = ' '.join([chave[i:i+4] for i in range(0, len(chave), 4)])
-                    nova_pag.insert_text(
+                    chave_fmt = _formatar_chave(chave)
+                    shape.insert_text(
                         (x_lateral + 5, margem_topo + 8),
                         f"Chave: {chave_fmt}",
                         fontsize=4, fontname=fonte, color=preto, rotate=270
                     )
-                    try:
-                        svg_bytes = self._gerar_barcode_svg(chave)
-                        barcode_rect = fitz.Rect(
-                            x_lateral + 8, margem_topo + 10,
-                            x_lateral + faixa_lateral - 2, margem_topo + alt_etiqueta - 10
-                        )
-                        nova_pag.insert_image(barcode_rect, stream=svg_bytes, rotate=90)
-                    except Exception:
-                        pass
 
                 # --- Tabela de produtos no rodape ---
                 fs = self.fonte_produto
@@ -4062,70 +4380,61 @@ class ProcessadorEtiquetasShopee:
                 col_prod = margem_esq + 95
                 col_qtd = larg - margem_dir - 25
 
-                nova_pag.draw_line(
-                    (margem_esq, y), (larg - margem_dir, y), color=preto, width=0.8
-                )
+                shape.draw_line((margem_esq, y), (larg - margem_dir, y))
+                shape.finish(color=preto, width=0.8, closePath=False)
                 y += line_h
 
-                nova_pag.insert_text(
+                shape.insert_text(
                     (col_codigo, y), "CÓDIGO", fontsize=fs, fontname=fonte_bold, color=preto
                 )
                 header_prod = f"PROD. (NF: {nf} T-ITENS: {total_itens} T-QUANT: {total_qtd})"
-                nova_pag.insert_text(
+                shape.insert_text(
                     (col_prod, y), header_prod, fontsize=fs, fontname=fonte_bold, color=preto
                 )
-                nova_pag.insert_text(
+                shape.insert_text(
                     (col_qtd, y), "Q.", fontsize=fs, fontname=fonte_bold, color=preto
                 )
                 y += 2
-                nova_pag.draw_line(
-                    (margem_esq, y), (larg - margem_dir, y), color=preto, width=0.5
-                )
+                shape.draw_line((margem_esq, y), (larg - margem_dir, y))
+                shape.finish(color=preto, width=0.5, closePath=False)
                 y_top_tabela = margem_topo + alt_etiqueta + 3
                 y += line_h
 
                 fs_destaque = int(round(fs * 1.5))
                 fs_qtd = int(round(fs_destaque * 1.5))
+                insert_text = shape.insert_text
+
+                def _put(pos, txt, tamanho_fonte):
+                    insert_text(pos, txt, fontsize=tamanho_fonte, fontname=fonte_bold, color=preto)
+
                 for prod in produtos_shein[:5]:
-                    atrib = prod.get('atributos', '')
-                    modelo, cor, tamanho = self._parsear_atributos_shein(atrib)
-                    qtd = str(int(float(prod.get('qtd', '1'))))
-                    nova_pag.insert_text(
-                        (col_codigo, y), modelo, fontsize=fs_destaque, fontname=fonte_bold, color=preto
-                    )
+                    cor, tamanho = prod['cor'], prod['tamanho']
                     cor_tam = f"{cor},{tamanho}" if cor and tamanho else (cor or tamanho or '-')
-                    if len(cor_tam) > 30:
-                        cor_tam = cor_tam[:28] + '..'
-                    nova_pag.insert_text(
-                        (col_prod, y), cor_tam, fontsize=fs_destaque, fontname=fonte_bold, color=preto
-                    )
-                    nova_pag.insert_text(
-                        (col_qtd, y), qtd, fontsize=fs_qtd, fontname=fonte_bold, color=preto
-                    )
+                    _put((col_codigo, y), prod['modelo'], fs_destaque)
+                    _put((col_prod, y), cor_tam[:28] + '..' if len(cor_tam) > 30 else cor_tam, fs_destaque)
+                    _put((col_qtd, y), str(prod['qtd_int']), fs_qtd)
                     y += line_h
 
-                nova_pag.draw_line(
-                    (margem_esq, y), (larg - margem_dir, y), color=preto, width=0.8
-                )
-                nova_pag.draw_line(
-                    (col_prod - 5, y_top_tabela), (col_prod - 5, y), color=preto, width=0.5
-                )
-                nova_pag.draw_line(
-                    (col_qtd - 5, y_top_tabela), (col_qtd - 5, y), color=preto, width=0.5
-                )
+                shape.draw_line((margem_esq, y), (larg - margem_dir, y))
+                shape.finish(color=preto, width=0.8, closePath=False)
+                shape.draw_line((col_prod - 5, y_top_tabela), (col_prod - 5, y))
+                shape.finish(color=preto, width=0.5, closePath=False)
+                shape.draw_line((col_qtd - 5, y_top_tabela), (col_qtd - 5, y))
+                shape.finish(color=preto, width=0.5, closePath=False)
 
             # Numero de ordem (subido para nao cortar na impressao)
-            nova_pag.insert_text(
+            shape.insert_text(
                 (larg - margem_dir - 15, alt - margem_inf - 14),
                 f"p.{idx + 1}",
                 fontsize=9, fontname="hebo", color=(0.4, 0.4, 0.4)
             )
+            shape.commit()
 
-        for doc in docs_abertos.values():
+        for doc in docs_locais:
             doc.close()
 
         total = len(doc_saida)
-        doc_saida.save(caminho_saida)
+        doc_saida.save(caminho_saida, **_OPCOES_SAVE_PDF)
         doc_saida.close()
         print(f"    Shein PDF: {total} paginas geradas")
         return total
@@ -4133,11 +4442,38 @@ class ProcessadorEtiquetasShopee:
     # ----------------------------------------------------------------
     # GERACAO DO RESUMO XLSX
     # ----------------------------------------------------------------
+    @staticmethod
+    def _registrar_estilo_borda(wb, border):
+        """Registra no workbook o NamedStyle das celulas de dados (so borda fina).
+        Celulas com o mesmo estilo nomeado compartilham um unico registro de estilo."""
+        wb.add_named_style(NamedStyle(name='borda', border=border))
+        return 'borda'
+
+    @staticmethod
+    def _celula_estilo(ws, valor, **estilos):
+        """WriteOnlyCell com os estilos dados (font=, fill=, border=, alignment=)."""
+        cell = WriteOnlyCell(ws, value=valor)
+        for nome, estilo in estilos.items():
+            setattr(cell, nome, estilo)
+        return cell
+
+    @staticmethod
+    def _anexar_linha_estilo(ws, valores, estilo):
+        """Anexa uma linha (ws.append) com o estilo nomeado em todas as celulas."""
+        celulas = []
+        for valor in valores:
+            cell = WriteOnlyCell(ws, value=valor)
+            cell.style = estilo
+            celulas.append(cell)
+        ws.append(celulas)
+
     def gerar_resumo_xlsx(self, etiquetas, caminho_saida, nome_loja, sku_somente=False):
         """Gera resumo XLSX.
 
         - Padrao: SKU + Variacao + Quantidade (comportamento legado)
         - sku_somente=True: SKU + Quantidade (fluxo novo da automacao UpSeller)
+
+        Workbook write_only: larguras definidas antes e linhas anexadas ja estilizadas.
         """
         # Estilos compartilhados
         header_font = Font(bold=True, size=11)
@@ -4149,9 +4485,12 @@ class ProcessadorEtiquetasShopee:
             bottom=Side(style='thin')
         )
 
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = f"Resumo {len(etiquetas)} xmls "
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(f"Resumo {len(etiquetas)} xmls ")
+        estilo_borda = self._registrar_estilo_borda(wb, border)
+        _celula = self._celula_estilo
+        alinhar_esq = Alignment(horizontal='left')
+        fonte_total = Font(bold=True)
 
         def _salvar_planilha_e_preview():
             wb.save(caminho_saida)
@@ -4167,86 +4506,82 @@ class ProcessadorEtiquetasShopee:
 
         if sku_somente:
             sku_qtd = defaultdict(int)
+            total_geral = 0
             for etq in etiquetas:
                 dados = etq.get('dados_xml', {})
                 for prod in dados.get('produtos', []):
                     codigo = (prod.get('codigo', '') or '').strip() or 'SEM_SKU'
-                    qtd = int(float(prod.get('qtd', '1')))
+                    qtd = _qtd_int(prod.get('qtd', '1'))
                     sku_qtd[codigo] += qtd
+                    total_geral += qtd
 
-            ws['A1'] = 'Cod. SKU'
-            ws['B1'] = 'Soma Quant.'
-            for cell in [ws['A1'], ws['B1']]:
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.border = border
-                cell.alignment = Alignment(horizontal='left')
+            ws.column_dimensions['A'].width = 28
+            ws.column_dimensions['B'].width = 15
 
-            row = 2
+            ws.append([
+                _celula(ws, h, font=header_font, fill=header_fill, border=border, alignment=alinhar_esq)
+                for h in ('Cod. SKU', 'Soma Quant.')
+            ])
             for sku in sorted(sku_qtd.keys()):
-                ws.cell(row=row, column=1, value=sku).border = border
-                ws.cell(row=row, column=2, value=sku_qtd[sku]).border = border
-                row += 1
+                self._anexar_linha_estilo(ws, (sku, sku_qtd[sku]), estilo_borda)
 
-            ws.cell(row=row, column=1, value='TOTAL').font = Font(bold=True)
-            ws.cell(row=row, column=1).border = border
-            ws.cell(row=row, column=2, value=sum(sku_qtd.values())).font = Font(bold=True)
-            ws.cell(row=row, column=2).border = border
-
-            ws.column_dimensions['A'].width = 28
-            ws.column_dimensions['B'].width = 15
+            ws.append([
+                _celula(ws, 'TOTAL', font=fonte_total, border=border),
+                _celula(ws, total_geral, font=fonte_total, border=border),
+            ])
 
             _salvar_planilha_e_preview()
-            return len(sku_qtd), sum(sku_qtd.values())
+            return len(sku_qtd), total_geral
 
         # Contar quantidade por (SKU, Variacao) - modo legado
         sku_var_qtd = defaultdict(int)
+        total_geral = 0
         for etq in etiquetas:
             dados = etq.get('dados_xml', {})
             for prod in dados.get('produtos', []):
                 codigo = prod.get('codigo', '')
                 variacao = prod.get('variacao', '')
-                qtd = int(float(prod.get('qtd', '1')))
+                qtd = _qtd_int(prod.get('qtd', '1'))
                 if codigo or variacao:
                     chave = (codigo, variacao)
                     sku_var_qtd[chave] += qtd
+                    total_geral += qtd
 
-        ws['A1'] = 'Cod. SKU'
-        ws['B1'] = 'Variacao'
-        ws['C1'] = 'Soma Quant.'
-        for cell in [ws['A1'], ws['B1'], ws['C1']]:
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = border
-            cell.alignment = Alignment(horizontal='left')
+        ws.column_dimensions['A'].width = 25
+        ws.column_dimensions['B'].width = 40
+        ws.column_dimensions['C'].width = 15
+
+        ws.append([
+            _celula(ws, h, font=header_font, fill=header_fill, border=border, alignment=alinhar_esq)
+            for h in ('Cod. SKU', 'Variacao', 'Soma Quant.')
+        ])
+
+        # A mesma variacao (ex: 'Preto,38') se repete entre SKUs: chave calculada uma vez por texto
+        chave_por_var = {}
 
         def _sort_var(var):
-            partes = re.split(r'[,/]', var or '', maxsplit=1)
+            chave = chave_por_var.get(var)
+            if chave is not None:
+                return chave
+            partes = _RE_SPLIT_VAR.split(var or '', maxsplit=1)
             cor = partes[0].strip() if partes else ''
             num_str = partes[1].strip() if len(partes) > 1 else ''
-            m = re.search(r'(\d+)', num_str)
+            m = _RE_DIGITS.search(num_str)
             num_val = int(m.group(1)) if m else 99999
-            return (cor, num_val, num_str)
+            chave = chave_por_var[var] = (cor, num_val, num_str)
+            return chave
 
-        row = 2
         for (sku, var) in sorted(sku_var_qtd.keys(), key=lambda x: (x[0] or '', _sort_var(x[1]))):
-            ws.cell(row=row, column=1, value=sku).border = border
-            ws.cell(row=row, column=2, value=var).border = border
-            ws.cell(row=row, column=3, value=sku_var_qtd[(sku, var)]).border = border
-            row += 1
+            self._anexar_linha_estilo(ws, (sku, var, sku_var_qtd[(sku, var)]), estilo_borda)
 
-        ws.cell(row=row, column=1, value='TOTAL').font = Font(bold=True)
-        ws.cell(row=row, column=1).border = border
-        ws.cell(row=row, column=2, value='').border = border
-        ws.cell(row=row, column=3, value=sum(sku_var_qtd.values())).font = Font(bold=True)
-        ws.cell(row=row, column=3).border = border
-
-        ws.column_dimensions['A'].width = 25
-        ws.column_dimensions['B'].width = 40
-        ws.column_dimensions['C'].width = 15
+        ws.append([
+            _celula(ws, 'TOTAL', font=fonte_total, border=border),
+            _celula(ws, '', border=border),
+            _celula(ws, total_geral, font=fonte_total, border=border),
+        ])
 
         _salvar_planilha_e_preview()
-        return len(sku_var_qtd), sum(sku_var_qtd.values())
+        return len(sku_var_qtd), total_geral
 
     def gerar_imagem_resumo_xlsx(
         self,
@@ -4429,14 +4764,15 @@ class ProcessadorEtiquetasShopee:
         """Gera resumo XLSX de etiquetas Shein com Modelo, Cor, Tamanho, Quantidade."""
         # Agrupar por (modelo, cor, tamanho)
         modelo_cor_tam_qtd = defaultdict(int)
+        total_geral = 0
         for etq in etiquetas_shein:
             dados_danfe = etq.get('dados_danfe', {})
             for prod in dados_danfe.get('produtos_shein', []):
-                atrib = prod.get('atributos', '')
-                qtd = int(float(prod.get('qtd', '1')))
-                modelo, cor, tamanho = self._parsear_atributos_shein(atrib)
+                qtd = prod['qtd_int']
+                modelo, cor, tamanho = prod['modelo'], prod['cor'], prod['tamanho']
                 chave = (modelo or prod.get('descricao', '-'), cor, tamanho)
                 modelo_cor_tam_qtd[chave] += qtd
+                total_geral += qtd
 
         if not modelo_cor_tam_qtd:
             return 0, 0
@@ -4463,20 +4799,23 @@ class ProcessadorEtiquetasShopee:
             cell.fill = header_fill
             cell.border = border
             cell.alignment = Alignment(horizontal='left')
+        estilo_borda = self._registrar_estilo_borda(wb, border)
 
         # Ordenar: Modelo > Cor > Tamanho (numerico)
+        # Poucos tamanhos distintos (BR35/36, BR37/38...): numero extraido uma vez por tamanho
+        num_por_tamanho = {}
+
         def _sort_key(chave):
             modelo, cor, tamanho = chave
-            m = re.search(r'(\d+)', tamanho)
-            num_val = int(m.group(1)) if m else 99999
+            num_val = num_por_tamanho.get(tamanho)
+            if num_val is None:
+                m = _RE_DIGITS.search(tamanho)
+                num_val = num_por_tamanho[tamanho] = int(m.group(1)) if m else 99999
             return (modelo, cor, num_val, tamanho)
 
         row = 2
-        for (modelo, cor, tamanho) in sorted(modelo_cor_tam_qtd.keys(), key=_sort_key):
-            ws.cell(row=row, column=1, value=modelo).border = border
-            ws.cell(row=row, column=2, value=cor).border = border
-            ws.cell(row=row, column=3, value=tamanho).border = border
-            ws.cell(row=row, column=4, value=modelo_cor_tam_qtd[(modelo, cor, tamanho)]).border = border
+        for chave in sorted(modelo_cor_tam_qtd.keys(), key=_sort_key):
+            self._anexar_linha_estilo(ws, chave + (modelo_cor_tam_qtd[chave],), estilo_borda)
             row += 1
 
         # Total
@@ -4484,7 +4823,7 @@ class ProcessadorEtiquetasShopee:
         ws.cell(row=row, column=1).border = border
         ws.cell(row=row, column=2, value='').border = border
         ws.cell(row=row, column=3, value='').border = border
-        ws.cell(row=row, column=4, value=sum(modelo_cor_tam_qtd.values())).font = Font(bold=True)
+        ws.cell(row=row, column=4, value=total_geral).font = Font(bold=True)
         ws.cell(row=row, column=4).border = border
 
         ws.column_dimensions['A'].width = 20
@@ -4493,14 +4832,17 @@ class ProcessadorEtiquetasShopee:
         ws.column_dimensions['D'].width = 15
 
         wb.save(caminho_saida)
-        return len(modelo_cor_tam_qtd), sum(modelo_cor_tam_qtd.values())
+        return len(modelo_cor_tam_qtd), total_geral
 
     def gerar_resumo_geral_xlsx(self, lojas_info, etiquetas_por_cnpj, caminho_saida):
         """Gera resumo geral XLSX com totais de todas as lojas.
         lojas_info: list of dicts com nome, cnpj, etiquetas, skus, total_qtd
         etiquetas_por_cnpj: dict cnpj -> list de etiquetas
+
+        Workbook write_only: as linhas vao direto para o arquivo (a aba "SKUs por Loja"
+        pode ter todas as lojas x todos os SKUs).
         """
-        wb = openpyxl.Workbook()
+        wb = openpyxl.Workbook(write_only=True)
 
         # Estilos
         header_font = Font(bold=True, size=11)
@@ -4510,52 +4852,50 @@ class ProcessadorEtiquetasShopee:
             left=Side(style='thin'), right=Side(style='thin'),
             top=Side(style='thin'), bottom=Side(style='thin')
         )
+        estilo_borda = self._registrar_estilo_borda(wb, border)
+        _celula = self._celula_estilo
 
         # ---- Sheet 1: Resumo por Loja ----
-        ws1 = wb.active
-        ws1.title = "Resumo Geral"
+        ws1 = wb.create_sheet("Resumo Geral")
+        ws1.column_dimensions['A'].width = 30
+        ws1.column_dimensions['B'].width = 15
+        ws1.column_dimensions['C'].width = 12
+        ws1.column_dimensions['D'].width = 15
+
         headers = ['Loja', 'Etiquetas', 'SKUs', 'Unidades']
-        for col, h in enumerate(headers, 1):
-            cell = ws1.cell(row=1, column=col, value=h)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = border
-            cell.alignment = Alignment(horizontal='left')
+        ws1.append([
+            _celula(ws1, h, font=header_font, fill=header_fill, border=border,
+                    alignment=Alignment(horizontal='left'))
+            for h in headers
+        ])
 
-        row = 2
         sum_etiq = sum_skus = sum_un = 0
         for loja in sorted(lojas_info, key=lambda x: x['nome']):
-            ws1.cell(row=row, column=1, value=loja['nome']).border = border
-            ws1.cell(row=row, column=2, value=loja['etiquetas']).border = border
-            ws1.cell(row=row, column=3, value=loja['skus']).border = border
-            ws1.cell(row=row, column=4, value=loja['total_qtd']).border = border
+            self._anexar_linha_estilo(
+                ws1, (loja['nome'], loja['etiquetas'], loja['skus'], loja['total_qtd']), estilo_borda
+            )
             sum_etiq += loja['etiquetas']
             sum_skus += loja['skus']
             sum_un += loja['total_qtd']
-            row += 1
 
         # Linha total
-        for col, val in enumerate(['TOTAL', sum_etiq, sum_skus, sum_un], 1):
-            cell = ws1.cell(row=row, column=col, value=val)
-            cell.font = Font(bold=True, size=11)
-            cell.fill = total_fill
-            cell.border = border
-
-        ws1.column_dimensions['A'].width = 30
-        ws1.column_dimensions['B'].width = 15
-        ws1.column_dimensions['C'].width = 12
-        ws1.column_dimensions['D'].width = 15
+        ws1.append([
+            _celula(ws1, val, font=Font(bold=True, size=11), fill=total_fill, border=border)
+            for val in ['TOTAL', sum_etiq, sum_skus, sum_un]
+        ])
 
         # ---- Sheet 2: SKUs detalhados por Loja ----
         ws2 = wb.create_sheet("SKUs por Loja")
+        ws2.column_dimensions['A'].width = 30
+        ws2.column_dimensions['B'].width = 35
+        ws2.column_dimensions['C'].width = 15
+
         headers2 = ['Loja', 'Cod. SKU', 'Quantidade']
-        for col, h in enumerate(headers2, 1):
-            cell = ws2.cell(row=1, column=col, value=h)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.border = border
+        ws2.append([
+            _celula(ws2, h, font=header_font, fill=header_fill, border=border)
+            for h in headers2
+        ])
 
-        row2 = 2
         grand_total = 0
         for cnpj in sorted(etiquetas_por_cnpj.keys(), key=lambda c: self.get_nome_loja(c)):
             nome = self.get_nome_loja(cnpj)
@@ -4565,36 +4905,44 @@ class ProcessadorEtiquetasShopee:
                 dados = etq.get('dados_xml', {})
                 for prod in dados.get('produtos', []):
                     codigo = prod.get('codigo', '')
-                    qtd = int(float(prod.get('qtd', '1')))
+                    qtd = _qtd_int(prod.get('qtd', '1'))
                     if codigo:
                         sku_qtd[codigo] += qtd
 
             for sku in sorted(sku_qtd.keys()):
-                ws2.cell(row=row2, column=1, value=nome).border = border
-                ws2.cell(row=row2, column=2, value=sku).border = border
-                ws2.cell(row=row2, column=3, value=sku_qtd[sku]).border = border
+                self._anexar_linha_estilo(ws2, (nome, sku, sku_qtd[sku]), estilo_borda)
                 grand_total += sku_qtd[sku]
-                row2 += 1
 
         # Total geral
-        cell_t1 = ws2.cell(row=row2, column=1, value='TOTAL GERAL')
-        cell_t1.font = Font(bold=True)
-        cell_t1.fill = total_fill
-        cell_t1.border = border
-        ws2.cell(row=row2, column=2, value='').border = border
-        cell_t3 = ws2.cell(row=row2, column=3, value=grand_total)
-        cell_t3.font = Font(bold=True)
-        cell_t3.fill = total_fill
-        cell_t3.border = border
-
-        ws2.column_dimensions['A'].width = 30
-        ws2.column_dimensions['B'].width = 35
-        ws2.column_dimensions['C'].width = 15
+        ws2.append([
+            _celula(ws2, 'TOTAL GERAL', font=Font(bold=True), fill=total_fill, border=border),
+            _celula(ws2, '', border=border),
+            _celula(ws2, grand_total, font=Font(bold=True), fill=total_fill, border=border),
+        ])
 
         wb.save(caminho_saida)
         return len(lojas_info), sum_un
 
 
+def _extrair_quadrantes_cpf_worker(caminho_pdf):
+    """Ponto de entrada (picklable) para extrair os quadrantes de um PDF CPF num processo."""
+    return ProcessadorEtiquetasShopee()._extrair_quadrantes_cpf(caminho_pdf)
+
+
+def _extrair_pares_shein_worker(caminho_pdf):
+    """Ponto de entrada (picklable) para ler os pares de um PDF Shein num processo."""
+    doc = fitz.open(caminho_pdf)
+    try:
+        return ProcessadorEtiquetasShopee()._extrair_pares_shein(doc)
+    finally:
+        doc.close()
+
+
+def _ler_registros_xlsx_worker(caminho):
+    """Ponto de entrada (picklable) para ler um XLSX num processo do pool."""
+    return ProcessadorEtiquetasShopee()._ler_registros_xlsx(caminho)
+
+
 def main():
     """Funcao principal."""
 
@@ -4610,9 +4958,16 @@ def main():
         return
 
     # Listar arquivos
-    arquivos = os.listdir(pasta_entrada)
-    pdfs = [f for f in arquivos if f.lower().endswith('.pdf') and not f.startswith('etiquetas_prontas')]
-    zips = [f for f in arquivos if f.lower().endswith('.zip')]
+    pdfs = []
+    zips = []
+    with os.scandir(pasta_entrada) as entradas:
+        for entrada in entradas:
+            nome_lower = entrada.name.lower()
+            if nome_lower.endswith('.pdf'):
+                if not entrada.name.startswith('etiquetas_prontas'):
+                    pdfs.append(entrada.name)
+            elif nome_lower.endswith('.zip'):
+                zips.append(entrada.name)
 
     if not pdfs:
         print(f"\nNenhum PDF encontrado em: {pasta_entrada}")
@@ -4673,60 +5028,73 @@ def main():
     lojas = proc.separar_por_loja(todas_etiquetas)
 
     # 4. Criar pasta de saida
-    if not os.path.exists(pasta_saida):
-        os.makedirs(pasta_saida)
+    os.makedirs(pasta_saida, exist_ok=True)
+
+    # Um timestamp por execucao; cada pasta de loja e criada uma vez (o Shein reaproveita)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    pastas_criadas = set()
+
+    def _garantir_pasta(pasta):
+        if pasta not in pastas_criadas:
+            os.makedirs(pasta, exist_ok=True)
+            pastas_criadas.add(pasta)
 
     # 5. Gerar PDF e XLSX para cada loja
     print(f"\n{'='*40}")
     print("GERANDO ARQUIVOS POR LOJA...")
 
-    for cnpj, etiquetas_loja in lojas.items():
-        nome_loja = proc.get_nome_loja(cnpj)
-        n_etiquetas = len(etiquetas_loja)
-
-        print(f"\n  --- {nome_loja} ({n_etiquetas} etiquetas) ---")
-
+    def _gerar_arquivos_loja(nome_loja, etiquetas_loja):
         # Criar pasta da loja
         pasta_loja = os.path.join(pasta_saida, nome_loja)
-        if not os.path.exists(pasta_loja):
-            os.makedirs(pasta_loja)
+        _garantir_pasta(pasta_loja)
 
         # Todas as etiquetas juntas no mesmo PDF (regular, cpf, retirada)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        total_pags = 0
-        n_simples = n_multi = com_xml = sem_xml = 0
-
+        resultado_pdf = None
         if etiquetas_loja:
             caminho_pdf = os.path.join(pasta_loja, f"etiquetas_{nome_loja}_{timestamp}.pdf")
-            total_pags, n_simples, n_multi, com_xml, sem_xml = proc.gerar_pdf_loja(
-                etiquetas_loja, caminho_pdf
-            )
-            print(f"    PDF: {total_pags} paginas ({n_simples} simples + {n_multi} multi-produto)")
-            if sem_xml > 0:
-                print(f"    AVISO: {sem_xml} etiquetas sem XML correspondente")
+            with _FITZ_LOCK:
+                resultado_pdf = proc.gerar_pdf_loja(etiquetas_loja, caminho_pdf)
 
         # Gerar XLSX (inclui regular + CPF)
         caminho_xlsx = os.path.join(pasta_loja, f"resumo_{nome_loja}_{timestamp}.xlsx")
-        n_skus, total_qtd = proc.gerar_resumo_xlsx(etiquetas_loja, caminho_xlsx, nome_loja)
-        print(f"    XLSX: {n_skus} SKUs, {total_qtd} unidades vendidas")
+        resultado_xlsx = proc.gerar_resumo_xlsx(etiquetas_loja, caminho_xlsx, nome_loja)
+        return resultado_pdf, resultado_xlsx
+
+    # Lojas em paralelo: o XLSX (openpyxl/zip) de uma loja sobrepoe o PDF da outra
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(lojas)))) as executor:
+        futuros = []
+        for cnpj, etiquetas_loja in lojas.items():
+            nome_loja = proc.get_nome_loja(cnpj)
+            futuros.append((nome_loja, etiquetas_loja,
+                            executor.submit(_gerar_arquivos_loja, nome_loja, etiquetas_loja)))
+
+        for nome_loja, etiquetas_loja, futuro in futuros:
+            resultado_pdf, (n_skus, total_qtd) = futuro.result()
+
+            print(f"\n  --- {nome_loja} ({len(etiquetas_loja)} etiquetas) ---")
+            if resultado_pdf:
+                total_pags, n_simples, n_multi, com_xml, sem_xml = resultado_pdf
+                print(f"    PDF: {total_pags} paginas ({n_simples} simples + {n_multi} multi-produto)")
+                if sem_xml > 0:
+                    print(f"    AVISO: {sem_xml} etiquetas sem XML correspondente")
+            print(f"    XLSX: {n_skus} SKUs, {total_qtd} unidades vendidas")
 
     # 5b. Gerar PDF Shein separado (formato 150x225mm com barcode vertical)
     if etiquetas_shein:
         print(f"\n  --- Gerando PDF Shein ---")
-        # Agrupar shein por CNPJ
-        shein_por_cnpj = defaultdict(list)
-        for etq in etiquetas_shein:
-            shein_por_cnpj[etq.get('cnpj', '')].append(etq)
+        # Agrupar shein por CNPJ: uma ordenacao estavel + groupby (grupos contiguos)
+        def _cnpj_de(etq):
+            return etq.get('cnpj', '') or ''
 
-        for cnpj, etqs_shein in shein_por_cnpj.items():
+        for cnpj, grupo in groupby(sorted(etiquetas_shein, key=_cnpj_de), key=_cnpj_de):
+            etqs_shein = list(grupo)
             nome_loja_shein = proc.get_nome_loja(cnpj)
             pasta_loja_shein = os.path.join(pasta_saida, nome_loja_shein)
-            if not os.path.exists(pasta_loja_shein):
-                os.makedirs(pasta_loja_shein)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            _garantir_pasta(pasta_loja_shein)
             caminho_shein = os.path.join(pasta_loja_shein, f"shein_{nome_loja_shein}_{timestamp}.pdf")
             total_shein = proc.gerar_pdf_shein(etqs_shein, caminho_shein)
             print(f"    Shein {nome_loja_shein}: {total_shein} paginas")
+    proc.fechar_documentos()
 
     # 6. Resumo final
     print(f"\n{'='*60}")
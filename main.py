@@ -3,12 +3,83 @@
 Beka MKT - Sistema de Geração de Etiquetas
 Versão modular - Suporta múltiplos marketplaces
 """
+import io
+import logging
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 from pathlib import Path
 from parsers.shopee_parser import ShopeeParser
 from generators.etiqueta_pdf import EtiquetaPDFGenerator
 
+try:
+    from tqdm import tqdm
+except ImportError:  # barra de progresso opcional
+    tqdm = None
+
+logger = logging.getLogger("beka")
+
+
+def _progresso(iteravel, total):
+    """Envolve o iteravel numa barra tqdm (se instalado e com log em INFO ou mais detalhado)."""
+    if tqdm is None or not logger.isEnabledFor(logging.INFO):
+        return iteravel
+    return tqdm(iteravel, total=total, unit="xml")
+
+
+def _processar_xml(xml_path: Path, pasta_output: Path):
+    """Faz parse de um XML e gera seu PDF.
+
+    O PDF e gravado num arquivo temporario proprio do XML (varios XMLs do mesmo emitente
+    geram o mesmo etiqueta_<emitente>.pdf e rodam em paralelo); quem move para o nome
+    final e o processo principal, na ordem original. Retorna (pdf_final, pdf_tmp) ou None.
+    """
+    print(f"⏳ Processando: {xml_path.name}")
+    tmp_path = pasta_output / f".{xml_path.stem}.tmp.pdf"
+    
+    try:
+        # Parse do XML
+        parser = ShopeeParser(str(xml_path))
+        if not parser.parse():
+            print(f"  ❌ Erro ao fazer parse do XML")
+            return None
+        
+        # Info do parse
+        resumo = parser.get_resumo()
+        print(f"  📦 Marketplace: {resumo['marketplace']}")
+        print(f"  📦 Produtos: {resumo['total_produtos']} ({resumo['total_itens']} itens)")
+        
+        # Gera PDF
+        gerador = EtiquetaPDFGenerator(
+            produtos=parser.get_produtos(),
+            dados_envio=parser.get_dados_envio(),
+            nota_fiscal=parser.get_nota_fiscal()
+        )
+        
+        # Nome do PDF baseado no emitente
+        nome_emitente = parser.get_nome_emitente_limpo()
+        pdf_path = pasta_output / f"etiqueta_{nome_emitente}.pdf"
+        
+        gerador.gerar(str(tmp_path))
+        print(f"  ✅ PDF gerado: {pdf_path.name}\n")
+        return str(pdf_path), str(tmp_path)
+        
+    except Exception as e:
+        print(f"  ❌ Erro: {str(e)}\n")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return None
+
+
+def _processar_xml_worker(tarefa):
+    """Ponto de entrada (picklable) do pool: processa um XML e devolve (pdfs ou None, saida capturada)."""
+    xml_path, pasta_output = tarefa
+    buf = io.StringIO()
+    with redirect_stdout(buf):
+        pdfs = _processar_xml(Path(xml_path), Path(pasta_output))
+    return pdfs, buf.getvalue()
+
 
 def processar_pasta(pasta_xmls: str, pasta_output: str = "output"):
     """
@@ -28,80 +99,82 @@ def processar_pasta(pasta_xmls: str, pasta_output: str = "output"):
     xmls = list(pasta_xmls.glob("*.xml"))
     
     if not xmls:
-        print(f"❌ Nenhum arquivo XML encontrado em {pasta_xmls}")
+        logger.error(f"❌ Nenhum arquivo XML encontrado em {pasta_xmls}")
         return
     
-    print(f"📁 Encontrados {len(xmls)} arquivos XML")
-    print(f"📂 PDFs serão salvos em: {pasta_output.absolute()}\n")
-    
-    sucesso = 0
-    falhas = 0
+    logger.info(f"📁 Encontrados {len(xmls)} arquivos XML")
+    logger.info(f"📂 PDFs serão salvos em: {pasta_output.absolute()}\n")
     
-    for xml_path in xmls:
-        print(f"⏳ Processando: {xml_path.name}")
-        
+    # Cada XML e independente: processa em paralelo; as saidas vao para o log na ordem original
+    tarefas = [(str(xml_path), str(pasta_output)) for xml_path in xmls]
+    resultados = None
+    if len(tarefas) > 1:
         try:
-            # Parse do XML
-            parser = ShopeeParser(str(xml_path))
-            if not parser.parse():
-                print(f"  ❌ Erro ao fazer parse do XML")
-                falhas += 1
-                continue
-            
-            # Info do parse
-            resumo = parser.get_resumo()
-            print(f"  📦 Marketplace: {resumo['marketplace']}")
-            print(f"  📦 Produtos: {resumo['total_produtos']} ({resumo['total_itens']} itens)")
-            
-            # Gera PDF
-            gerador = EtiquetaPDFGenerator(
-                produtos=parser.get_produtos(),
-                dados_envio=parser.get_dados_envio(),
-                nota_fiscal=parser.get_nota_fiscal()
-            )
-            
-            # Nome do PDF baseado no emitente
-            nome_emitente = parser.get_nome_emitente_limpo()
-            pdf_path = pasta_output / f"etiqueta_{nome_emitente}.pdf"
-            
-            gerador.gerar(str(pdf_path))
-            print(f"  ✅ PDF gerado: {pdf_path.name}\n")
-            sucesso += 1
-            
+            max_workers = min(len(tarefas), os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                resultados = list(_progresso(
+                    executor.map(_processar_xml_worker, tarefas, chunksize=4), len(tarefas)
+                ))
         except Exception as e:
-            print(f"  ❌ Erro: {str(e)}\n")
-            falhas += 1
-            continue
+            logger.warning(f"⚠️  Processamento paralelo indisponível ({e}), processando em sequência\n")
+            resultados = None
+    
+    if resultados is None:
+        resultados = [_processar_xml_worker(t) for t in _progresso(tarefas, len(tarefas))]
+    
+    # Detalhe por arquivo so em DEBUG (--verbose); falhas sempre aparecem
+    # Cada PDF vai para o nome final na ordem dos XMLs: com nomes repetidos, o ultimo vence
+    sucesso = 0
+    for pdfs, saida in resultados:
+        if pdfs:
+            pdf_path, tmp_path = pdfs
+            os.replace(tmp_path, pdf_path)
+            sucesso += 1
+            logger.debug(saida.rstrip("\n"))
+        else:
+            logger.warning(saida.rstrip("\n"))
+    falhas = len(resultados) - sucesso
     
     # Resumo final
-    print("="*50)
-    print(f"✅ Sucesso: {sucesso}")
-    print(f"❌ Falhas: {falhas}")
-    print(f"📊 Total: {len(xmls)}")
-    print("="*50)
+    logger.info("="*50)
+    logger.info(f"✅ Sucesso: {sucesso}")
+    logger.info(f"❌ Falhas: {falhas}")
+    logger.info(f"📊 Total: {len(xmls)}")
+    logger.info("="*50)
 
 
 def main():
     """Ponto de entrada do programa"""
-    print("="*50)
-    print("  BEKA MKT - Gerador de Etiquetas v2.0")
-    print("  Sistema Modular Multi-Marketplace")
-    print("="*50)
-    print()
-    
-    if len(sys.argv) < 2:
-        print("Uso: python main.py <pasta_xmls> [pasta_output]")
+    flags = {a for a in sys.argv[1:] if a.startswith("-")}
+    args = [a for a in sys.argv[1:] if not a.startswith("-")]
+    
+    nivel = logging.INFO
+    if "--quiet" in flags or "-q" in flags:
+        nivel = logging.WARNING
+    elif "--verbose" in flags or "-v" in flags:
+        nivel = logging.DEBUG
+    logging.basicConfig(level=nivel, format="%(message)s", stream=sys.stdout)
+    
+    logger.info("="*50)
+    logger.info("  BEKA MKT - Gerador de Etiquetas v2.0")
+    logger.info("  Sistema Modular Multi-Marketplace")
+    logger.info("="*50)
+    logger.info("")
+    
+    if len(args) < 1:
+        print("Uso: python main.py [--quiet | --verbose] <pasta_xmls> [pasta_output]")
         print()
         print("Exemplos:")
         print("  python main.py xmls_extraidos")
         print("  python main.py xmls_extraidos output_personalizado")
+        print("  python main.py --quiet xmls_extraidos")
         sys.exit(1)
     
-    pasta_xmls = sys.argv[1]
-    pasta_output = sys.argv[2] if len(sys.argv) > 2 else "output"
+    pasta_xmls = args[0]
+    pasta_output = args[1] if len(args) > 1 else "output"
     
     if not os.path.exists(pasta_xmls):
-        print(f"❌ Pasta não encontrada: {pasta_xmls}")
+        logger.error(f"❌ Pasta não encontrada: {pasta_xmls}")
         sys.exit(1)
     
     processar_pasta(pasta_xmls, pasta_output)
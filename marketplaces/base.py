@@ -1,10 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
+import gzip
+import hashlib
+import json
+import os
+import time
 from dataclasses import dataclass
-from typing import List, Dict, Any, Optional, Protocol
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Protocol, Tuple
 
+import fitz  # PyMuPDF
 
-@dataclass
+
+@dataclass(slots=True)
 class DetectedDoc:
     kind: str
     confidence: float
@@ -12,7 +20,7 @@ class DetectedDoc:
     source_path: str
 
 
-@dataclass
+@dataclass(slots=True)
 class ExtractedEtiqueta:
     cnpj: str
     nf: str
@@ -30,3 +38,93 @@ class MarketplaceDriver(Protocol):
 
     def extract(self, doc: DetectedDoc) -> List[ExtractedEtiqueta]:
         ...
+
+
+# Cache em disco dos textos por pagina, endereçado pelo conteudo do PDF (sobrevive entre
+# execucoes). Opcional: so liga com BEKA_CACHE_DIR definido (uso no CLI). Os textos tem dados
+# de destinatarios, entao as entradas expiram por idade e o diretorio tem tamanho maximo.
+PAGES_CACHE_DIR = os.environ.get("BEKA_CACHE_DIR") or None
+PAGES_CACHE_MAX_AGE_S = float(os.environ.get("BEKA_CACHE_MAX_HORAS", "24")) * 3600
+PAGES_CACHE_MAX_BYTES = int(float(os.environ.get("BEKA_CACHE_MAX_MB", "100")) * 1024 * 1024)
+
+
+def _pages_cache_path(pdf_path: str) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    with open(pdf_path, "rb") as f:
+        for bloco in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloco)
+    return os.path.join(PAGES_CACHE_DIR, h.hexdigest() + ".json.gz")
+
+
+def _ler_textos_cache(cache_path: str) -> Optional[List[str]]:
+    try:
+        with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+            textos = json.load(f)
+        return textos if isinstance(textos, list) else None
+    except (OSError, EOFError, ValueError):
+        return None
+
+
+def _limpar_cache_paginas() -> None:
+    """Remove entradas vencidas (PAGES_CACHE_MAX_AGE_S) e as mais antigas acima do limite de tamanho."""
+    try:
+        entradas = []
+        with os.scandir(PAGES_CACHE_DIR) as it:
+            for e in it:
+                if e.is_file():
+                    st = e.stat()
+                    entradas.append((st.st_mtime, st.st_size, e.path))
+    except OSError:
+        return
+    limite_idade = time.time() - PAGES_CACHE_MAX_AGE_S
+    total = sum(tam for _, tam, _ in entradas)
+    for mtime, tam, caminho in sorted(entradas):
+        if mtime >= limite_idade and total <= PAGES_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(caminho)
+            total -= tam
+        except OSError:
+            pass
+
+
+def _gravar_textos_cache(cache_path: str, textos: List[str]) -> None:
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=3) as f:
+            json.dump(textos, f, ensure_ascii=False)
+        os.replace(tmp, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    _limpar_cache_paginas()
+
+
+@lru_cache(maxsize=64)
+def _load_pages(pdf_path: str, mtime_ns: int, size: int) -> Tuple[Tuple[str, str], ...]:
+    # Sem cache em disco, nem le/hasheia o arquivo a toa
+    cache_path = _pages_cache_path(pdf_path) if PAGES_CACHE_DIR else None
+    textos = _ler_textos_cache(cache_path) if cache_path else None
+    if textos is None:
+        doc = fitz.open(pdf_path)
+        try:
+            textos = [page.get_text("text") for page in doc]
+        finally:
+            doc.close()
+        if cache_path:
+            _gravar_textos_cache(cache_path, textos)
+    return tuple((tx, tx.upper()) for tx in textos)
+
+
+def load_pages(pdf_path: str) -> Tuple[Tuple[str, str], ...]:
+    """Texto de cada pagina do PDF como (texto, TEXTO_MAIUSCULO).
+
+    Extraido uma vez por arquivo e compartilhado entre os detect()/extract() dos drivers;
+    mtime e tamanho entram na chave para invalidar quando o arquivo muda. Com BEKA_CACHE_DIR
+    definido, entre execucoes (e entre workers) os textos vem do cache em disco (hash do conteudo).
+    """
+    st = os.stat(pdf_path)
+    return _load_pages(pdf_path, st.st_mtime_ns, st.st_size)
@@ -3,9 +3,7 @@ from __future__ import annotations
 import os
 from typing import Optional, List
 
-import fitz
-
-from .base import DetectedDoc, ExtractedEtiqueta
+from .base import DetectedDoc, ExtractedEtiqueta, load_pages
 
 
 class GenericFallbackDriver:
@@ -19,9 +17,8 @@ class GenericFallbackDriver:
 
     def extract(self, doc: DetectedDoc) -> List[ExtractedEtiqueta]:
         pdf_path = doc.source_path
-        d = fitz.open(pdf_path)
         etqs = []
-        for i in range(len(d)):
+        for i in range(len(load_pages(pdf_path))):
             etqs.append(ExtractedEtiqueta(
                 cnpj="",
                 nf="?",
@@ -30,5 +27,4 @@ class GenericFallbackDriver:
                 dados_xml={"produtos": []},
                 tipo_especial="normal",
             ))
-        d.close()
         return etqs
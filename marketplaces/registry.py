@@ -5,6 +5,12 @@ from .base import MarketplaceDriver, DetectedDoc
 
 _DRIVERS: List[MarketplaceDriver] = []
 
+# Confianca a partir da qual a deteccao para no primeiro driver (ordem de registro)
+STRONG_CONFIDENCE = 0.95
+
+# Assinatura do PDF; a especificacao tolera lixo antes dela dentro do primeiro 1 KB
+PDF_MAGIC = b"%PDF-"
+
 
 def register(driver: MarketplaceDriver) -> None:
     _DRIVERS.append(driver)
@@ -14,13 +20,26 @@ def drivers() -> List[MarketplaceDriver]:
     return list(_DRIVERS)
 
 
+def _parece_pdf(pdf_path: str) -> bool:
+    try:
+        with open(pdf_path, "rb") as f:
+            return PDF_MAGIC in f.read(1024)
+    except OSError:
+        return False
+
+
 def detect_best(pdf_path: str) -> Optional[DetectedDoc]:
+    # Pre-filtro barato: arquivo que nem e PDF nao chega ao PyMuPDF de nenhum driver
+    if not _parece_pdf(pdf_path):
+        return None
     best = None
     for d in _DRIVERS:
         try:
             r = d.detect(pdf_path)
             if not r:
                 continue
+            if r.confidence >= STRONG_CONFIDENCE:
+                return r
             if (best is None) or (r.confidence > best.confidence):
                 best = r
         except Exception:
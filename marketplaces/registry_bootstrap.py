@@ -5,15 +5,14 @@ from .tiktok_shop import TikTokShopDriver
 from .temu import TemuDriver
 from .generic_fallback import GenericFallbackDriver
 
-_BOOTSTRAPPED = False
+# Registro no corpo do modulo: o lock de import do Python garante uma unica execucao,
+# mesmo com varias threads importando ao mesmo tempo.
+# Ordem de prioridade do detect_best: mais frequente primeiro, fallback por ultimo
+register(ShopeeDanfeDriver())
+register(TikTokShopDriver())
+register(TemuDriver())
+register(GenericFallbackDriver())
 
 
 def bootstrap_drivers():
-    global _BOOTSTRAPPED
-    if _BOOTSTRAPPED:
-        return
-    register(ShopeeDanfeDriver())
-    register(TikTokShopDriver())
-    register(TemuDriver())
-    register(GenericFallbackDriver())
-    _BOOTSTRAPPED = True
+    """Mantido por compatibilidade: os drivers ja sao registrados na importacao do modulo."""
@@ -3,13 +3,25 @@ from __future__ import annotations
 import re
 from typing import Optional, List, Dict, Any
 
-import fitz  # PyMuPDF
-
-from .base import DetectedDoc, ExtractedEtiqueta
+from .base import DetectedDoc, ExtractedEtiqueta, load_pages
 
 RE_TRACK = re.compile(r"\b(BR\d{10,})\b", re.IGNORECASE)
-RE_PEDIDO = re.compile(r"\bPEDIDO\s*[:#]?\s*([A-Z0-9]{8,})\b", re.IGNORECASE)
-RE_RETIRADA = re.compile(r"\bRETIRADA\s*(PELO)?\s*COMPRADOR\b", re.IGNORECASE)
+RE_NF = re.compile(r"\bNF[:\s]*([0-9]{3,})\b", re.IGNORECASE)
+RE_PROD_LINE = re.compile(r"^\s*(\d+)\s+(\S+)\s+(.+)$")
+RE_NUM = re.compile(r"\d+[.,]?\d*")
+RE_VARIACAO = re.compile(r"(.+)\s+([^\s]+,[^\s]+)\s*$")
+# Track, pedido e retirada numa so alternancia (um finditer por pagina).
+# O valor do pedido fica num lookahead para nao consumir um track logo apos "PEDIDO:".
+RE_PAGINA = re.compile(
+    r"\b(?P<track>BR\d{10,})\b"
+    r"|\bPEDIDO\s*[:#]?\s*(?=(?P<pedido>[A-Z0-9]{8,})\b)"
+    r"|(?P<ret>\bRETIRADA\s*(?:PELO)?\s*COMPRADOR\b)",
+    re.IGNORECASE,
+)
+
+# Ancoras testadas no texto ja em maiusculas (calculado uma vez por pagina em load_pages)
+ANCORA_ETIQUETA = "DANFE SIMPLIFICADO - ETIQUETA"
+ANCORAS_DECLARACAO = ("DECLARAÇÃO DE CONTEÚDO", "DECLARACAO DE CONTEUDO")
 
 
 class ShopeeDanfeDriver:
@@ -18,24 +30,19 @@ class ShopeeDanfeDriver:
 
     def detect(self, pdf_path: str) -> Optional[DetectedDoc]:
         try:
-            doc = fitz.open(pdf_path)
-            sample = ""
-            for i in range(min(3, len(doc))):
-                sample += "\n" + (doc[i].get_text("text") or "")
-            doc.close()
-
-            up = sample.upper()
+            # Testa as ancoras pagina a pagina, sem montar a amostra concatenada
+            amostra = load_pages(pdf_path)[:3]
             score = 0.0
 
-            if "DANFE SIMPLIFICADO - ETIQUETA" in up:
+            if any(ANCORA_ETIQUETA in up for _, up in amostra):
                 score += 0.65
-            if ("DECLARAÇÃO DE CONTEÚDO" in up) or ("DECLARACAO DE CONTEUDO" in up):
+            if any(_eh_declaracao(up) for _, up in amostra):
                 score += 0.25
-            if RE_TRACK.search(sample):
+            if any(RE_TRACK.search(tx) for tx, _ in amostra):
                 score += 0.10
 
             if score >= 0.70:
-                tracks = sorted(set(t.upper() for t in RE_TRACK.findall(sample)))
+                tracks = sorted(set(t.upper() for tx, _ in amostra for t in RE_TRACK.findall(tx)))
                 return DetectedDoc(
                     kind=self.kind,
                     confidence=min(score, 1.0),
@@ -48,56 +55,37 @@ class ShopeeDanfeDriver:
 
     def extract(self, docdet: DetectedDoc) -> List[ExtractedEtiqueta]:
         pdf_path = docdet.source_path
-        doc = fitz.open(pdf_path)
+        paginas = load_pages(pdf_path)
 
+        # Uma unica passada: paginas de etiqueta, tracks e produtos das declaracoes
         label_pages = []
-        decl_pages = []
-        tracks_by_page = {}
-        pedido_by_page = {}
-        retirada_by_page = {}
-
-        for i in range(len(doc)):
-            tx = doc[i].get_text("text") or ""
-            up = tx.upper()
-
-            if "DANFE SIMPLIFICADO - ETIQUETA" in up:
-                label_pages.append(i)
-            if ("DECLARAÇÃO DE CONTEÚDO" in up) or ("DECLARACAO DE CONTEUDO" in up):
-                decl_pages.append(i)
-
-            tracks = sorted(set(t.upper() for t in RE_TRACK.findall(tx)))
-            if tracks:
-                tracks_by_page[i] = tracks
-
-            mp = RE_PEDIDO.search(tx)
-            if mp:
-                pedido_by_page[i] = mp.group(1).strip()
-
-            retirada_by_page[i] = bool(RE_RETIRADA.search(tx))
-
+        scan_por_pagina = []
         produtos_por_track: Dict[str, List[Dict[str, Any]]] = {}
         produtos_global: List[Dict[str, Any]] = []
 
-        for i in decl_pages:
-            tx = doc[i].get_text("text") or ""
-            prods = _parse_declaracao_produtos(tx)
-            if not prods:
-                continue
-            tracks = tracks_by_page.get(i, [])
-            if tracks:
-                for tr in tracks:
-                    produtos_por_track.setdefault(tr, []).extend(prods)
-            else:
-                produtos_global.extend(prods)
+        for i, (tx, up) in enumerate(paginas):
+            scan = _scan_pagina(tx)
+            scan_por_pagina.append(scan)
+            tracks = scan[0]
+
+            if ANCORA_ETIQUETA in up:
+                label_pages.append(i)
+            if _eh_declaracao(up):
+                prods = _parse_declaracao_produtos(tx, up)
+                if not prods:
+                    continue
+                if tracks:
+                    for tr in tracks:
+                        produtos_por_track.setdefault(tr, []).extend(prods)
+                else:
+                    produtos_global.extend(prods)
 
         etiquetas: List[ExtractedEtiqueta] = []
-        pages = label_pages or list(range(len(doc)))
+        pages = label_pages or range(len(paginas))
 
         for i in pages:
-            tx = doc[i].get_text("text") or ""
-            tracks = tracks_by_page.get(i, [])
-            pedido = pedido_by_page.get(i, "")
-            retirada = retirada_by_page.get(i, False)
+            tx = paginas[i][0]
+            tracks, pedido, retirada = scan_por_pagina[i]
 
             produtos = []
             for tr in tracks:
@@ -125,66 +113,107 @@ class ShopeeDanfeDriver:
                 )
             )
 
-        doc.close()
         return etiquetas
 
 
+def _scan_pagina(text: str):
+    """(tracks ordenados, primeiro pedido, retirada?) numa unica passada do RE_PAGINA."""
+    tracks = set()
+    pedido = ""
+    retirada = False
+    for m in RE_PAGINA.finditer(text):
+        g = m.lastgroup
+        if g == "track":
+            tracks.add(m.group("track").upper())
+        elif g == "pedido":
+            if not pedido:
+                pedido = m.group("pedido")
+        else:
+            retirada = True
+    return sorted(tracks), pedido, retirada
+
+
+def _eh_declaracao(up: str) -> bool:
+    return ANCORAS_DECLARACAO[0] in up or ANCORAS_DECLARACAO[1] in up
+
+
 def _guess_nf(text: str) -> str:
-    m = re.search(r"\bNF[:\s]*([0-9]{3,})\b", text, re.IGNORECASE)
+    m = RE_NF.search(text)
     return m.group(1) if m else "?"
 
 
-def _parse_declaracao_produtos(text: str) -> List[Dict[str, Any]]:
-    lines = [l.strip() for l in (text or "").splitlines() if l.strip()]
+def _cortar_num_final(texto: str, m: re.Match) -> str:
+    """Remove o numero do match (e o espaco antes) se ele fecha o texto."""
+    ini = m.start()
+    if ini > 0 and texto[ini - 1].isspace() and not texto[m.end():].strip():
+        return texto[:ini].rstrip()
+    return texto
+
+
+def _parse_declaracao_produtos(text: str, up: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Produtos da tabela da declaracao. `up` e text.upper(), se o chamador ja o tiver.
+
+    Trabalha sobre o texto plano da pagina (o mesmo do cache de load_pages, em memoria e
+    em disco) de proposito: um caminho via page.get_text("dict") exigiria reabrir o PDF
+    a cada extract e nao aproveitaria o cache entre execucoes.
+    """
+    text = text or ""
+    if up is None:
+        up = text.upper()
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    # Maiusculas calculadas uma vez para a pagina; linha a linha alinhada com `lines`
+    up_lines = [l.strip() for l in up.splitlines() if l.strip()]
 
     hdr = -1
-    for idx, l in enumerate(lines):
-        up = l.upper()
-        if ("CODIGO" in up or "CÓDIGO" in up) and ("DESCRICAO" in up or "DESCRIÇÃO" in up) and ("QTD" in up or "Q." in up):
-            hdr = idx
-            break
-        if ("Nº" in up or "NO" in up) and ("CODIGO" in up or "CÓDIGO" in up) and ("DESCRICAO" in up or "DESCRIÇÃO" in up):
+    for idx, u in enumerate(up_lines):
+        # Os dois formatos de cabecalho exigem CODIGO: rejeita o resto sem outros testes
+        if "CODIGO" not in u and "CÓDIGO" not in u:
+            continue
+        if "DESCRICAO" not in u and "DESCRIÇÃO" not in u:
+            continue
+        if "QTD" in u or "Q." in u or "Nº" in u or "NO" in u:
             hdr = idx
             break
 
     if hdr < 0:
         return []
 
-    data = lines[hdr + 1:]
-    cleaned = []
-    for l in data:
-        up = l.upper()
-        if up.startswith("P.") or "ASSINATURA" in up:
-            break
-        cleaned.append(l)
-
+    # Linhas de produto ate o rodape ("P." / ASSINATURA); metodos dos regex ligados fora do laco
+    casar_linha = RE_PROD_LINE.match
+    numeros = RE_NUM.finditer
+    buscar_variacao = RE_VARIACAO.search
     prods: List[Dict[str, Any]] = []
-    for l in cleaned:
-        m = re.match(r"^\s*(\d+)\s+(\S+)\s+(.+)$", l)
+    adicionar = prods.append
+    for l, u in zip(lines[hdr + 1:], up_lines[hdr + 1:]):
+        if u.startswith("P.") or "ASSINATURA" in u:
+            break
+        m = casar_linha(l)
         if not m:
             continue
-        _, sku, tail = m.group(1), m.group(2), m.group(3)
-        nums = re.findall(r"(\d+[.,]?\d*)", tail)
-        qtd = "1"
-        if len(nums) >= 2:
-            qtd = nums[-2]
+        sku, tail = m.group(2), m.group(3)
+        nums = list(numeros(tail))
 
+        # Tira os dois numeros finais (qtd e valor) pelos spans do proprio finditer
+        qtd = "1"
         tail_wo = tail
         if len(nums) >= 2:
-            tail_wo = re.sub(r"\s+" + re.escape(nums[-1]) + r"\s*$", "", tail_wo)
-            tail_wo = re.sub(r"\s+" + re.escape(nums[-2]) + r"\s*$", "", tail_wo)
+            qtd = str(int(nums[-2].group().replace(",", ".").split(".")[0]))
+            tail_wo = _cortar_num_final(tail_wo, nums[-1])
+            tail_wo = _cortar_num_final(tail_wo, nums[-2])
         descricao = tail_wo.strip()
 
+        # A variacao ("Cor,Tam") exige virgula: sem ela o regex nem roda
         variacao = ""
-        mm = re.search(r"(.+)\s+([^\s]+,[^\s]+)\s*$", descricao)
-        if mm:
-            descricao = mm.group(1).strip()
-            variacao = mm.group(2).strip()
-
-        prods.append({
-            "codigo": sku.strip(),
+        if "," in descricao:
+            mm = buscar_variacao(descricao)
+            if mm:
+                descricao = mm.group(1).strip()
+                variacao = mm.group(2).strip()
+
+        adicionar({
+            "codigo": sku,
             "variacao": variacao,
-            "qtd": str(int(float(qtd.replace(",", ".")))) if qtd else "1",
+            "qtd": qtd,
             "descricao": descricao[:80],
         })
 
@@ -3,9 +3,7 @@ from __future__ import annotations
 import re
 from typing import Optional, List, Dict, Any
 
-import fitz
-
-from .base import DetectedDoc, ExtractedEtiqueta
+from .base import DetectedDoc, ExtractedEtiqueta, load_pages
 
 
 class TemuDriver:
@@ -14,13 +12,8 @@ class TemuDriver:
 
     def detect(self, pdf_path: str) -> Optional[DetectedDoc]:
         try:
-            doc = fitz.open(pdf_path)
-            sample = ""
-            for i in range(min(2, len(doc))):
-                sample += "\n" + (doc[i].get_text("text") or "")
-            doc.close()
-
-            up = sample.upper()
+            amostra = load_pages(pdf_path)[:2]
+            up = "".join("\n" + u for _, u in amostra)
             score = 0.0
 
             if "TEMU" in up:
@@ -43,11 +36,9 @@ class TemuDriver:
 
     def extract(self, docdet: DetectedDoc) -> List[ExtractedEtiqueta]:
         pdf_path = docdet.source_path
-        doc = fitz.open(pdf_path)
         etqs: List[ExtractedEtiqueta] = []
 
-        for i in range(len(doc)):
-            tx = doc[i].get_text("text") or ""
+        for i, (tx, _) in enumerate(load_pages(pdf_path)):
             produtos = _parse_produtos_temu(tx)
             etqs.append(ExtractedEtiqueta(
                 cnpj="",
@@ -58,7 +49,6 @@ class TemuDriver:
                 tipo_especial="normal",
             ))
 
-        doc.close()
         return etqs
 
 
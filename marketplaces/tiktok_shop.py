@@ -3,9 +3,7 @@ from __future__ import annotations
 import re
 from typing import Optional, List, Dict, Any
 
-import fitz
-
-from .base import DetectedDoc, ExtractedEtiqueta
+from .base import DetectedDoc, ExtractedEtiqueta, load_pages
 
 RE_TRACK_GENERIC = re.compile(r"\b([A-Z]{2}\d{9,}|BR\d{10,})\b")
 
@@ -16,13 +14,9 @@ class TikTokShopDriver:
 
     def detect(self, pdf_path: str) -> Optional[DetectedDoc]:
         try:
-            doc = fitz.open(pdf_path)
-            sample = ""
-            for i in range(min(2, len(doc))):
-                sample += "\n" + (doc[i].get_text("text") or "")
-            doc.close()
-
-            up = sample.upper()
+            amostra = load_pages(pdf_path)[:2]
+            sample = "".join("\n" + tx for tx, _ in amostra)
+            up = "".join("\n" + u for _, u in amostra)
             score = 0.0
 
             if "TIKTOK" in up:
@@ -47,11 +41,9 @@ class TikTokShopDriver:
 
     def extract(self, docdet: DetectedDoc) -> List[ExtractedEtiqueta]:
         pdf_path = docdet.source_path
-        doc = fitz.open(pdf_path)
         etqs: List[ExtractedEtiqueta] = []
 
-        for i in range(len(doc)):
-            tx = doc[i].get_text("text") or ""
+        for i, (tx, _) in enumerate(load_pages(pdf_path)):
             produtos = _parse_produtos_generic(tx)
             etqs.append(ExtractedEtiqueta(
                 cnpj="",
@@ -62,7 +54,6 @@ class TikTokShopDriver:
                 tipo_especial="normal",
             ))
 
-        doc.close()
         return etqs
 
 
@@ -7,8 +7,12 @@ Inclui: Users, Sessions, Payments, WhatsAppContacts, Schedules, UpSellerConfig,
 import os
 import uuid
 import json
+import sqlite3
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, func
+from sqlalchemy.engine import Engine
 
 # Fuso horario de Brasilia (UTC-3)
 _FUSO_BRASILIA = timezone(timedelta(hours=-3))
@@ -17,15 +21,90 @@ _FUSO_BRASILIA = timezone(timedelta(hours=-3))
 def _agora_brasil():
     """Retorna datetime atual no fuso de Brasilia (UTC-3), sem tzinfo (naive)."""
     return datetime.now(_FUSO_BRASILIA).replace(tzinfo=None)
-from flask_bcrypt import Bcrypt
-from cryptography.fernet import Fernet
+import hashlib
+import hmac
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+import bcrypt
+from cryptography.fernet import Fernet, MultiFernet
 
 db = SQLAlchemy()
-bcrypt = Bcrypt()
+
+# Custo do bcrypt: BCRYPT_ROUNDS fixa; senao e calibrado na CPU do deploy para o hash
+# levar ate BCRYPT_TARGET_MS (cada +1 no custo dobra o tempo)
+_BCRYPT_MIN_ROUNDS = 10
+_BCRYPT_MAX_ROUNDS = 13
+
+
+@lru_cache(maxsize=1)
+def bcrypt_rounds():
+    """Custo usado em novos hashes (calculado uma vez por processo)."""
+    fixo = os.environ.get("BCRYPT_ROUNDS", "").strip()
+    if fixo.isdigit():
+        return max(4, min(31, int(fixo)))
+    alvo = float(os.environ.get("BCRYPT_TARGET_MS", "120") or 120) / 1000.0
+    inicio = time.perf_counter()
+    bcrypt.hashpw(b"calibracao", bcrypt.gensalt(rounds=_BCRYPT_MIN_ROUNDS))
+    tempo = max(time.perf_counter() - inicio, 1e-6)
+    extra = math.floor(math.log2(alvo / tempo)) if alvo > tempo else 0
+    return max(_BCRYPT_MIN_ROUNDS, min(_BCRYPT_MAX_ROUNDS, _BCRYPT_MIN_ROUNDS + extra))
+
+# Cache de verificacoes de senha BEM-SUCEDIDAS (so em memoria, por processo): evita refazer
+# o bcrypt em verificacoes repetidas dentro de poucos segundos. A chave usa HMAC da senha com
+# um pepper (BCRYPT_CACHE_PEPPER ou aleatorio por processo), nunca a senha em claro.
+_SENHA_CACHE_TTL = 60
+_SENHA_CACHE_MAX = 1024
+_SENHA_CACHE_PEPPER = (os.environ.get("BCRYPT_CACHE_PEPPER") or "").encode() or os.urandom(32)
+_senha_cache = OrderedDict()  # (password_hash, hmac) -> expira_em
+_senha_cache_lock = threading.Lock()
+
+
+def _chave_senha_cache(password_hash, password):
+    digest = hmac.new(_SENHA_CACHE_PEPPER, password.encode('utf-8'), hashlib.sha256).hexdigest()
+    return (password_hash, digest)
+
+
+def _senha_em_cache(chave):
+    agora = time.monotonic()
+    with _senha_cache_lock:
+        expira = _senha_cache.get(chave)
+        if expira is None:
+            return False
+        if expira < agora:
+            del _senha_cache[chave]
+            return False
+        return True
+
+
+def _guardar_senha_cache(chave):
+    with _senha_cache_lock:
+        _senha_cache[chave] = time.monotonic() + _SENHA_CACHE_TTL
+        _senha_cache.move_to_end(chave)
+        while len(_senha_cache) > _SENHA_CACHE_MAX:
+            _senha_cache.popitem(last=False)
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL deixa leitores concorrentes enquanto ha uma escrita (webhook, scheduler);
+    synchronous=NORMAL e seguro com WAL e evita um fsync por commit."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+    finally:
+        cursor.close()
 
 # Chave de criptografia para senhas do UpSeller (fixa para persistir entre reinícios)
 _FERNET_KEY = os.environ.get("FERNET_KEY", "cj6k4FwRMbZFA2X7s1vDGqm_UMdd1FWtM-KcTjs2g-k=")
-_fernet = Fernet(_FERNET_KEY.encode() if isinstance(_FERNET_KEY, str) else _FERNET_KEY)
+# Rotacao: FERNET_KEYS="nova,antiga,..." - a primeira encripta, todas decriptam
+_FERNET_KEYS = [k.strip() for k in os.environ.get("FERNET_KEYS", "").split(",") if k.strip()] or [_FERNET_KEY]
+_fernet = MultiFernet([Fernet(k.encode()) for k in _FERNET_KEYS])
 
 
 def encrypt_value(value: str) -> str:
@@ -34,17 +113,53 @@ def encrypt_value(value: str) -> str:
 
 
 def decrypt_value(encrypted: str) -> str:
-    """Decripta um valor sensivel."""
+    """Decripta um valor sensivel (com qualquer uma das chaves configuradas)."""
     return _fernet.decrypt(encrypted.encode()).decode()
 
+
+def reencrypt_value(encrypted: str) -> str:
+    """Reencripta com a chave atual (para migrar valores antigos apos uma rotacao)."""
+    return _fernet.rotate(encrypted.encode()).decode()
+
 # Planos disponiveis
+@dataclass(frozen=True, slots=True)
+class PlanoInfo:
+    nome: str
+    max_ips: int
+    limite_proc: int  # -1 = ilimitado
+    valor: float
+
+
 PLANOS = {
-    "free":         {"nome": "Free",         "max_ips": 1, "limite_proc": 5,  "valor": 0},
-    "basico":       {"nome": "Basico",       "max_ips": 1, "limite_proc": -1, "valor": 39.90},
-    "pro":          {"nome": "Pro",          "max_ips": 2, "limite_proc": -1, "valor": 59.90},
-    "empresarial":  {"nome": "Empresarial",  "max_ips": 5, "limite_proc": -1, "valor": 89.90},
-    "unlimited":    {"nome": "Admin",        "max_ips": 99, "limite_proc": -1, "valor": 0},
+    "free":         PlanoInfo(nome="Free",         max_ips=1,  limite_proc=5,  valor=0),
+    "basico":       PlanoInfo(nome="Basico",       max_ips=1,  limite_proc=-1, valor=39.90),
+    "pro":          PlanoInfo(nome="Pro",          max_ips=2,  limite_proc=-1, valor=59.90),
+    "empresarial":  PlanoInfo(nome="Empresarial",  max_ips=5,  limite_proc=-1, valor=89.90),
+    "unlimited":    PlanoInfo(nome="Admin",        max_ips=99, limite_proc=-1, valor=0),
 }
+PLANO_FREE = PLANOS["free"]
+
+
+# Datas dos to_dict sem strftime (que interpreta o formato a cada chamada)
+def _fmt_data(dt):
+    """dd/mm/aaaa"""
+    if not dt:
+        return ''
+    return f"{dt.day:02d}/{dt.month:02d}/{dt.year}"
+
+
+def _fmt_data_hora(dt):
+    """dd/mm/aaaa HH:MM"""
+    if not dt:
+        return ''
+    return f"{dt.day:02d}/{dt.month:02d}/{dt.year} {dt.hour:02d}:{dt.minute:02d}"
+
+
+def _fmt_data_hora_seg(dt):
+    """dd/mm/aaaa HH:MM:SS"""
+    if not dt:
+        return ''
+    return f"{dt.day:02d}/{dt.month:02d}/{dt.year} {dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
 
 
 def _json_list(value):
@@ -65,6 +180,26 @@ def _json_list(value):
     return []
 
 
+# Base das pastas dos usuarios: volume persistente do Railway se disponivel
+# (resolvida uma vez na importacao; as variaveis nao mudam com o app rodando)
+_VOLUME_RAILWAY = os.environ.get("RAILWAY_VOLUME_MOUNT_PATH", "")
+USERS_BASE_DIR = (os.path.join(_VOLUME_RAILWAY, "users") if _VOLUME_RAILWAY
+                  else os.environ.get("USERS_DATA_DIR", "/tmp/users"))
+
+# Pastas ja criadas neste processo: o makedirs roda so na primeira chamada de cada uma
+_pastas_criadas = set()
+_pastas_criadas_lock = threading.Lock()
+
+
+def _garantir_pasta_usuario(user_id, nome):
+    pasta = os.path.join(USERS_BASE_DIR, str(user_id), nome)
+    if pasta not in _pastas_criadas:
+        os.makedirs(pasta, exist_ok=True)
+        with _pastas_criadas_lock:
+            _pastas_criadas.add(pasta)
+    return pasta
+
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -87,8 +222,9 @@ class User(db.Model):
     reset_code_expires = db.Column(db.DateTime, nullable=True)
 
     # Sistema de indicacao
-    cupom_indicacao = db.Column(db.String(20), unique=True, nullable=True)
-    indicado_por = db.Column(db.Integer, nullable=True)  # user_id de quem indicou
+    # Indice unico (e nao UNIQUE inline): bancos antigos receberam a coluna por ALTER TABLE
+    cupom_indicacao = db.Column(db.String(20), unique=True, index=True, nullable=True)
+    indicado_por = db.Column(db.Integer, nullable=True, index=True)  # user_id de quem indicou
     meses_gratis = db.Column(db.Integer, default=0)  # meses gratis acumulados
     plano_expira = db.Column(db.DateTime, nullable=True)  # quando plano pago expira
 
@@ -103,75 +239,83 @@ class User(db.Model):
     smtp_pass_enc = db.Column(db.Text, default='')
     smtp_from = db.Column(db.String(200), default='')
     pasta_avulsas = db.Column(db.String(500), default='')
+    # IPs distintos ja registrados (sessoes nunca sao apagadas, so cresce).
+    # None = ainda nao contado: contar_ips recalcula a partir de sessions
+    dispositivos = db.Column(db.Integer, nullable=True)
 
-    payments = db.relationship('Payment', backref='user', lazy=True)
-    sessions = db.relationship('Session', backref='user', lazy=True)
+    # Colecoes com lazy='raise': acesso sem selectinload explicito falha em vez de gerar
+    # um SELECT por usuario (N+1). Os lados muitos-para-um (Payment.user etc.) seguem lazy.
+    payments = db.relationship('Payment', backref='user', lazy='raise')
+    sessions = db.relationship('Session', backref='user', lazy='raise')
 
     def get_plano_info(self):
-        return PLANOS.get(self.plano, PLANOS["free"])
+        return PLANOS.get(self.plano, PLANO_FREE)
 
     def set_password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        salt = bcrypt.gensalt(rounds=bcrypt_rounds())
+        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
 
     def check_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        chave = _chave_senha_cache(self.password_hash or '', password)
+        if _senha_em_cache(chave):
+            return True
+        try:
+            ok = bcrypt.checkpw(password.encode('utf-8'), (self.password_hash or '').encode('utf-8'))
+        except ValueError:
+            return False
+        if ok:  # falhas nunca entram no cache
+            _guardar_senha_cache(chave)
+        return ok
+
+    def precisa_rehash(self):
+        """True se o hash salvo tem custo menor que o atual (refazer no proximo login)."""
+        try:
+            return int((self.password_hash or '').split('$')[2]) < bcrypt_rounds()
+        except (IndexError, ValueError):
+            return False
+
+    def processamentos_no_mes(self):
+        """Processamentos do mes corrente (contador de mes anterior vale 0, sem gravar)."""
+        if self.mes_atual != _agora_brasil().strftime('%Y-%m'):
+            return 0
+        return self.processamentos_mes or 0
 
     def pode_processar(self):
-        """Verifica limite de processamentos (free = 5/mes, pagos = ilimitado)."""
-        info = self.get_plano_info()
-        if info["limite_proc"] == -1:
+        """Verifica limite de processamentos (free = 5/mes, pagos = ilimitado).
+        So le: a virada de mes e gravada por registrar_processamento."""
+        limite = self.get_plano_info().limite_proc
+        if limite == -1:
             return True
-        mes = _agora_brasil().strftime('%Y-%m')
-        if self.mes_atual != mes:
-            self.mes_atual = mes
-            self.processamentos_mes = 0
-            db.session.commit()
-        return self.processamentos_mes < info["limite_proc"]
+        return self.processamentos_no_mes() < limite
 
     def registrar_processamento(self):
+        """Incrementa o contador num UPDATE atomico (zera na virada do mes), sem o
+        read-modify-write que perdia incrementos em processamentos simultaneos."""
         mes = _agora_brasil().strftime('%Y-%m')
-        if self.mes_atual != mes:
-            self.mes_atual = mes
-            self.processamentos_mes = 0
-        self.processamentos_mes += 1
+        db.session.execute(
+            db.update(User).where(User.id == self.id).values(
+                processamentos_mes=db.case(
+                    (User.mes_atual == mes, func.coalesce(User.processamentos_mes, 0) + 1),
+                    else_=1,
+                ),
+                mes_atual=mes,
+            ).execution_options(synchronize_session=False)
+        )
         db.session.commit()
 
     def get_pasta_entrada(self):
-        # Usar volume persistente do Railway se disponivel
-        volume = os.environ.get("RAILWAY_VOLUME_MOUNT_PATH", "")
-        if volume:
-            base = os.path.join(volume, "users")
-        else:
-            base = os.environ.get("USERS_DATA_DIR", "/tmp/users")
-        pasta = os.path.join(base, str(self.id), "entrada")
-        os.makedirs(pasta, exist_ok=True)
-        return pasta
+        return _garantir_pasta_usuario(self.id, "entrada")
 
     def get_pasta_saida(self):
-        # Usar volume persistente do Railway se disponivel
-        volume = os.environ.get("RAILWAY_VOLUME_MOUNT_PATH", "")
-        if volume:
-            base = os.path.join(volume, "users")
-        else:
-            base = os.environ.get("USERS_DATA_DIR", "/tmp/users")
-        pasta = os.path.join(base, str(self.id), "Etiquetas prontas")
-        os.makedirs(pasta, exist_ok=True)
-        return pasta
+        return _garantir_pasta_usuario(self.id, "Etiquetas prontas")
 
     def get_pasta_lucro(self):
         """Pasta separada para arquivos da calculadora de lucros (ZIP/XML + custos)."""
-        volume = os.environ.get("RAILWAY_VOLUME_MOUNT_PATH", "")
-        if volume:
-            base = os.path.join(volume, "users")
-        else:
-            base = os.environ.get("USERS_DATA_DIR", "/tmp/users")
-        pasta = os.path.join(base, str(self.id), "lucro_entrada")
-        os.makedirs(pasta, exist_ok=True)
-        return pasta
+        return _garantir_pasta_usuario(self.id, "lucro_entrada")
 
     def criar_sessao(self, ip):
         """Cria sessao com IP. BLOQUEIA se ja atingiu o limite de IPs do plano."""
-        max_ips = self.get_plano_info()["max_ips"]
+        max_ips = self.get_plano_info().max_ips
 
         # Se ja existe sessao com esse IP, reutiliza
         sessao_existente = Session.query.filter_by(user_id=self.id, ip=ip).first()
@@ -181,18 +325,24 @@ class User(db.Model):
             db.session.commit()
             return sessao_existente.token_id
 
-        # IP novo - verificar se cabe no plano
-        ips_ativos = db.session.query(Session.ip).filter_by(user_id=self.id).distinct().count()
+        # IP novo - verificar se cabe no plano (a contagem so roda aqui, nao a cada reconexao)
+        ips_ativos = self.contar_ips()
         if ips_ativos >= max_ips:
             return None  # BLOQUEADO - limite de IPs atingido
 
         nova = Session(user_id=self.id, token_id=str(uuid.uuid4()), ip=ip)
         db.session.add(nova)
+        # Contador denormalizado: +1 atomico na mesma transacao da nova sessao
+        db.session.execute(
+            db.update(User).where(User.id == self.id)
+            .values(dispositivos=func.coalesce(User.dispositivos, 0) + 1)
+            .execution_options(synchronize_session=False)
+        )
         db.session.commit()
         return nova.token_id
 
     def sessao_valida(self, token_id):
-        return Session.query.filter_by(user_id=self.id, token_id=token_id).first() is not None
+        return sessao_existe(self.id, token_id)
 
     def remover_sessao(self, token_id):
         """Invalida o token (logout) mas MANTEM o IP registrado para sempre."""
@@ -201,23 +351,44 @@ class User(db.Model):
             sessao.token_id = "deslogado_" + str(uuid.uuid4())[:8]
             db.session.commit()
 
-    def to_dict(self):
+    def contar_ips(self):
+        """Quantidade de IPs distintos com sessao registrada (coluna dispositivos; se
+        ainda nao contada, um COUNT DISTINCT que fica gravado no proximo commit)."""
+        if self.dispositivos is None:
+            self.dispositivos = db.session.query(func.count(func.distinct(Session.ip))).filter(
+                Session.user_id == self.id).scalar() or 0
+        return self.dispositivos
+
+    @classmethod
+    def bulk_ip_counts(cls, user_ids):
+        """{user_id: IPs distintos} para varios usuarios numa unica consulta agrupada.
+        Usuarios sem sessao ficam fora do dict."""
+        ids = list(user_ids)
+        if not ids:
+            return {}
+        linhas = db.session.query(Session.user_id, func.count(func.distinct(Session.ip))).filter(
+            Session.user_id.in_(ids)).group_by(Session.user_id).all()
+        return dict(linhas)
+
+    def to_dict(self, ips_ativos=None):
+        """ips_ativos: contagem ja calculada (ex: via bulk_ip_counts em listagens)."""
         info = self.get_plano_info()
-        ips_ativos = db.session.query(Session.ip).filter_by(user_id=self.id).distinct().count()
+        if ips_ativos is None:
+            ips_ativos = self.contar_ips()
         return {
             "id": self.id,
             "email": self.email,
             "plano": self.plano,
-            "plano_nome": info["nome"],
-            "processamentos_mes": self.processamentos_mes,
-            "limite_mes": info["limite_proc"],
+            "plano_nome": info.nome,
+            "processamentos_mes": self.processamentos_no_mes(),
+            "limite_mes": info.limite_proc,
             "dispositivos": ips_ativos,
-            "max_dispositivos": info["max_ips"],
-            "created_at": self.created_at.strftime("%d/%m/%Y"),
+            "max_dispositivos": info.max_ips,
+            "created_at": _fmt_data(self.created_at),
             "email_verified": self.email_verified,
             "cupom_indicacao": self.cupom_indicacao or '',
             "meses_gratis": self.meses_gratis or 0,
-            "plano_expira": self.plano_expira.strftime("%d/%m/%Y") if self.plano_expira else '',
+            "plano_expira": _fmt_data(self.plano_expira),
             "auto_send_whatsapp": bool(self.auto_send_whatsapp),
             "email_remetente": (self.email_remetente or '').strip(),
             "nome_remetente": (self.nome_remetente or '').strip(),
@@ -231,6 +402,7 @@ class User(db.Model):
 
 class Session(db.Model):
     __tablename__ = 'sessions'
+    __table_args__ = (db.Index('ix_sessions_user_ip', 'user_id', 'ip'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -240,8 +412,22 @@ class Session(db.Model):
     last_seen = db.Column(db.DateTime, default=_agora_brasil)
 
 
+def sessao_existe(user_id, token_id):
+    """SELECT EXISTS da sessao (user_id, token_id), sem materializar a linha."""
+    return db.session.query(
+        db.session.query(Session.id).filter_by(user_id=user_id, token_id=token_id).exists()
+    ).scalar()
+
+
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        db.Index('ix_payments_user_id', 'user_id', 'id'),
+        # Um Payment por id do Mercado Pago (idempotencia do webhook); '' = ainda sem id
+        db.Index('uq_payments_mercadopago_id', 'mercadopago_id', unique=True,
+                 sqlite_where=db.text("mercadopago_id != ''"),
+                 postgresql_where=db.text("mercadopago_id != ''")),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -260,6 +446,7 @@ class Payment(db.Model):
 class WhatsAppContact(db.Model):
     """Contatos WhatsApp vinculados a lojas para envio automatico de etiquetas."""
     __tablename__ = 'whatsapp_contacts'
+    __table_args__ = (db.Index('ix_wa_user_cnpj', 'user_id', 'loja_cnpj'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -278,7 +465,7 @@ class WhatsAppContact(db.Model):
     agendamento_ativo = db.Column(db.Boolean, default=True)  # False = agendamento individual desligado
     created_at = db.Column(db.DateTime, default=_agora_brasil)
 
-    user = db.relationship('User', backref=db.backref('whatsapp_contacts', lazy=True))
+    user = db.relationship('User', backref=db.backref('whatsapp_contacts', lazy='raise'))
 
     def to_dict(self):
         horarios = []
@@ -304,7 +491,7 @@ class WhatsAppContact(db.Model):
             "resumo_geral": bool(self.resumo_geral),
             "lote_ids": lote_ids,
             "agendamento_ativo": self.agendamento_ativo if self.agendamento_ativo is not None else True,
-            "created_at": self.created_at.strftime("%d/%m/%Y %H:%M") if self.created_at else '',
+            "created_at": _fmt_data_hora(self.created_at),
         }
 
 
@@ -335,7 +522,7 @@ class Schedule(db.Model):
     ultima_execucao = db.Column(db.DateTime, nullable=True)
     ultimo_status = db.Column(db.String(20), default='')      # "sucesso" | "erro" | "parcial"
 
-    user = db.relationship('User', backref=db.backref('schedules', lazy=True))
+    user = db.relationship('User', backref=db.backref('schedules', lazy='raise'))
 
     def to_dict(self):
         return {
@@ -352,9 +539,9 @@ class Schedule(db.Model):
             "lojas": _json_list(self.lojas_json),
             "grupos": _json_list(self.grupos_json),
             "job_id": self.job_id or '',
-            "ultima_execucao": self.ultima_execucao.strftime("%d/%m/%Y %H:%M") if self.ultima_execucao else '',
+            "ultima_execucao": _fmt_data_hora(self.ultima_execucao),
             "ultimo_status": self.ultimo_status or '',
-            "created_at": self.created_at.strftime("%d/%m/%Y %H:%M") if self.created_at else '',
+            "created_at": _fmt_data_hora(self.created_at),
         }
 
 
@@ -388,7 +575,7 @@ class UpSellerConfig(db.Model):
             "email": self.email,
             "headless": self.headless,
             "status_conexao": self.status_conexao or 'nao_testado',
-            "ultima_sincronizacao": self.ultima_sincronizacao.strftime("%d/%m/%Y %H:%M") if self.ultima_sincronizacao else '',
+            "ultima_sincronizacao": _fmt_data_hora(self.ultima_sincronizacao),
             # NUNCA retorna senha
         }
 
@@ -396,6 +583,7 @@ class UpSellerConfig(db.Model):
 class ExecutionLog(db.Model):
     """Log de execucoes do pipeline automatizado."""
     __tablename__ = 'execution_logs'
+    __table_args__ = (db.Index('ix_exec_user_inicio', 'user_id', 'inicio'),)
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -405,7 +593,8 @@ class ExecutionLog(db.Model):
     fim = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.String(20), default='executando')   # "sucesso" | "erro" | "parcial" | "executando"
 
-    # Contadores
+    # Contadores (o pipeline soma em memoria e atribui o total da etapa: um commit por
+    # fase, nunca um UPDATE por item)
     etiquetas_baixadas = db.Column(db.Integer, default=0)
     xmls_baixados = db.Column(db.Integer, default=0)
     etiquetas_processadas = db.Column(db.Integer, default=0)
@@ -415,16 +604,16 @@ class ExecutionLog(db.Model):
     # Detalhes completos em JSON
     detalhes = db.Column(db.Text, default='{}')
 
-    user = db.relationship('User', backref=db.backref('execution_logs', lazy=True))
-    schedule = db.relationship('Schedule', backref=db.backref('execution_logs', lazy=True))
+    user = db.relationship('User', backref=db.backref('execution_logs', lazy='raise'))
+    schedule = db.relationship('Schedule', backref=db.backref('execution_logs', lazy='raise'))
 
     def to_dict(self):
         return {
             "id": self.id,
             "schedule_id": self.schedule_id,
             "tipo": self.tipo,
-            "inicio": self.inicio.strftime("%d/%m/%Y %H:%M:%S") if self.inicio else '',
-            "fim": self.fim.strftime("%d/%m/%Y %H:%M:%S") if self.fim else '',
+            "inicio": _fmt_data_hora_seg(self.inicio),
+            "fim": _fmt_data_hora_seg(self.fim),
             "status": self.status,
             "etiquetas_baixadas": self.etiquetas_baixadas,
             "xmls_baixados": self.xmls_baixados,
@@ -458,7 +647,7 @@ class Loja(db.Model):
             "pedidos": self.pedidos_pendentes,
             "notas_pendentes": self.notas_pendentes or 0,
             "etiquetas_pendentes": self.etiquetas_pendentes or 0,
-            "ultima_atualizacao": self.ultima_atualizacao.strftime("%d/%m/%Y %H:%M") if self.ultima_atualizacao else "",
+            "ultima_atualizacao": _fmt_data_hora(self.ultima_atualizacao),
             "ativo": self.ativo,
         }
 
@@ -566,11 +755,11 @@ class WhatsAppQueueItem(db.Model):
             "status": self.status,
             "tentativas": self.tentativas,
             "max_tentativas": self.max_tentativas,
-            "next_attempt_at": self.next_attempt_at.strftime("%d/%m/%Y %H:%M:%S") if self.next_attempt_at else "",
+            "next_attempt_at": _fmt_data_hora_seg(self.next_attempt_at),
             "last_error": self.last_error or "",
             "message_id": self.message_id or "",
-            "created_at": self.created_at.strftime("%d/%m/%Y %H:%M:%S") if self.created_at else "",
-            "sent_at": self.sent_at.strftime("%d/%m/%Y %H:%M:%S") if self.sent_at else "",
+            "created_at": _fmt_data_hora_seg(self.created_at),
+            "sent_at": _fmt_data_hora_seg(self.sent_at),
         }
 
 
@@ -663,10 +852,10 @@ class MarketplaceApiConfig(db.Model):
             "partner_id": (self.partner_id or '').strip(),
             "shop_id": (self.shop_id or '').strip(),
             "status_conexao": (self.status_conexao or 'nao_configurado'),
-            "ultima_sincronizacao": self.ultima_sincronizacao.strftime("%d/%m/%Y %H:%M") if self.ultima_sincronizacao else "",
+            "ultima_sincronizacao": _fmt_data_hora(self.ultima_sincronizacao),
             "ativo": bool(self.ativo),
             "configurado": bool(self.configurado()),
-            "token_expires_at": self.token_expires_at.strftime("%d/%m/%Y %H:%M:%S") if self.token_expires_at else "",
+            "token_expires_at": _fmt_data_hora_seg(self.token_expires_at),
             "has_partner_key": bool((self.partner_key_enc or '').strip()),
             "has_access_token": bool((self.access_token_enc or '').strip()),
             "has_refresh_token": bool((self.refresh_token_enc or '').strip()),
@@ -699,7 +888,7 @@ class MarketplaceLoja(db.Model):
             "pedidos": int(self.pedidos_pendentes or 0),
             "notas_pendentes": int(self.notas_pendentes or 0),
             "etiquetas_pendentes": int(self.etiquetas_pendentes or 0),
-            "ultima_atualizacao": self.ultima_atualizacao.strftime("%d/%m/%Y %H:%M") if self.ultima_atualizacao else "",
+            "ultima_atualizacao": _fmt_data_hora(self.ultima_atualizacao),
             "ativo": bool(self.ativo),
         }
 
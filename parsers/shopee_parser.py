@@ -9,8 +9,20 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from core.marketplace_parser import MarketplaceParser, Produto, DadosEnvio, NotaFiscal
-from etiquetas_shopee import ProcessadorEtiquetasShopee
-import re
+from etiquetas_shopee import ProcessadorEtiquetasShopee, limpar_nome_emitente
+
+
+def _produto_de_item(item: dict) -> Produto:
+    """Produto no formato padrao a partir de um item do processador legado.
+    _parse_xml usa codigo/descricao e qtd em texto ("2.0000")."""
+    get = item.get
+    return Produto(
+        sku=get('sku', '') or get('codigo', ''),
+        nome=get('titulo', '') or get('descricao', ''),
+        quantidade=int(float(get('qtd', 1) or 1)),
+        preco=float(get('preco', 0)),
+        variacao=get('variacao', '')
+    )
 
 
 class ShopeeParser(MarketplaceParser):
@@ -40,6 +52,12 @@ class ShopeeParser(MarketplaceParser):
             elif os.path.isdir(self.arquivo_path):
                 # É uma pasta
                 self.processador.carregar_todos_xmls(self.arquivo_path)
+            elif os.path.isfile(self.arquivo_path) and self.arquivo_path.lower().endswith('.xml'):
+                # É um XML avulso (CLI main.py): mesmo parser dos XMLs dentro do ZIP
+                with open(self.arquivo_path, 'rb') as f:
+                    dados = self.processador._parse_xml(f.read())
+                if dados:
+                    self.processador.dados_xml[dados['nf']] = dados
             else:
                 return False
             
@@ -54,19 +72,12 @@ class ShopeeParser(MarketplaceParser):
     
     def _converter_dados(self):
         """Converte dados do processador legado para formato padrão"""
-        # Para cada XML carregado, extrai produtos
+        # Para cada XML carregado, extrai produtos (um extend por NF)
+        adicionar_produtos = self._produtos.extend
         for nf, dados in self.processador.dados_xml.items():
             # Produtos
             if 'produtos' in dados:
-                for item in dados['produtos']:
-                    prod = Produto(
-                        sku=item.get('sku', ''),
-                        nome=item.get('titulo', ''),
-                        quantidade=item.get('qtd', 1),
-                        preco=float(item.get('preco', 0)),
-                        variacao=item.get('variacao', '')
-                    )
-                    self._produtos.append(prod)
+                adicionar_produtos([_produto_de_item(item) for item in dados['produtos']])
             
             # Dados de envio (pega do primeiro XML com dados completos)
             if not self._dados_envio and 'destinatario' in dados:
@@ -84,9 +95,9 @@ class ShopeeParser(MarketplaceParser):
             if not self._nota_fiscal:
                 self._nota_fiscal = NotaFiscal(
                     numero=dados.get('nf', ''),
-                    chave=dados.get('chave_nf', ''),
-                    emitente=dados.get('emitente', ''),
-                    cnpj=dados.get('cnpj', '')
+                    chave=dados.get('chave_nf', '') or dados.get('chave', ''),
+                    emitente=dados.get('emitente', '') or dados.get('nome_emitente', ''),
+                    cnpj=dados.get('cnpj', '') or dados.get('cnpj_emitente', '')
                 )
     
     def get_marketplace_nome(self) -> str:
@@ -96,16 +107,6 @@ class ShopeeParser(MarketplaceParser):
     def get_nome_emitente_limpo(self) -> str:
         """Retorna nome do emitente limpo para usar em nomes de arquivo"""
         if self._nota_fiscal:
-            nome = self._nota_fiscal.emitente
-            # Remove números de CNPJ do início
-            nome = re.sub(r'^\d[\d.]+\s+', '', nome)
-            # Remove CPF
-            nome = re.sub(r'\s+\d{11}$', '', nome)
-            # Remove LTDA, ME, MEI, etc
-            nome = re.sub(r'\s+(LTDA|ME|MEI|EPP|EIRELI)\s*$', '', nome, flags=re.IGNORECASE)
-            # Capitaliza
-            nome = nome.strip().title()
-            # Remove caracteres inválidos
-            nome = re.sub(r'[<>:"/\\|?*]', '', nome)
-            return nome.strip() or 'Loja_Desconhecida'
+            # Mesma limpeza das pastas por loja do processador (CNPJ, CPF, LTDA/ME..., invalidos)
+            return limpar_nome_emitente(self._nota_fiscal.emitente)
         return 'Desconhecido'
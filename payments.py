@@ -5,9 +5,15 @@ Sistema de cupom de indicacao com meses gratis
 """
 
 import os
+import queue
+import threading
 import uuid
+from collections import namedtuple
+from functools import lru_cache
 from datetime import datetime, timedelta, timezone
 
+from sqlalchemy.exc import IntegrityError
+
 # Fuso horario de Brasilia (UTC-3)
 _FUSO_BRASILIA = timezone(timedelta(hours=-3))
 
@@ -15,7 +21,7 @@ _FUSO_BRASILIA = timezone(timedelta(hours=-3))
 def _agora_brasil():
     """Retorna datetime atual no fuso de Brasilia (UTC-3), sem tzinfo (naive)."""
     return datetime.now(_FUSO_BRASILIA).replace(tzinfo=None)
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User, Payment, PLANOS
 
@@ -30,11 +36,16 @@ PERIODOS = {
 
 
 def _get_mp_sdk():
-    """Inicializa SDK do Mercado Pago."""
-    import mercadopago
+    """SDK do Mercado Pago (uma instancia por token, reaproveitada entre requisicoes)."""
     token = os.environ.get('MERCADOPAGO_ACCESS_TOKEN', '')
     if not token:
         return None
+    return _mp_sdk_para_token(token)
+
+
+@lru_cache(maxsize=1)
+def _mp_sdk_para_token(token):
+    import mercadopago
     return mercadopago.SDK(token)
 
 
@@ -44,7 +55,7 @@ def _calcular_valor(plano_id, periodo_id):
     periodo = PERIODOS.get(periodo_id)
     if not plano or not periodo:
         return 0, 0, 0
-    valor_mensal = plano["valor"]
+    valor_mensal = plano.valor
     meses = periodo["meses"]
     desconto = periodo["desconto"]
     valor_total = round(valor_mensal * meses * (1 - desconto), 2)
@@ -56,7 +67,7 @@ def _calcular_valor(plano_id, periodo_id):
 def create_payment():
     """Cria link de pagamento no Mercado Pago para o plano escolhido."""
     user_id = get_jwt_identity()
-    user = User.query.get(int(user_id))
+    user = db.session.get(User, int(user_id))
     if not user:
         return jsonify({"erro": "Usuario nao encontrado"}), 404
 
@@ -91,21 +102,25 @@ def create_payment():
     if not sdk:
         return jsonify({"erro": "Mercado Pago nao configurado"}), 500
 
+    # Devolve a conexao ao pool antes da chamada HTTP ao Mercado Pago
+    user_id, user_email = user.id, user.email
+    db.session.close()
+
     base_url = os.environ.get('APP_URL', 'https://web-production-274ef.up.railway.app')
 
     desc_periodo = periodo["label"]
     preference_data = {
         "items": [
             {
-                "title": f"Beka MultiPlace - {plano['nome']} {desc_periodo}",
-                "description": f"Ate {plano['max_ips']} dispositivo(s), processamentos ilimitados, {meses} mes(es)",
+                "title": f"Beka MultiPlace - {plano.nome} {desc_periodo}",
+                "description": f"Ate {plano.max_ips} dispositivo(s), processamentos ilimitados, {meses} mes(es)",
                 "quantity": 1,
                 "unit_price": valor_total,
                 "currency_id": "BRL",
             }
         ],
         "payer": {
-            "email": user.email,
+            "email": user_email,
         },
         "back_urls": {
             "success": f"{base_url}/",
@@ -114,7 +129,7 @@ def create_payment():
         },
         "auto_return": "approved",
         "notification_url": f"{base_url}/api/payment/webhook",
-        "external_reference": f"{user.id}:{plano_id}:{periodo_id}:{indicador_id or 0}",
+        "external_reference": f"{user_id}:{plano_id}:{periodo_id}:{indicador_id or 0}",
     }
 
     result = sdk.preference().create(preference_data)
@@ -124,7 +139,7 @@ def create_payment():
         return jsonify({"erro": "Erro ao criar pagamento"}), 500
 
     payment = Payment(
-        user_id=user.id,
+        user_id=user_id,
         status='pending',
         mercadopago_id=preference.get("id", ""),
         plano_contratado=plano_id,
@@ -156,11 +171,76 @@ def webhook():
     if tipo == "payment":
         payment_id = dados.get("data", {}).get("id")
         if payment_id:
-            _processar_pagamento(payment_id)
+            _enfileirar_pagamento(current_app._get_current_object(), payment_id)
 
     return jsonify({"ok": True}), 200
 
 
+# Fila de webhooks: o Mercado Pago recebe 200 na hora e a consulta ao pagamento + commit
+# rodam numa thread de fundo (uma por processo, iniciada no primeiro webhook)
+_fila_pagamentos = queue.Queue()
+_pagamentos_pendentes = set()  # ids ja na fila (notificacoes repetidas nao duplicam trabalho)
+_fila_lock = threading.Lock()
+_fila_worker = None
+
+
+def _enfileirar_pagamento(app, payment_id):
+    global _fila_worker
+    pid = str(payment_id)
+    with _fila_lock:
+        if pid in _pagamentos_pendentes:
+            return
+        _pagamentos_pendentes.add(pid)
+        if _fila_worker is None or not _fila_worker.is_alive():
+            _fila_worker = threading.Thread(target=_consumir_pagamentos, args=(app,), daemon=True)
+            _fila_worker.start()
+    _fila_pagamentos.put(pid)
+
+
+def _consumir_pagamentos(app):
+    while True:
+        pid = _fila_pagamentos.get()
+        with _fila_lock:
+            _pagamentos_pendentes.discard(pid)
+        try:
+            with app.app_context():
+                _processar_pagamento(pid)
+        except Exception as e:
+            print(f"Erro ao processar webhook: {e}")
+
+
+ExtRef = namedtuple('ExtRef', 'user_id plano periodo indicador')
+
+
+def _parse_ref(ref):
+    """external_reference "user_id:plano[:periodo[:indicador]]" (montado em create_payment).
+
+    Retorna ExtRef ou None se faltar o plano; indicador "0" vira None.
+    """
+    partes = ref.split(":", 3)
+    if len(partes) < 2:
+        return None
+    return ExtRef(
+        int(partes[0]),
+        partes[1],
+        partes[2] if len(partes) > 2 else "mensal",
+        int(partes[3]) if len(partes) > 3 and partes[3] != "0" else None,
+    )
+
+
+def _travar_usuario(user_id):
+    """Carrega o usuario travado para escrita ate o fim da transacao.
+
+    Postgres/MySQL: SELECT ... FOR UPDATE na linha (so webhooks do mesmo usuario esperam).
+    SQLite nao tem trava de linha: BEGIN IMMEDIATE pega a trava de escrita do banco, que
+    o SQLite serializaria de qualquer forma no primeiro UPDATE.
+    """
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(db.text("BEGIN IMMEDIATE"))
+        return db.session.get(User, user_id)
+    return db.session.get(User, user_id, with_for_update=True)
+
+
 def _processar_pagamento(payment_id):
     """Busca detalhes do pagamento e atualiza o plano do usuario."""
     try:
@@ -177,19 +257,24 @@ def _processar_pagamento(payment_id):
         if not ref:
             return
 
-        partes = ref.split(":")
-        if len(partes) < 2:
+        ext = _parse_ref(ref)
+        if not ext:
             return
+        plano_id, periodo_id, indicador_id = ext.plano, ext.periodo, ext.indicador
 
-        user_id_str = partes[0]
-        plano_id = partes[1]
-        periodo_id = partes[2] if len(partes) > 2 else "mensal"
-        indicador_id = int(partes[3]) if len(partes) > 3 and partes[3] != "0" else None
-
-        user = User.query.get(int(user_id_str))
+        # Trava antes de qualquer leitura: checagem de repeticao e credito ficam atomicos
+        # entre workers (a chamada HTTP acima ja terminou, a trava dura so ate o commit)
+        user = _travar_usuario(ext.user_id)
         if not user:
+            db.session.rollback()
             return
 
+        # Notificacao repetida (mesmo pagamento, mesmo status): ja aplicada, nao estender de novo
+        if Payment.query.filter_by(mercadopago_id=str(payment_id), status=status).first():
+            db.session.rollback()
+            return
+
+        # Plano, bonus de indicacao e Payment numa unica transacao (um commit no final)
         if status == "approved" and plano_id in PLANOS:
             user.plano = plano_id
 
@@ -202,28 +287,33 @@ def _processar_pagamento(payment_id):
             meses_bonus = user.meses_gratis or 0
             user.plano_expira = base + timedelta(days=(meses + meses_bonus) * 30)
             user.meses_gratis = 0  # Zerar apos aplicar
-            db.session.commit()
 
             # Aplicar bonus de indicacao
             if indicador_id and not user.indicado_por:
                 user.indicado_por = indicador_id
-                db.session.commit()
                 # +1 mes gratis para quem indicou
-                indicador = User.query.get(indicador_id)
+                indicador = db.session.get(User, indicador_id)
                 if indicador:
                     indicador.meses_gratis = (indicador.meses_gratis or 0) + 1
-                    db.session.commit()
                 # +1 mes gratis para quem usou o cupom (adicionar ao plano)
                 user.plano_expira = user.plano_expira + timedelta(days=30)
-                db.session.commit()
 
-        payment = Payment.query.filter_by(user_id=user.id).order_by(Payment.id.desc()).first()
-        if payment:
-            payment.status = status
-            payment.mercadopago_id = str(payment_id)
-            db.session.commit()
+        # Payment alvo: o que ja tem este mercadopago_id (mudanca de status de um pagamento
+        # conhecido) ou, no primeiro aviso, o ultimo do usuario. UPDATE ... WHERE id = (subselect)
+        mesmo_id = (db.session.query(Payment.id).filter_by(mercadopago_id=str(payment_id))
+                    .limit(1).scalar_subquery())
+        ultimo_id = (db.session.query(Payment.id).filter_by(user_id=user.id)
+                     .order_by(Payment.id.desc()).limit(1).scalar_subquery())
+        db.session.execute(
+            db.update(Payment).where(Payment.id == db.func.coalesce(mesmo_id, ultimo_id))
+            .values(status=status, mercadopago_id=str(payment_id))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
 
     except Exception as e:
+        # Nada parcial fica na sessao: o webhook inteiro e aplicado ou descartado
+        db.session.rollback()
         print(f"Erro ao processar webhook: {e}")
 
 
@@ -232,18 +322,18 @@ def _processar_pagamento(payment_id):
 def payment_status():
     """Retorna status do plano do usuario."""
     user_id = get_jwt_identity()
-    user = User.query.get(int(user_id))
+    user = db.session.get(User, int(user_id))
     if not user:
         return jsonify({"erro": "Usuario nao encontrado"}), 404
 
     info = user.get_plano_info()
     return jsonify({
         "plano": user.plano,
-        "plano_nome": info["nome"],
-        "valor": info["valor"],
-        "max_ips": info["max_ips"],
+        "plano_nome": info.nome,
+        "valor": info.valor,
+        "max_ips": info.max_ips,
         "planos_disponiveis": [
-            {"id": k, "nome": v["nome"], "max_ips": v["max_ips"], "valor": v["valor"]}
+            {"id": k, "nome": v.nome, "max_ips": v.max_ips, "valor": v.valor}
             for k, v in PLANOS.items() if k != "free"
         ],
         "periodos": [
@@ -268,7 +358,7 @@ def simular_pagamento():
 
     plano = PLANOS[plano_id]
     valor_total, meses, desconto = _calcular_valor(plano_id, periodo_id)
-    valor_mensal_original = plano["valor"]
+    valor_mensal_original = plano.valor
     valor_mensal_com_desc = round(valor_total / meses, 2) if meses > 0 else 0
 
     return jsonify({
@@ -292,22 +382,24 @@ def simular_pagamento():
 def meu_cupom():
     """Retorna ou gera o cupom de indicacao do usuario."""
     user_id = get_jwt_identity()
-    user = User.query.get(int(user_id))
+    user = db.session.get(User, int(user_id))
     if not user:
         return jsonify({"erro": "Usuario nao encontrado"}), 404
 
     # Gerar cupom se nao tiver
     if not user.cupom_indicacao:
-        # Gerar cupom unico baseado no email
+        # Gerar cupom unico baseado no email; a unicidade fica com o indice unico:
+        # grava direto e, em colisao, sorteia outro sufixo
         base = user.email.split('@')[0].upper().replace('.', '')[:6]
-        sufixo = uuid.uuid4().hex[:4].upper()
-        cupom = f"{base}{sufixo}"
-        # Garantir unicidade
-        while User.query.filter_by(cupom_indicacao=cupom).first():
-            sufixo = uuid.uuid4().hex[:4].upper()
-            cupom = f"{base}{sufixo}"
-        user.cupom_indicacao = cupom
-        db.session.commit()
+        for _ in range(3):
+            user.cupom_indicacao = f"{base}{uuid.uuid4().hex[:4].upper()}"
+            try:
+                db.session.commit()
+                break
+            except IntegrityError:
+                db.session.rollback()
+        else:
+            return jsonify({"erro": "Nao foi possivel gerar o cupom, tente novamente"}), 503
 
     # Contar quantos usaram este cupom
     total_indicados = User.query.filter_by(indicado_por=user.id).count()
@@ -324,7 +416,7 @@ def meu_cupom():
 def validar_cupom():
     """Valida um cupom de indicacao."""
     user_id = get_jwt_identity()
-    user = User.query.get(int(user_id))
+    user = db.session.get(User, int(user_id))
     if not user:
         return jsonify({"erro": "Usuario nao encontrado"}), 404
 
@@ -6,7 +6,9 @@ permitindo misturar com etiquetas de outros formatos no mesmo lote.
 """
 
 import os
-import tempfile
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
 
 
@@ -15,6 +17,8 @@ DANFE_MARKERS = (
     "DECLARAÇÃO DE CONTEÚDO",
     "DECLARACAO DE CONTEUDO",
 )
+# Todos os marcadores numa so varredura, sem caixa (dispensa o text.upper() da pagina)
+_RE_DANFE = re.compile("|".join(map(re.escape, DANFE_MARKERS)), re.IGNORECASE)
 
 
 def _mm_to_pt(mm: float) -> float:
@@ -22,27 +26,24 @@ def _mm_to_pt(mm: float) -> float:
 
 
 def _looks_like_danfe(page: fitz.Page) -> bool:
-    text = (page.get_text("text") or "").upper()
-    return any(m.upper() in text for m in DANFE_MARKERS)
+    return _RE_DANFE.search(page.get_text("text")) is not None
 
 
 def _union_content_rect(page: fitz.Page):
-    d = page.get_text("dict")
-    rects = []
-    for b in d.get("blocks", []):
-        bbox = b.get("bbox")
-        if not bbox:
+    # "blocks" da so as caixas (sem spans/fontes/bytes de imagem do "dict"); as flags do
+    # "dict" mantem os blocos de imagem (codigos de barras) na uniao
+    caixas = []
+    for x0, y0, x1, y1, _texto, _n, _tipo in page.get_text("blocks", flags=fitz.TEXTFLAGS_DICT):
+        # Area >= 10 (mesmo criterio de Rect.get_area)
+        w, h = x1 - x0, y1 - y0
+        if w <= 0 or h <= 0 or w * h < 10:
             continue
-        r = fitz.Rect(bbox)
-        if r.get_area() < 10:
-            continue
-        rects.append(r)
-    if not rects:
+        caixas.append((x0, y0, x1, y1))
+    if not caixas:
         return None
-    u = rects[0]
-    for r in rects[1:]:
-        u |= r
-    return u
+    # Uniao = quatro reducoes min/max, sem um Rect por bloco
+    x0s, y0s, x1s, y1s = zip(*caixas)
+    return fitz.Rect(min(x0s), min(y0s), max(x1s), max(y1s))
 
 
 def _eh_pdf_shein(caminho_pdf: str) -> bool:
@@ -64,7 +65,7 @@ def _eh_pdf_shein(caminho_pdf: str) -> bool:
 
 def normalize_pdf_to_labels(
     input_pdf_path: str,
-    output_pdf_path: str,
+    output_pdf_path: str = None,
     target_w_mm: float = 150.0,
     target_h_mm: float = 230.0,
     padding_mm: float = 3.0,
@@ -73,6 +74,7 @@ def normalize_pdf_to_labels(
     """
     Normaliza PDF DANFE para paginas target_w_mm x target_h_mm.
     Retorna {"matched": bool, "pages_in": int, "pages_out": int}.
+    Sem output_pdf_path, o PDF gerado vem em memoria na chave "data" (bytes).
     """
     if not os.path.exists(input_pdf_path):
         raise FileNotFoundError(input_pdf_path)
@@ -95,8 +97,7 @@ def normalize_pdf_to_labels(
     H = _mm_to_pt(target_h_mm)
     pad = _mm_to_pt(padding_mm)
 
-    for i in range(n_pages):
-        p = src[i]
+    for i, p in enumerate(src):
         content_rect = _union_content_rect(p)
         if content_rect is None:
             out.new_page(width=W, height=H)
@@ -126,14 +127,16 @@ def normalize_pdf_to_labels(
 
         newp.show_pdf_page(dest, src, i, clip=r)
 
-    out.save(output_pdf_path)
+    # Paginas geradas contadas no proprio documento, sem reabrir o arquivo salvo
+    n_out = len(out)
+    result = {"matched": True, "pages_in": n_pages, "pages_out": n_out}
+    if output_pdf_path:
+        out.save(output_pdf_path)
+    else:
+        result["data"] = out.tobytes()
     out.close()
     src.close()
-
-    out_check = fitz.open(output_pdf_path)
-    n_out = len(out_check)
-    out_check.close()
-    return {"matched": True, "pages_in": n_pages, "pages_out": n_out}
+    return result
 
 
 def normalize_pdf_to_labels_inplace(
@@ -151,31 +154,27 @@ def normalize_pdf_to_labels_inplace(
     if _eh_pdf_shein(caminho_pdf):
         return False
 
-    tmp_fd = None
-    tmp_path = None
-    try:
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix=".pdf", prefix="norm_")
-        os.close(tmp_fd)
-
-        result = normalize_pdf_to_labels(
-            caminho_pdf,
-            tmp_path,
-            target_w_mm=largura_mm,
-            target_h_mm=altura_mm,
-            padding_mm=3.0,
-            only_when_matches_danfe=True,
-        )
-
-        if not result["matched"]:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-            return False
+    # PDF normalizado gerado em memoria: so o resultado final vai para o disco, num .tmp
+    # ao lado do original (mesmo volume) trocado atomicamente por os.replace
+    result = normalize_pdf_to_labels(
+        caminho_pdf,
+        target_w_mm=largura_mm,
+        target_h_mm=altura_mm,
+        padding_mm=3.0,
+        only_when_matches_danfe=True,
+    )
+    if not result["matched"]:
+        return False
 
+    tmp_path = f"{caminho_pdf}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(result["data"])
         os.replace(tmp_path, caminho_pdf)
         return True
 
     except Exception:
-        if tmp_path and os.path.exists(tmp_path):
+        if os.path.exists(tmp_path):
             try:
                 os.remove(tmp_path)
             except Exception:
@@ -183,6 +182,16 @@ def normalize_pdf_to_labels_inplace(
         raise
 
 
+def _normalizar_worker(tarefa):
+    """Ponto de entrada (picklable) do pool: devolve (nome, normalizou?, erro ou None)."""
+    caminho, largura_mm, altura_mm = tarefa
+    nome = os.path.basename(caminho)
+    try:
+        return nome, normalize_pdf_to_labels_inplace(caminho, largura_mm, altura_mm), None
+    except Exception as e:
+        return nome, False, str(e)
+
+
 def normalizar_pdfs_danfe_pasta(pasta, largura_mm=150, altura_mm=230, log_callback=None, error_callback=None):
     """
     Percorre a pasta, normaliza PDFs DANFE e retorna lista de arquivos normalizados.
@@ -201,15 +210,29 @@ def normalizar_pdfs_danfe_pasta(pasta, largura_mm=150, altura_mm=230, log_callba
         and f.lower() not in especiais_lower
     ]
 
-    normalizados = []
-    for nome in pdfs:
-        caminho = os.path.join(pasta, nome)
+    # Cada PDF e independente: normaliza em paralelo; os callbacks rodam aqui, na ordem original.
+    # Pool (fork) so num processo de uma thread: com outras threads vivas (dashboard) o filho
+    # pode herdar um lock travado e ficar preso, entao la segue em sequencia
+    tarefas = [(os.path.join(pasta, nome), largura_mm, altura_mm) for nome in pdfs]
+    resultados = None
+    if len(tarefas) > 1 and threading.active_count() == 1:
         try:
-            if normalize_pdf_to_labels_inplace(caminho, largura_mm, altura_mm):
-                normalizados.append(nome)
-                if log_callback:
-                    log_callback(nome)
-        except Exception as e:
+            max_workers = min(len(tarefas), os.cpu_count() or 1)
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                resultados = list(executor.map(_normalizar_worker, tarefas))
+        except Exception:
+            resultados = None
+
+    if resultados is None:
+        resultados = [_normalizar_worker(t) for t in tarefas]
+
+    normalizados = []
+    for nome, ok, erro in resultados:
+        if erro is not None:
             if error_callback:
-                error_callback(nome, str(e))
+                error_callback(nome, erro)
+        elif ok:
+            normalizados.append(nome)
+            if log_callback:
+                log_callback(nome)
     return normalizados